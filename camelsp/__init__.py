@@ -1,3 +1,6 @@
 from .__version__ import __version__
 from .util import nuts, get_full_nuts_mapping, get_metadata
-from .output import Bundesland, Station
\ No newline at end of file
+from .output import Bundesland, Station, iter_stations
+from .summary import get_summary
+from .cube import open_cube, build_cube
+from .events import load_events
\ No newline at end of file
@@ -0,0 +1,38 @@
+import argparse
+
+from .util import OUTPUT_PATH, RELEASE_PATH
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='camelsp', description='Camels data processing helper')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # release
+    release = commands.add_parser('release', help='Package the output tree into per-state archives with a checksum manifest.')
+    release.add_argument('-o', '--output', default=RELEASE_PATH, help='Release folder. Defaults to RELEASE_DIR.')
+    release.add_argument('-b', '--base-path', default=OUTPUT_PATH, help='Output root folder. Defaults to OUTPUT_DIR.')
+    release.add_argument('-s', '--states', nargs='+', default=None, help='Only release these states. Defaults to all.')
+    release.add_argument('-f', '--format', default='zip', choices=['zip', 'tar', 'tar.gz', 'tar.xz'], help='Archive format.')
+    release.add_argument('--no-extras', action='store_true', help="Don't release metadata, reports and scatter plots.")
+    release.add_argument('--force', action='store_true', help='Write all archives, even if unchanged since the last release.')
+    release.add_argument('-e', '--executor', default='process', help="Execution backend: 'serial', 'process' or 'dask'.")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'release':
+        from .release import build_release
+        summary = build_release(
+            release_path=args.output,
+            base_path=args.base_path,
+            states=args.states,
+            fmt=args.format,
+            extras=not args.no_extras,
+            force=args.force,
+            executor=args.executor
+        )
+        print(summary.to_string())
+        return 1 if (summary.status == 'failed').any() else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
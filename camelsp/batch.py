@@ -0,0 +1,194 @@
+from typing import Any, Callable, Dict, List, Tuple, Union
+import os
+import json
+
+import pandas as pd
+
+from .util import OUTPUT_PATH
+from .executor import Executor, TaskResult, get_executor
+
+
+JOURNAL_COLUMNS = ['timestamp', 'job', 'key', 'status', 'attempt', 'duration', 'error', 'n_warnings', 'transient']
+
+# errors that fail again on every attempt, ie. a missing column, a missing input or an existing output
+NON_TRANSIENT_ERRORS = (LookupError, ValueError, TypeError, AttributeError, NotImplementedError, FileExistsError, FileNotFoundError, PermissionError)
+
+
+def is_transient(result: TaskResult) -> bool:
+    """Check if a failed task may succeed on another attempt."""
+    names = set(error.__name__ for error in NON_TRANSIENT_ERRORS)
+    return not any(name in names for name in result.error_types)
+
+
+class Journal():
+    """
+    Append-only checkpoint journal of a batch job. Each finished item is
+    one JSON line in 'metadata/batch/<name>.jsonl' with its status
+    ('done' or 'failed'), the attempt number, duration and error, and
+    if a failed item may succeed on another attempt.
+    Each line is written and flushed as soon as the item is finished, thus
+    a crash only loses the items that were running.
+
+    """
+    def __init__(self, name: str, base_path: str = OUTPUT_PATH):
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the batch job. Re-use the name to resume the job.
+        base_path : str
+            The output root folder.
+        """
+        self.name = name
+
+        # build the path
+        folder = os.path.join(base_path, 'metadata', 'batch')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.path = os.path.join(folder, f"{name}.jsonl")
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Read all journal records."""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                # skip a possibly truncated last line
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def state(self) -> Dict[str, Dict[str, Any]]:
+        """Get the last record of each key, with the total number of attempts."""
+        state = {}
+        for record in self.records():
+            attempts = state[record['key']]['attempts'] + 1 if record['key'] in state else 1
+            state[record['key']] = dict(record, attempts=attempts)
+        return state
+
+    def append(self, result: TaskResult, attempt: int):
+        """Append the result of one item and flush it to disk."""
+        record = dict(
+            timestamp=pd.Timestamp.now().isoformat(),
+            job=self.name,
+            key=result.key,
+            status='done' if result.error is None else 'failed',
+            attempt=attempt,
+            duration=result.duration,
+            error=result.error,
+            n_warnings=len(result.warnings),
+            transient=result.error is not None and is_transient(result)
+        )
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def to_frame(self) -> pd.DataFrame:
+        """All journal records as a DataFrame."""
+        df = pd.DataFrame.from_records(self.records(), columns=JOURNAL_COLUMNS)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        return df
+
+    def touch(self):
+        """Create the journal file, to mark the job as started."""
+        with open(self.path, 'a'):
+            pass
+
+    def clear(self):
+        """Remove the journal, to run all items again."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def run_batch(name: str, func: Callable, keys: List[str], args: List[Tuple] = None, max_attempts: int = 3, base_path: str = OUTPUT_PATH, executor: Union[str, Executor] = None, outputs: List[str] = None) -> pd.DataFrame:
+    """
+    Run func for each key as a resumable batch job. The outcome of each item
+    is recorded in the job's Journal. Items that are already done are
+    skipped, failed items are retried until they used max_attempts
+    attempts, counted over all runs of the job. Errors that fail again on
+    every attempt, see NON_TRANSIENT_ERRORS, are not retried. Thus, after
+    a crash, run the same job again to resume it.
+
+    func should write its outputs atomically, ie. with camelsp.util.atomic_path,
+    so that a file that exists is always complete. If the outputs are
+    given, an item whose output exists is marked as done on resume, as
+    it may have been written right before a crash, but not journaled.
+
+    Parameters
+    ----------
+    name : str
+        Name of the batch job. Re-use the name to resume the job.
+    func : Callable
+        The function to run for each item.
+    keys : list
+        The keys of the items, ie. the camels_ids.
+    args : list, optional
+        The arguments of func for each key. Defaults to (key, ).
+    max_attempts : int
+        Maximum number of attempts per item.
+    base_path : str
+        The output root folder, which holds the journal.
+    executor : str, Executor, dask.distributed.Client, optional
+        Execution backend, see camelsp.executor.get_executor.
+        Defaults to the current process.
+    outputs : list, optional
+        The output file of each key. Only pass them, if an existing
+        output should not be written again by this job.
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        One row per key with the final status ('done', 'failed' or 'pending'),
+        the number of attempts, the duration and error of the last attempt,
+        and if the item was run in this call.
+
+    """
+    keys = [str(key) for key in keys]
+    if args is None:
+        args = [(key, ) for key in keys]
+    arguments = dict(zip(keys, args))
+
+    journal = Journal(name, base_path=base_path)
+    resume = os.path.exists(journal.path)
+    state = journal.state()
+    ran = set()
+
+    # mark outputs written right before a crash as done
+    if resume and outputs is not None:
+        for key, output in zip(keys, outputs):
+            if (key not in state or state[key]['status'] != 'done') and os.path.exists(output):
+                attempt = state[key]['attempts'] + 1 if key in state else 1
+                journal.append(TaskResult(key=key, value=output, error=None, traceback=None, warnings=[], duration=0.0), attempt)
+                state[key] = dict(status='done', attempts=attempt, duration=0.0, error=None)
+    journal.touch()
+
+    # run rounds until everything is done or out of attempts
+    backend = get_executor(executor)
+    try:
+        while True:
+            todo = [key for key in keys if key not in state or (state[key]['status'] != 'done' and state[key].get('transient', True) and state[key]['attempts'] < max_attempts)]
+            if len(todo) == 0:
+                break
+
+            # record each item as soon as it is finished
+            for result in backend.as_completed(func, todo, [arguments[key] for key in todo]):
+                attempt = state[result.key]['attempts'] + 1 if result.key in state else 1
+                journal.append(result, attempt)
+                state[result.key] = dict(status='done' if result.error is None else 'failed', attempts=attempt, duration=result.duration, error=result.error, transient=is_transient(result))
+                ran.add(result.key)
+    finally:
+        if backend is not executor:
+            backend.close()
+
+    return pd.DataFrame({
+        'key': keys,
+        'status': [state[key]['status'] if key in state else 'pending' for key in keys],
+        'attempts': [state[key]['attempts'] if key in state else 0 for key in keys],
+        'duration': [state[key]['duration'] if key in state else None for key in keys],
+        'error': [state[key]['error'] if key in state else None for key in keys],
+        'ran': [key in ran for key in keys],
+    }).set_index('key')
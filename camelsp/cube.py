@@ -0,0 +1,324 @@
+from typing import Dict, List, Tuple, Union
+import os
+import json
+import shutil
+
+import pandas as pd
+import numpy as np
+
+from .util import OUTPUT_PATH, SENTINELS, get_metadata
+from .flags import has_flag_table
+
+
+class Cube():
+    """
+    Memory-mapped, date-aligned (station x day) array of one variable.
+    The values are float32 with NaN for missing data, the flags are int8
+    with 1 (True), 0 (False) and -1 (NA). Use open_cube to open a cube
+    built by build_cube.
+
+    Slicing a station (row) or a date (column) returns a view into the
+    memory-mapped file, no data is read until the values are accessed.
+
+    """
+    def __init__(self, path: str, mode: str = 'r'):
+        """
+        Parameters
+        ----------
+        path : str
+            The cube folder, which contains values.npy, flags.npy and index.json
+        mode : str
+            The numpy memmap mode. Use 'r' (default) for read-only access.
+        """
+        self.path = path
+
+        # load the index
+        with open(os.path.join(path, 'index.json'), 'r') as f:
+            self.index = json.load(f)
+
+        self.variable = self.index['variable']
+        self.camels_ids: List[str] = self.index['camels_ids']
+        self.dates = pd.date_range(self.index['start'], periods=self.index['n_days'], freq='D', name='date')
+
+        # lookup camels_id -> row
+        self.rows: Dict[str, int] = {camels_id: i for i, camels_id in enumerate(self.camels_ids)}
+
+        # open the memory maps
+        self.values: np.memmap = np.load(os.path.join(path, 'values.npy'), mmap_mode=mode)
+        self.flags: np.memmap = np.load(os.path.join(path, 'flags.npy'), mmap_mode=mode)
+
+    def __repr__(self) -> str:
+        return f"<Cube '{self.variable}' {len(self.camels_ids)} stations x {len(self.dates)} days>"
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.values.shape
+
+    def row(self, camels_id: str) -> int:
+        """Get the row number of the station."""
+        return self.rows[camels_id]
+
+    def column(self, date: Union[str, pd.Timestamp]) -> int:
+        """Get the column number of the date."""
+        col = (pd.Timestamp(date) - self.dates[0]).days
+        if col < 0 or col >= len(self.dates):
+            raise IndexError(f"{date} is outside of the cube's date range {self.dates[0].date()} - {self.dates[-1].date()}")
+        return col
+
+    def station(self, camels_id: str) -> np.ndarray:
+        """Get the values of one station as a zero-copy view."""
+        return self.values[self.row(camels_id)]
+
+    def date(self, date: Union[str, pd.Timestamp]) -> np.ndarray:
+        """Get the values of all stations on the given date as a zero-copy view."""
+        return self.values[:, self.column(date)]
+
+    def to_series(self, camels_id: str) -> pd.Series:
+        """Get the values of one station as a pandas.Series, indexed by date."""
+        return pd.Series(self.station(camels_id), index=self.dates, name=self.variable)
+
+
+def _cube_path(variable: str, base_path: str = OUTPUT_PATH) -> str:
+    return os.path.join(base_path, 'cube', variable)
+
+
+def _replace_folder(src: str, dst: str):
+    """
+    Replace the folder dst by src. The old folder is moved aside first,
+    thus dst is either the complete old or the complete new folder and
+    only missing in between the two renames.
+    """
+    old = f'{dst}.old'
+    if os.path.exists(old):
+        shutil.rmtree(old)
+    if os.path.exists(dst):
+        os.rename(dst, old)
+    os.rename(src, dst)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _recover_folder(path: str):
+    """Move the old cube back, if a build stopped in between the two renames of _replace_folder."""
+    old = f'{path}.old'
+    if not os.path.exists(path) and os.path.exists(os.path.join(old, 'index.json')):
+        os.rename(old, path)
+
+
+def _signature(path: str) -> Union[List[int], None]:
+    """Cheap change signature of a data file: modification time and size."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _read_station(path: str, variable: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Read the variable and its flag of one station as day numbers,
+    float32 values and int8 flags. Sentinels are replaced by NaN, if the
+    station has no flag table yet.
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int8))
+    flag_col = f'{variable}_flag'
+    try:
+        df = pd.read_csv(path, usecols=lambda c: c in ('date', variable, flag_col), parse_dates=['date'])
+    except FileNotFoundError:
+        return empty
+    if variable not in df.columns or len(df) == 0:
+        return empty
+
+    # day numbers
+    days = df['date'].values.astype('datetime64[D]').astype(np.int64)
+
+    # values without sentinels, files with flag table were normalized on ingest
+    values = pd.to_numeric(df[variable], errors='coerce').values.astype(np.float32)
+    if not has_flag_table(path):
+        values[np.isin(values, SENTINELS)] = np.nan
+
+    # flags as int8
+    if flag_col in df.columns:
+        flags = df[flag_col].astype('boolean').astype('Int8').fillna(-1).values.astype(np.int8)
+    else:
+        flags = np.full(len(df), -1, dtype=np.int8)
+
+    return days, values, flags
+
+
+def open_cube(variable: str = 'q', base_path: str = OUTPUT_PATH, mode: str = 'r') -> Cube:
+    """
+    Open the memory-mapped (station x day) cube of the given variable.
+    The cube has to be built by build_cube first.
+
+    Parameters
+    ----------
+    variable : str
+        The variable of the cube, ie. 'q' or 'w'.
+    base_path : str
+        The output root folder.
+    mode : str
+        The numpy memmap mode. Use 'r' (default) for read-only access.
+
+    Returns
+    -------
+    cube : Cube
+        The opened cube. cube.values and cube.flags are numpy memmaps.
+
+    """
+    path = _cube_path(variable, base_path)
+    _recover_folder(path)
+    if not os.path.exists(os.path.join(path, 'index.json')):
+        raise FileNotFoundError(f"There is no cube for '{variable}' at {path}. Run camelsp.build_cube('{variable}') first.")
+    return Cube(path, mode=mode)
+
+
+def build_cube(variable: str = 'q', base_path: str = OUTPUT_PATH, force: bool = False) -> str:
+    """
+    Build or update the memory-mapped (station x day) cube of the given
+    variable. The cube holds one row for each station in the metadata and
+    one column for each day between the first and last observation of any
+    station. values.npy (float32) and flags.npy (int8) are stored along
+    with index.json, that maps the camels_id to the row and the date to
+    the column.
+
+    Only stations whose data file changed since the last build are read.
+    If the stations and date range did not change, the rows are updated
+    in place and the index is replaced last, thus an interrupted update
+    re-reads the same stations on the next build. Otherwise, a new cube
+    is written to a temporary folder, unchanged rows are copied over from
+    the old cube and the whole folder is swapped in at the end.
+
+    Parameters
+    ----------
+    variable : str
+        The variable of the cube, ie. 'q' or 'w'.
+    base_path : str
+        The output root folder.
+    force : bool
+        If True, the cube is rebuilt from all data files.
+
+    Returns
+    -------
+    path : str
+        The cube folder
+
+    """
+    path = _cube_path(variable, base_path)
+    _recover_folder(path)
+
+    # get all stations from the metadata
+    meta = get_metadata(base_path=base_path)
+    camels_ids = meta.camels_id.astype(str).tolist()
+    paths = {camels_id: os.path.join(base_path, camels_id[:3], camels_id, f'{camels_id}_data.csv') for camels_id in camels_ids}
+    signatures = {camels_id: _signature(p) for camels_id, p in paths.items()}
+
+    # load the old cube
+    old = None
+    if not force and os.path.exists(os.path.join(path, 'index.json')):
+        old = Cube(path, mode='r')
+    old_signatures = old.index['signatures'] if old is not None else {}
+    old_extents = old.index['extents'] if old is not None else {}
+
+    # find the stations that need to be read
+    changed = [camels_id for camels_id in camels_ids if camels_id not in old_signatures or old_signatures[camels_id] != signatures[camels_id]]
+
+    # nothing to do
+    if old is not None and len(changed) == 0 and old.camels_ids == camels_ids:
+        return path
+
+    # read the changed stations
+    data = {camels_id: _read_station(paths[camels_id], variable) for camels_id in changed}
+
+    # get the extents of all stations as first and last day number
+    extents = {}
+    for camels_id in camels_ids:
+        if camels_id in data:
+            days = data[camels_id][0]
+            extents[camels_id] = [int(days.min()), int(days.max())] if days.size > 0 else None
+        else:
+            extents[camels_id] = old_extents.get(camels_id)
+    valid_extents = [e for e in extents.values() if e is not None]
+    first = min([e[0] for e in valid_extents]) if len(valid_extents) > 0 else 0
+    last = max([e[1] for e in valid_extents]) if len(valid_extents) > 0 else -1
+
+    # check if the old cube can be updated in place
+    if old is not None:
+        old_first = int(np.datetime64(old.index['start'], 'D').astype(np.int64))
+        old_last = old_first + len(old.dates) - 1
+        inplace = old.camels_ids == camels_ids and first >= old_first and last <= old_last
+    else:
+        old_first = 0
+        inplace = False
+
+    if inplace:
+        # re-open writeable and update only the changed rows
+        del old
+        cube = Cube(path, mode='r+')
+        first = old_first
+        for camels_id in changed:
+            _fill_row(cube, cube.rows[camels_id], first, *data[camels_id])
+        cube.values.flush()
+        cube.flags.flush()
+        index = cube.index
+        del cube
+    else:
+        # create a new cube in a temporary folder next to the old one
+        tmp_path = f'{path}.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        n_days = last - first + 1
+        values = np.lib.format.open_memmap(os.path.join(tmp_path, 'values.npy'), mode='w+', dtype=np.float32, shape=(len(camels_ids), n_days))
+        flags = np.lib.format.open_memmap(os.path.join(tmp_path, 'flags.npy'), mode='w+', dtype=np.int8, shape=(len(camels_ids), n_days))
+
+        for row, camels_id in enumerate(camels_ids):
+            if camels_id in data:
+                _fill_row((values, flags), row, first, *data[camels_id])
+            else:
+                # copy the row from the old cube
+                values[row] = np.nan
+                flags[row] = -1
+                ext = extents[camels_id]
+                if ext is None:
+                    continue
+                old_row = old.rows[camels_id]
+                src = slice(ext[0] - old_first, ext[1] - old_first + 1)
+                dst = slice(ext[0] - first, ext[1] - first + 1)
+                values[row, dst] = old.values[old_row, src]
+                flags[row, dst] = old.flags[old_row, src]
+
+        values.flush()
+        flags.flush()
+        del values, flags, old
+        index = dict(variable=variable, start=str(np.datetime64(first, 'D')), n_days=int(n_days), camels_ids=camels_ids)
+
+    # update the index
+    index['signatures'] = signatures
+    index['extents'] = extents
+    if inplace:
+        with open(os.path.join(path, 'index.json.tmp'), 'w') as f:
+            json.dump(index, f)
+        os.replace(os.path.join(path, 'index.json.tmp'), os.path.join(path, 'index.json'))
+    else:
+        # the index is written last, then the complete cube is swapped in
+        with open(os.path.join(tmp_path, 'index.json'), 'w') as f:
+            json.dump(index, f)
+        _replace_folder(tmp_path, path)
+
+    return path
+
+
+def _fill_row(cube: Union[Cube, Tuple[np.ndarray, np.ndarray]], row: int, first: int, days: np.ndarray, values: np.ndarray, flags: np.ndarray):
+    """Overwrite one row of the cube with the data of a station."""
+    if isinstance(cube, Cube):
+        cube_values, cube_flags = cube.values, cube.flags
+    else:
+        cube_values, cube_flags = cube
+
+    # reset the row
+    cube_values[row] = np.nan
+    cube_flags[row] = -1
+
+    # fill
+    cube_values[row, days - first] = values
+    cube_flags[row, days - first] = flags
@@ -0,0 +1,393 @@
+from typing import Dict, List, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import os
+import warnings
+
+import pandas as pd
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from rasterio.features import shapes
+import shapely
+import geopandas as gpd
+
+from .util import get_metadata, get_output_path
+from .output import Station
+
+
+# ESRI D8 flow direction encoding, as used by MERIT Hydro: code -> (row offset, col offset)
+D8 = {
+    1: (0, 1),
+    2: (1, 1),
+    4: (1, 0),
+    8: (1, -1),
+    16: (0, -1),
+    32: (-1, -1),
+    64: (-1, 0),
+    128: (-1, 1),
+}
+
+
+class TileReader():
+    """
+    Read windows of a large raster through an LRU cache of fixed-size
+    tiles. Neighboring outlets share most of their tiles, thus the raster
+    is read only once per tile as long as it stays in the cache.
+    Parts of a window outside of the raster are filled with fill_value.
+
+    """
+    def __init__(self, path: str, tile_size: int = 1024, cache_size: int = 64, fill_value: Union[int, float] = 0):
+        """
+        Parameters
+        ----------
+        path : str
+            Path to the raster. Use a VRT to combine several tiles.
+        tile_size : int
+            Edge length of the cached tiles in cells.
+        cache_size : int
+            Maximum number of tiles kept in memory.
+        fill_value : int, float
+            Value used outside of the raster.
+        """
+        self.path = path
+        self.src = rasterio.open(path)
+        self.transform = self.src.transform
+        self.crs = self.src.crs
+        self.height, self.width = self.src.height, self.src.width
+        self.dtype = self.src.dtypes[0]
+        self.tile_size = tile_size
+        self.fill_value = fill_value
+
+        # instance-level cache
+        self.tile = lru_cache(maxsize=cache_size)(self._read_tile)
+
+    def _read_tile(self, tile_row: int, tile_col: int) -> np.ndarray:
+        row, col = tile_row * self.tile_size, tile_col * self.tile_size
+        window = Window(col, row, min(self.tile_size, self.width - col), min(self.tile_size, self.height - row))
+        return self.src.read(1, window=window)
+
+    def index(self, lon: float, lat: float) -> Tuple[int, int]:
+        """Get the row and column of the cell containing the coordinate."""
+        row, col = rasterio.transform.rowcol(self.transform, lon, lat)
+        return int(row), int(col)
+
+    def read(self, row: int, col: int, height: int, width: int) -> np.ndarray:
+        """Read the window starting at (row, col) from the cached tiles."""
+        out = np.full((height, width), self.fill_value, dtype=self.dtype)
+
+        # clip to the raster
+        r0, r1 = max(row, 0), min(row + height, self.height)
+        c0, c1 = max(col, 0), min(col + width, self.width)
+        if r0 >= r1 or c0 >= c1:
+            return out
+
+        ts = self.tile_size
+        for tile_row in range(r0 // ts, (r1 - 1) // ts + 1):
+            for tile_col in range(c0 // ts, (c1 - 1) // ts + 1):
+                tile = self.tile(tile_row, tile_col)
+
+                # overlap of the tile and the window in raster coordinates
+                tr0, tc0 = tile_row * ts, tile_col * ts
+                a0, a1 = max(r0, tr0), min(r1, tr0 + tile.shape[0])
+                b0, b1 = max(c0, tc0), min(c1, tc0 + tile.shape[1])
+                out[a0 - row:a1 - row, b0 - col:b1 - col] = tile[a0 - tr0:a1 - tr0, b0 - tc0:b1 - tc0]
+
+        return out
+
+    def window_transform(self, row: int, col: int) -> rasterio.Affine:
+        return self.transform * rasterio.Affine.translation(col, row)
+
+    def close(self):
+        self.tile.cache_clear()
+        self.src.close()
+
+
+def upstream_mask(fdir: np.ndarray, row: int, col: int) -> np.ndarray:
+    """
+    Trace all cells upstream of (row, col) in a D8 flow direction array.
+    The trace is a breadth-first search, which processes the whole frontier
+    of cells at once for each of the eight directions.
+
+    Parameters
+    ----------
+    fdir : numpy.ndarray
+        D8 flow direction array (ESRI encoding)
+    row, col : int
+        The outlet cell
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        Boolean array, True for all cells draining to the outlet.
+
+    """
+    height, width = fdir.shape
+    mask = np.zeros(fdir.shape, dtype=bool)
+    mask[row, col] = True
+    frontier_r, frontier_c = np.array([row]), np.array([col])
+
+    while frontier_r.size > 0:
+        new_r, new_c = [], []
+        for code, (dr, dc) in D8.items():
+            # the neighbor that drains into the frontier cell using this direction
+            nr, nc = frontier_r - dr, frontier_c - dc
+            inside = (nr >= 0) & (nr < height) & (nc >= 0) & (nc < width)
+            nr, nc = nr[inside], nc[inside]
+            sel = (fdir[nr, nc] == code) & ~mask[nr, nc]
+            new_r.append(nr[sel])
+            new_c.append(nc[sel])
+
+        frontier_r, frontier_c = np.concatenate(new_r), np.concatenate(new_c)
+        mask[frontier_r, frontier_c] = True
+
+    return mask
+
+
+def snap_outlet(upa: np.ndarray, row: int, col: int, area: float = None, area_tolerance: float = 0.2, distance_weight: float = 0.5) -> Tuple[int, int]:
+    """
+    Snap the outlet to the best cell in the window. Each cell is scored by
+    its area error plus its distance to the reported outlet (row, col),
+    relative to the window radius and weighted by distance_weight. The 
+    cell with the lowest score wins.
+    If the reported catchment area is known, the area error is the relative
+    difference to the area, and only cells with an upstream area of at most
+    (1 + area_tolerance) * area are considered, so that the outlet does not
+    jump onto a larger, nearby river. If no cell qualifies, all cells are
+    considered. Without area, the area error is the difference to the
+    highest upstream area of the window, relative to it.
+
+    Parameters
+    ----------
+    upa : numpy.ndarray
+        Upstream area window in km²
+    row, col : int
+        The cell of the reported outlet in the window
+    area : float, optional
+        The reported catchment area in km²
+    area_tolerance : float
+        Accepted relative overestimation of the reported area.
+    distance_weight : float
+        Weight of the distance to the reported outlet. A cell at the edge
+        of the window needs an area error lower by this value to win over
+        the reported cell.
+
+    Returns
+    -------
+    row, col : int
+        The snapped outlet cell in the window
+
+    """
+    upa = np.where(np.isfinite(upa) & (upa > 0), upa, 0.0)
+    candidates = upa > 0
+    if not candidates.any():
+        return row, col
+
+    # distance to the reported outlet, relative to the window radius
+    rows, cols = np.indices(upa.shape)
+    radius = max(max(upa.shape) - 1, 2) / 2
+    distance = np.hypot(rows - row, cols - col) / radius
+
+    if area is None or not np.isfinite(area) or area <= 0:
+        error = 1 - upa / upa.max()
+    else:
+        error = np.abs(upa - area) / area
+        below = candidates & (upa <= area * (1 + area_tolerance))
+        if below.any():
+            candidates = below
+
+    score = np.where(candidates, error + distance_weight * distance, np.inf)
+    return np.unravel_index(np.argmin(score), upa.shape)
+
+
+# readers of the worker process, set once by the pool initializer
+_WORKER_READERS: Dict[str, TileReader] = {}
+
+
+def _init_worker(dir_path: str, upa_path: str, tile_size: int, cache_size: int):
+    _WORKER_READERS['dir'] = TileReader(dir_path, tile_size=tile_size, cache_size=cache_size, fill_value=0)
+    _WORKER_READERS['upa'] = TileReader(upa_path, tile_size=tile_size, cache_size=cache_size, fill_value=0)
+
+
+def delineate_outlet(fdir: TileReader, upa: TileReader, lon: float, lat: float, area: float = None, search_radius: int = 5, area_tolerance: float = 0.2, max_size: int = 16384) -> dict:
+    """
+    Delineate the catchment of one outlet.
+
+    Parameters
+    ----------
+    fdir, upa : TileReader
+        Readers for the flow direction and upstream area rasters.
+    lon, lat : float
+        The reported outlet location in the CRS of the rasters.
+    area : float, optional
+        The reported catchment area in km²
+    search_radius : int
+        Radius of the snapping window in cells.
+    area_tolerance : float
+        Accepted relative overestimation of the reported area while snapping.
+    max_size : int
+        Maximum edge length of the tracing window in cells.
+
+    Returns
+    -------
+    result : dict
+        The snapped outlet, its upstream area and the catchment geometry.
+
+    """
+    # snap the outlet
+    row, col = fdir.index(lon, lat)
+    r0, c0 = row - search_radius, col - search_radius
+    upa_window = upa.read(r0, c0, 2 * search_radius + 1, 2 * search_radius + 1).astype(float)
+    sr, sc = snap_outlet(upa_window, search_radius, search_radius, area=area, area_tolerance=area_tolerance)
+    row, col = int(r0 + sr), int(c0 + sc)
+    outlet_upa = float(upa_window[sr, sc])
+    if not np.isfinite(outlet_upa) or outlet_upa <= 0:
+        raise ValueError(f"There is no upstream area near {lon}, {lat}. The outlet is probably outside of the raster.")
+
+    # estimate the window size from the upstream area
+    res_x, res_y = abs(fdir.transform.a), abs(fdir.transform.e)
+    if fdir.crs is not None and fdir.crs.is_geographic:
+        lat_snapped = fdir.transform.f + (row + 0.5) * fdir.transform.e
+        cell_area = res_x * 111.32 * np.cos(np.radians(lat_snapped)) * res_y * 110.57
+    else:
+        cell_area = res_x * res_y / 1e6
+    half = int(max(64, 2 * np.sqrt(max(outlet_upa, 1e-6) / cell_area)))
+
+    # trace upstream and enlarge the window until the catchment fits
+    while True:
+        size = 2 * half + 1
+        wr, wc = row - half, col - half
+        window = fdir.read(wr, wc, size, size)
+        mask = upstream_mask(window, half, half)
+
+        touches = mask[0, :].any() or mask[-1, :].any() or mask[:, 0].any() or mask[:, -1].any()
+        if not touches or size >= max_size:
+            break
+        half *= 2
+
+    if touches:
+        warnings.warn(f"The catchment at {lon}, {lat} exceeds the maximum window size of {max_size} cells and is truncated.")
+
+    # polygonize the mask
+    geoms = [shapely.geometry.shape(geom) for geom, _ in shapes(mask.astype(np.uint8), mask=mask, transform=fdir.window_transform(wr, wc))]
+    geometry = shapely.union_all(geoms)
+
+    # snapped outlet location
+    x, y = rasterio.transform.xy(fdir.transform, row, col)
+
+    return dict(
+        outlet_lon=float(x),
+        outlet_lat=float(y),
+        upa=outlet_upa,
+        area_error=(outlet_upa - area) / area if area is not None and np.isfinite(area) and area > 0 else np.nan,
+        n_cells=int(mask.sum()),
+        truncated=bool(touches),
+        geometry=shapely.to_wkb(geometry)
+    )
+
+
+def _delineate_task(camels_id: str, lon: float, lat: float, area: float, search_radius: int, area_tolerance: float, max_size: int) -> dict:
+    """Delineate one outlet in a worker process. Errors are returned, not raised."""
+    try:
+        result = delineate_outlet(_WORKER_READERS['dir'], _WORKER_READERS['upa'], lon, lat, area=area, search_radius=search_radius, area_tolerance=area_tolerance, max_size=max_size)
+        result['error'] = None
+    except Exception as e:
+        result = dict(error=f"{type(e).__name__}: {e}")
+    result['camels_id'] = camels_id
+    return result
+
+
+def _catchment_path(camels_id: str, datasource: str = 'merit_hydro') -> str:
+    """The path of a catchment geometry, see Station.save_catchment_geometry."""
+    return os.path.abspath(os.path.join(get_output_path(camels_id[:3]), camels_id, f"{camels_id}_{datasource}_catchment.geojson"))
+
+
+def delineate_catchments(dir_path: str, upa_path: str, camels_ids: List[str] = None, search_radius: int = 5, area_tolerance: float = 0.2, max_size: int = 16384, tile_size: int = 1024, cache_size: int = 64, max_workers: int = None, if_exists: str = 'skip', save: bool = True) -> pd.DataFrame:
+    """
+    Delineate the MERIT Hydro catchments for all stations from local flow
+    direction and upstream area rasters. Each outlet from the metadata
+    (lon, lat) is snapped to the highest upstream area cell near the gauge,
+    informed by the reported 'area'. Then all upstream cells are traced
+    on windows read through an LRU tile cache. The outlets are processed
+    in parallel, the geometries are saved with Station.save_catchment_geometry.
+
+    Parameters
+    ----------
+    dir_path : str
+        Path to the MERIT Hydro flow direction raster. Use a VRT to
+        combine several MERIT Hydro tiles.
+    upa_path : str
+        Path to the MERIT Hydro upstream area raster (km²).
+    camels_ids : list, optional
+        The stations to delineate. Defaults to all stations with location.
+    search_radius : int
+        Radius of the snapping window in cells.
+    area_tolerance : float
+        Accepted relative overestimation of the reported area while snapping.
+    max_size : int
+        Maximum edge length of the tracing window in cells.
+    tile_size : int
+        Edge length of the cached tiles in cells.
+    cache_size : int
+        Maximum number of cached tiles per worker and raster.
+    max_workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    if_exists : str
+        The policy to handle existing geometries. Can be 'skip' (default),
+        'raise' or 'replace'. Existing geometries are checked before 
+        delineating: 'skip' leaves these stations out, 'raise' fails
+        before any work is done.
+    save : bool
+        If False, the geometries are only returned.
+
+    Returns
+    -------
+    result : geopandas.GeoDataFrame
+        One row per station with the snapped outlet, upstream area,
+        relative area error, possible errors and the catchment geometry.
+        Stations that could not be saved have an error as well.
+
+    """
+    if if_exists not in ('skip', 'raise', 'replace'):
+        raise ValueError(f"if_exists must be either 'skip', 'raise' or 'replace', but is {if_exists}")
+
+    # get the outlets
+    meta = get_metadata()
+    meta = meta.dropna(subset=['lon', 'lat'])
+    if camels_ids is not None:
+        meta = meta[meta.camels_id.isin(camels_ids)]
+    if 'area' not in meta.columns:
+        meta = meta.assign(area=np.nan)
+
+    # handle existing geometries before the expensive delineation
+    if save and if_exists != 'replace':
+        existing = [c for c in meta.camels_id if os.path.exists(_catchment_path(c))]
+        if len(existing) > 0 and if_exists == 'raise':
+            raise FileExistsError(f"The merit_hydro catchments of {', '.join(existing)} already exist and if_exists policy is 'raise'")
+        elif len(existing) > 0:
+            warnings.warn(f"Skipping {len(existing)} stations with existing merit_hydro catchments.")
+            meta = meta[~meta.camels_id.isin(existing)]
+
+    tasks = [(c, lon, lat, a, search_radius, area_tolerance, max_size) for c, lon, lat, a in zip(meta.camels_id, meta.lon, meta.lat, meta.area.astype(float))]
+
+    # process in parallel
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(dir_path, upa_path, tile_size, cache_size)) as executor:
+        results = list(executor.map(_delineate_task, *zip(*tasks))) if len(tasks) > 0 else []
+
+    # build the result
+    df = pd.DataFrame.from_records(results, columns=['camels_id', 'outlet_lon', 'outlet_lat', 'upa', 'area_error', 'n_cells', 'truncated', 'error', 'geometry'])
+    with rasterio.open(dir_path) as src:
+        crs = src.crs
+    geometry = [shapely.from_wkb(g) if isinstance(g, bytes) else None for g in df.geometry]
+    result = gpd.GeoDataFrame(df.drop(columns='geometry'), geometry=geometry, crs=crs)
+
+    # save all catchments, keep going if one can't be saved
+    if save:
+        for i in np.flatnonzero(result.error.isna().values):
+            row = result.iloc[[i]]
+            try:
+                Station(row.camels_id.values[0]).save_catchment_geometry(row[['camels_id', 'upa', 'geometry']], 'merit_hydro', if_exists='replace' if if_exists == 'replace' else 'raise')
+            except Exception as e:
+                result.loc[result.index[i], 'error'] = f"{type(e).__name__}: {e}"
+
+    return result
@@ -0,0 +1,203 @@
+from __future__ import annotations
+from typing import Union, List, Dict
+from types import TracebackType
+from contextlib import AbstractContextManager, contextmanager
+import os
+import glob
+import json
+import time
+import warnings
+
+import pandas as pd
+
+from .util import OUTPUT_PATH, nuts
+
+
+EVENT_COLUMNS = ['timestamp', 'nuts_lvl2', 'run', 'provider_id', 'warning_type', 'message', 'context', 'duration', 'category']
+
+
+def parse_warning_message(message: str) -> Dict[str, Union[str, None]]:
+    """
+    Parse a warning message in the ';'-separated format used throughout
+    the processing scripts: 'provider_id;warning_type;message;additional_context'.
+    Messages with less fields are returned as plain message.
+    """
+    parts = str(message).split(';', 3)
+    if len(parts) < 3:
+        return dict(provider_id=None, warning_type=None, message=str(message), context=None)
+    return dict(
+        provider_id=parts[0].strip() or None,
+        warning_type=parts[1].strip() or None,
+        message=parts[2].strip(),
+        context=parts[3].strip() if len(parts) == 4 else None
+    )
+
+
+class EventLog(AbstractContextManager):
+    """
+    Append-only, structured event sink for one processing run of a federal
+    state. Each event is one JSON line in
+    'metadata/events/<NUTS>_<run>.jsonl'. Events are buffered and written
+    whenever the buffer is full, the flush interval passed, or the log is
+    closed. Thus, a crash only loses the events of the last interval.
+
+    Use load_events to load the events of all states into a DataFrame.
+
+    """
+    def __init__(self, bl: str, run: str = None, base_path: str = OUTPUT_PATH, buffer_size: int = 100, flush_interval: float = 5.0):
+        """
+        Parameters
+        ----------
+        bl : str
+            The Bundesland. Anything, that camelsp.nuts understands.
+        run : str, optional
+            Name of the processing run. Defaults to the current timestamp.
+        base_path : str
+            The output root folder.
+        buffer_size : int
+            Number of buffered events, that trigger a write.
+        flush_interval : float
+            Maximum number of seconds between two writes.
+        """
+        self.NUTS = nuts(bl)
+        self.run = run if run is not None else time.strftime('%Y%m%dT%H%M%S')
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        # build the path
+        folder = os.path.join(base_path, 'metadata', 'events')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.path = os.path.join(folder, f"{self.NUTS}_{self.run}.jsonl")
+
+        # buffer
+        self._buffer: List[str] = []
+        self._last_flush = time.monotonic()
+
+    def __enter__(self) -> 'EventLog':
+        return super().__enter__()
+
+    def __exit__(self, __exc_type: type[BaseException] | None, __exc_value: BaseException | None, __traceback: TracebackType | None) -> bool | None:
+        # log the exception that ended the run, if any
+        if __exc_type is not None:
+            self.log(warning_type=__exc_type.__name__, message=str(__exc_value), context='run aborted')
+        self.close()
+        return super().__exit__(__exc_type, __exc_value, __traceback)
+
+    def log(self, provider_id: str = None, warning_type: str = None, message: str = '', context: str = None, duration: float = None, category: str = None):
+        """
+        Add an event to the log.
+
+        Parameters
+        ----------
+        provider_id : str, optional
+            The id of the station the event refers to. Can be the provider
+            id or the CAMELS-DE id.
+        warning_type : str, optional
+            Short, machine-readable type of the event, ie. 'EmptyFile'.
+        message : str
+            The human-readable message.
+        context : str, optional
+            Any additional context.
+        duration : float, optional
+            Duration in seconds, if the event is a timing.
+        category : str, optional
+            The warning category, if the event was captured from a warning.
+        """
+        event = dict(
+            timestamp=pd.Timestamp.now().isoformat(),
+            nuts_lvl2=self.NUTS,
+            run=self.run,
+            provider_id=None if provider_id is None else str(provider_id),
+            warning_type=warning_type,
+            message=str(message),
+            context=None if context is None else str(context),
+            duration=duration,
+            category=category
+        )
+        self._buffer.append(json.dumps(event))
+
+        # write if needed
+        if len(self._buffer) >= self.buffer_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def log_warning(self, warning: warnings.WarningMessage):
+        """Add a captured warning to the log. The ';'-separated message format is parsed."""
+        parsed = parse_warning_message(warning.message.args[0] if len(warning.message.args) > 0 else warning.message)
+        if parsed['warning_type'] is None:
+            parsed['warning_type'] = warning.category.__name__
+        self.log(category=warning.category.__name__, **parsed)
+
+    @contextmanager
+    def capture(self):
+        """
+        Context manager, that writes all warnings issued within the context
+        to the log, as they occur.
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('always')
+
+            def _showwarning(message, category, filename, lineno, file=None, line=None):
+                self.log_warning(warnings.WarningMessage(message, category, filename, lineno, file, line))
+
+            warnings.showwarning = _showwarning
+            yield self
+
+    @contextmanager
+    def timed(self, provider_id: str = None, warning_type: str = 'timing', message: str = '', context: str = None):
+        """
+        Context manager, that logs the duration of the wrapped block.
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.log(provider_id=provider_id, warning_type=warning_type, message=message, context=context, duration=time.perf_counter() - start)
+
+    def flush(self):
+        """Write all buffered events to the log file."""
+        if len(self._buffer) > 0:
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(self._buffer) + '\n')
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+
+
+def load_events(base_path: str = OUTPUT_PATH, bl: str = None, run: str = None) -> pd.DataFrame:
+    """
+    Load the events of all states and runs into one DataFrame.
+
+    Parameters
+    ----------
+    base_path : str
+        The output root folder.
+    bl : str, optional
+        If given, only the events of this Bundesland are loaded.
+    run : str, optional
+        If given, only the events of this run are loaded.
+
+    Returns
+    -------
+    events : pandas.DataFrame
+        One row per event.
+
+    """
+    pattern = f"{nuts(bl) if bl is not None else '*'}_{run if run is not None else '*'}.jsonl"
+    fnames = sorted(glob.glob(os.path.join(base_path, 'metadata', 'events', pattern)))
+
+    records = []
+    for fname in fnames:
+        with open(fname, 'r') as f:
+            for line in f:
+                # skip a possibly truncated last line
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+
+    df = pd.DataFrame.from_records(records, columns=EVENT_COLUMNS)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df
@@ -0,0 +1,226 @@
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+import warnings
+import traceback
+
+import pandas as pd
+
+
+class TaskResult(NamedTuple):
+    """The outcome of one task, ie. one station."""
+    key: str
+    value: Any
+    error: Union[str, None]
+    traceback: Union[str, None]
+    warnings: List[str]
+    duration: float
+    warning_records: Tuple[Tuple[type, str, str, int], ...] = ()
+    # class names of the exception and its bases, names are picklable from any worker
+    error_types: Tuple[str, ...] = ()
+
+
+def run_task(func: Callable, key: str, args: Tuple) -> TaskResult:
+    """
+    Run func(*args) and wrap the outcome into a TaskResult. Exceptions and
+    warnings are recorded instead of raised, so that one failing station
+    does not stop the whole run. This function is executed on the worker.
+    The backends issue the recorded warnings again in the calling process,
+    see emit_warnings.
+    """
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter('always')
+        try:
+            value = func(*args)
+            error, tb, error_types = None, None, ()
+        except Exception as e:
+            value = None
+            error, tb = f"{type(e).__name__}: {e}", traceback.format_exc()
+            error_types = tuple(cls.__name__ for cls in type(e).__mro__)
+
+    return TaskResult(
+        key=str(key),
+        value=value,
+        error=error,
+        traceback=tb,
+        warnings=[str(w.message) for w in warns],
+        duration=time.perf_counter() - start,
+        warning_records=tuple((w.category, str(w.message), w.filename, w.lineno) for w in warns),
+        error_types=error_types
+    )
+
+
+def emit_warnings(result: TaskResult) -> TaskResult:
+    """
+    Issue the warnings recorded by run_task again in the calling process.
+    Thus, they pass the caller's warning filters and reach EventLog.capture,
+    no matter on which worker the task ran.
+    """
+    for category, message, filename, lineno in result.warning_records:
+        warnings.warn_explicit(message, category, filename, lineno)
+    return result
+
+
+class Executor():
+    """
+    Base class of all execution backends. The default implementation
+    runs all tasks one after another in the current process.
+    """
+    name = 'serial'
+
+    def map(self, func: Callable, keys: Iterable[str], args: Iterable[Tuple]) -> List[TaskResult]:
+        """
+        Run func(*arg) for each arg. keys identify the tasks, ie. the
+        camels_id. The results are returned in the order of keys.
+        """
+        return [emit_warnings(run_task(func, key, arg)) for key, arg in zip(keys, args)]
+
+    def as_completed(self, func: Callable, keys: Iterable[str], args: Iterable[Tuple]) -> Iterator[TaskResult]:
+        """
+        Run func(*arg) for each arg and yield the results as soon as
+        they are finished, in any order.
+        """
+        for key, arg in zip(keys, args):
+            yield emit_warnings(run_task(func, key, arg))
+
+    def close(self):
+        pass
+
+
+class SerialExecutor(Executor):
+    """Run all tasks in the current process."""
+    name = 'serial'
+
+
+class ProcessExecutor(Executor):
+    """Run the tasks on a local process pool."""
+    name = 'process'
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers
+
+    def map(self, func: Callable, keys: Iterable[str], args: Iterable[Tuple]) -> List[TaskResult]:
+        keys, args = list(keys), list(args)
+        if len(keys) == 0:
+            return []
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            return [emit_warnings(result) for result in pool.map(run_task, [func] * len(keys), keys, args)]
+
+    def as_completed(self, func: Callable, keys: Iterable[str], args: Iterable[Tuple]) -> Iterator[TaskResult]:
+        keys, args = list(keys), list(args)
+        if len(keys) == 0:
+            return
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(run_task, func, key, arg) for key, arg in zip(keys, args)]
+            for future in as_completed(futures):
+                yield emit_warnings(future.result())
+
+
+class DaskExecutor(Executor):
+    """
+    Run the tasks on a dask.distributed cluster. Pass a Client, the address
+    of a scheduler, or nothing to start a LocalCluster.
+    """
+    name = 'dask'
+
+    def __init__(self, client: Any = None):
+        # dask.distributed is only needed for this backend
+        from dask.distributed import Client
+
+        if client is None:
+            self.client = Client()
+            self._owns_client = True
+        elif isinstance(client, str):
+            self.client = Client(client)
+            self._owns_client = True
+        else:
+            self.client = client
+            self._owns_client = False
+
+    def map(self, func: Callable, keys: Iterable[str], args: Iterable[Tuple]) -> List[TaskResult]:
+        keys, args = list(keys), list(args)
+        if len(keys) == 0:
+            return []
+        futures = self.client.map(run_task, [func] * len(keys), keys, args, pure=False)
+        return [emit_warnings(result) for result in self.client.gather(futures)]
+
+    def as_completed(self, func: Callable, keys: Iterable[str], args: Iterable[Tuple]) -> Iterator[TaskResult]:
+        from dask.distributed import as_completed as dask_as_completed
+
+        keys, args = list(keys), list(args)
+        if len(keys) == 0:
+            return
+        futures = self.client.map(run_task, [func] * len(keys), keys, args, pure=False)
+        for future in dask_as_completed(futures):
+            yield emit_warnings(future.result())
+
+    def close(self):
+        if self._owns_client:
+            self.client.close()
+
+
+def get_executor(executor: Union[str, Executor, Any] = None, **kwargs) -> Executor:
+    """
+    Get an execution backend.
+
+    Parameters
+    ----------
+    executor : str, Executor, dask.distributed.Client
+        None or 'serial' for the current process, 'process' for a local
+        process pool, 'dask' for a new dask LocalCluster. A dask Client or
+        an Executor instance is used as is.
+    kwargs
+        Passed to the backend, ie. max_workers for 'process'.
+
+    Returns
+    -------
+    executor : Executor
+    """
+    if executor is None:
+        return SerialExecutor()
+    elif isinstance(executor, Executor):
+        return executor
+    elif isinstance(executor, str):
+        if executor.lower() == 'serial':
+            return SerialExecutor()
+        elif executor.lower() in ('process', 'processes'):
+            return ProcessExecutor(**kwargs)
+        elif executor.lower() in ('dask', 'distributed'):
+            return DaskExecutor(**kwargs)
+        else:
+            raise ValueError(f"executor must be 'serial', 'process', 'dask', a dask Client or an Executor, but is {executor}")
+    elif type(executor).__name__ == 'Client':
+        return DaskExecutor(client=executor)
+    else:
+        raise ValueError(f"executor must be 'serial', 'process', 'dask', a dask Client or an Executor, but is {executor}")
+
+
+def run(func: Callable, keys: Iterable[str], args: Iterable[Tuple], executor: Union[str, Executor, Any] = None) -> List[TaskResult]:
+    """
+    Run func(*arg) for each arg on the given execution backend.
+    Backends created here are closed afterwards.
+    """
+    backend = get_executor(executor)
+    try:
+        return backend.map(func, keys, args)
+    finally:
+        if backend is not executor:
+            backend.close()
+
+
+def summarize(results: List[TaskResult]) -> pd.DataFrame:
+    """
+    Gather the task results into one summary DataFrame, indexed by key,
+    with the status ('ok' or 'failed'), error message, number of warnings
+    and duration of each task.
+    """
+    df = pd.DataFrame({
+        'key': [r.key for r in results],
+        'status': ['ok' if r.error is None else 'failed' for r in results],
+        'error': [r.error for r in results],
+        'n_warnings': [len(r.warnings) for r in results],
+        'warnings': [r.warnings for r in results],
+        'duration': [r.duration for r in results],
+    })
+    return df.set_index('key')
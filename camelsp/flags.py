@@ -0,0 +1,268 @@
+from typing import Dict
+import os
+
+import pandas as pd
+import numpy as np
+
+from .util import SENTINELS
+
+
+# quality codes are bitmasks, one bit per condition
+SENTINEL = 1        # the provider used a sentinel value, it is stored as NaN
+MISSING = 2         # there is no value
+UNCHECKED = 4       # the provider flag is False
+NO_FLAG = 8         # the provider did not give a flag
+
+FLAG_CODES = {'sentinel': SENTINEL, 'missing': MISSING, 'unchecked': UNCHECKED, 'no_flag': NO_FLAG}
+
+FLAG_TABLE_COLUMNS = ['variable', 'start', 'end', 'code']
+
+
+def empty_flags() -> pd.DataFrame:
+    """An empty flag table, with the same dtypes as a filled one."""
+    return pd.DataFrame({
+        'variable': pd.Series([], dtype=object),
+        'start': pd.Series([], dtype='datetime64[ns]'),
+        'end': pd.Series([], dtype='datetime64[ns]'),
+        'code': pd.Series([], dtype=np.uint8)
+    }, columns=FLAG_TABLE_COLUMNS)
+
+
+def normalize_sentinels(values: np.ndarray) -> np.ndarray:
+    """
+    Replace the sentinel values by NaN, in place. Returns the mask of the
+    replaced positions.
+    """
+    mask = np.isin(values, SENTINELS)
+    values[mask] = np.nan
+    return mask
+
+
+def flag_codes(values: np.ndarray, flags: np.ndarray = None, sentinels: np.ndarray = None) -> np.ndarray:
+    """
+    Calculate the quality code of each value.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values, with NaN for missing values.
+    flags : numpy.ndarray, optional
+        The provider flags as nullable booleans, ie. a pandas 'boolean' array.
+        If not given, no flag bits are set.
+    sentinels : numpy.ndarray, optional
+        Mask of the values, that were sentinels.
+
+    Returns
+    -------
+    codes : numpy.ndarray
+        uint8 bitmask of SENTINEL, MISSING, UNCHECKED and NO_FLAG.
+
+    """
+    codes = np.where(np.isnan(values), MISSING, 0).astype(np.uint8)
+    if sentinels is not None:
+        codes |= np.where(sentinels, SENTINEL, 0).astype(np.uint8)
+    if flags is not None:
+        flags = pd.array(flags, dtype='boolean')
+        na = np.asarray(flags.isna())
+        codes |= np.where(na, NO_FLAG, 0).astype(np.uint8)
+        codes |= np.where(~na & ~np.asarray(flags.fillna(True), dtype=bool), UNCHECKED, 0).astype(np.uint8)
+    return codes
+
+
+def encode_flags(dates: np.ndarray, codes: np.ndarray, variable: str) -> pd.DataFrame:
+    """
+    Run-length encode the quality codes of one variable. A run is a sequence
+    of consecutive days with the same code. Only runs with a code other
+    than 0 are stored.
+
+    Parameters
+    ----------
+    dates : numpy.ndarray
+        The sorted dates of the codes.
+    codes : numpy.ndarray
+        The quality codes.
+    variable : str
+        The variable, ie. 'q' or 'w'.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        The flag table with variable, start, end (inclusive) and code.
+
+    """
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+    codes = np.asarray(codes, dtype=np.uint8)
+    if days.size == 0:
+        return empty_flags()
+
+    # a run breaks, where the code changes or a day is missing
+    breaks = np.flatnonzero((np.diff(codes) != 0) | (np.diff(days) != 1)) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks - 1, [days.size - 1]))
+    keep = codes[starts] != 0
+
+    return pd.DataFrame({
+        'variable': pd.Series(variable, index=range(int(keep.sum())), dtype=object),
+        'start': days[starts[keep]].astype('datetime64[D]').astype('datetime64[ns]'),
+        'end': days[ends[keep]].astype('datetime64[D]').astype('datetime64[ns]'),
+        'code': codes[starts[keep]]
+    }, columns=FLAG_TABLE_COLUMNS)
+
+
+def decode_flags(table: pd.DataFrame, variable: str, dates: np.ndarray) -> np.ndarray:
+    """
+    Get the quality code of one variable on each of the given dates.
+    Dates without a run get code 0.
+    """
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+    runs = table[table.variable == variable]
+    codes = np.zeros(days.size, dtype=np.uint8)
+    if len(runs) == 0 or days.size == 0:
+        return codes
+
+    starts = runs.start.values.astype('datetime64[D]').astype(np.int64)
+    ends = runs.end.values.astype('datetime64[D]').astype(np.int64)
+
+    # find the last run starting on or before each day
+    order = np.argsort(starts)
+    starts, ends, run_codes = starts[order], ends[order], runs.code.values.astype(np.uint8)[order]
+    idx = np.searchsorted(starts, days, side='right') - 1
+    inside = (idx >= 0) & (days <= ends[np.clip(idx, 0, None)])
+    codes[inside] = run_codes[idx[inside]]
+    return codes
+
+
+def stored_sentinels(table: pd.DataFrame, variable: str, dates: np.ndarray) -> np.ndarray:
+    """Mask of the dates, that are flagged as sentinel in the table."""
+    return (decode_flags(table, variable, dates) & np.uint8(SENTINEL)) != 0
+
+
+def station_flags(data: pd.DataFrame, sentinels: Dict[str, np.ndarray] = None) -> pd.DataFrame:
+    """
+    Build the flag table of all variables of a station from its data file.
+    Both, Bundesland.save_timeseries and Bundesland.update_flags use this
+    function, thus the same data always results in the same table.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The station data, sorted by date. 'date' has to be a data column
+        and the sentinels have to be replaced by NaN already.
+    sentinels : dict, optional
+        Mask of the rows, that were sentinels, for each variable.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        The flag table of the station.
+
+    """
+    if sentinels is None:
+        sentinels = {}
+    dates = pd.to_datetime(data['date']).values
+
+    tables = []
+    for var in [c for c in data.columns if c != 'date' and not c.endswith('_flag')]:
+        values = pd.to_numeric(data[var], errors='coerce').to_numpy(dtype=float)
+        flags = data[f'{var}_flag'].values if f'{var}_flag' in data.columns else None
+        tables.append(encode_flags(dates, flag_codes(values, flags, sentinels.get(var)), var))
+    
+    if len(tables) == 0:
+        return empty_flags()
+    return pd.concat(tables, ignore_index=True)
+
+
+def expand_flags(table: pd.DataFrame, variable: str) -> pd.Series:
+    """Expand the runs of one variable into a daily Series of codes, indexed by date."""
+    runs = table[table.variable == variable]
+    if len(runs) == 0:
+        return pd.Series([], index=pd.DatetimeIndex([], name='date'), dtype=np.uint8, name=variable)
+
+    starts = runs.start.values.astype('datetime64[D]').astype(np.int64)
+    lengths = runs.end.values.astype('datetime64[D]').astype(np.int64) - starts + 1
+
+    # the day numbers of all runs at once
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    days = np.repeat(starts, lengths) + offsets
+    codes = np.repeat(runs.code.values.astype(np.uint8), lengths)
+
+    return pd.Series(codes, index=pd.DatetimeIndex(days.astype('datetime64[D]'), name='date'), name=variable)
+
+
+def flag_share(table: pd.DataFrame, variable: str, mask: int = UNCHECKED, freq: str = 'YS') -> pd.Series:
+    """
+    Calculate the share of days, whose quality code has any of the bits in
+    mask set, for each period. The share is relative to all calendar days
+    of the period, ie. the share of flagged days per year.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        The flag table of a station.
+    variable : str
+        The variable, ie. 'q' or 'w'.
+    mask : int
+        Bitmask of the codes to count, ie. UNCHECKED | SENTINEL.
+    freq : str
+        Pandas offset alias of the periods. Defaults to years.
+
+    Returns
+    -------
+    share : pandas.Series
+        The share of flagged days, indexed by the start of the period.
+
+    """
+    codes = expand_flags(table, variable)
+    flagged = (codes.values & np.uint8(mask)) != 0
+    if not flagged.any():
+        return pd.Series([], index=pd.DatetimeIndex([], name='date'), dtype=float, name=variable)
+
+    # count the flagged days and the calendar days per period
+    counts = pd.Series(flagged.astype(int), index=codes.index).resample(freq).sum()
+    first, last = counts.index[0], counts.index[-1] + pd.tseries.frequencies.to_offset(freq)
+    days = pd.Series(1, index=pd.date_range(first, last - pd.Timedelta(days=1), freq='D')).resample(freq).sum()
+
+    return (counts / days.reindex(counts.index)).rename(variable)
+
+
+def flags_path(data_path: str) -> str:
+    """The path of the flag table next to a station data file."""
+    folder = os.path.dirname(data_path)
+    return os.path.join(folder, f"{os.path.basename(folder)}_flags.csv")
+
+
+def has_flag_table(data_path: str) -> bool:
+    """
+    Check if a station data file has a flag table. The sentinels of these
+    files were replaced by NaN on ingest, or by Bundesland.update_flags,
+    thus only files without flag table need to be searched for sentinels.
+    """
+    return os.path.exists(flags_path(data_path))
+
+
+def read_flags(path: str) -> pd.DataFrame:
+    """Read a flag table. Returns an empty table, if the file does not exist."""
+    if not os.path.exists(path):
+        return empty_flags()
+    table = pd.read_csv(path, dtype={'variable': object, 'code': np.uint8})
+
+    # a header-only file has no dates to parse
+    table['start'] = pd.to_datetime(table['start']).astype('datetime64[ns]')
+    table['end'] = pd.to_datetime(table['end']).astype('datetime64[ns]')
+    return table
+
+
+def write_flags(path: str, table: pd.DataFrame):
+    """Write a flag table. The file is written to a temporary file and moved into place."""
+    tmp_path = f"{path}.tmp"
+    table.to_csv(tmp_path, index=False, date_format='%Y-%m-%d')
+    os.replace(tmp_path, path)
+
+
+def sentinel_counts(table: pd.DataFrame) -> Dict[str, int]:
+    """Number of sentinel values of each variable in the flag table."""
+    runs = table[(table.code.values.astype(np.uint8) & SENTINEL) != 0]
+    if len(runs) == 0:
+        return {}
+    lengths = (runs.end - runs.start).dt.days + 1
+    return {var: int(n) for var, n in lengths.groupby(runs.variable).sum().items()}
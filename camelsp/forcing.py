@@ -0,0 +1,352 @@
+from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+import json
+import glob
+import hashlib
+import warnings
+
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+import xarray as xr
+import shapely
+from scipy import sparse
+
+from .util import HYRAS_PATH, OUTPUT_PATH, get_metadata
+from .output import Bundesland
+from .cube import _signature
+
+
+# the HYRAS-DE grids are provided in ETRS89 / LCC Europe
+HYRAS_CRS = 'EPSG:3034'
+
+
+def open_hyras(variable: str, hyras_path: str = HYRAS_PATH) -> List[str]:
+    """
+    Find all HYRAS files of the given variable, ie. 'pr', 'tas', 'tasmin',
+    'tasmax' or 'hurs'. The files are expected in the HYRAS folder and
+    follow the DWD naming scheme '<variable>_hyras_*.nc'.
+    """
+    fnames = sorted(glob.glob(os.path.join(hyras_path, '**', f'{variable}_hyras_*.nc'), recursive=True))
+    if len(fnames) == 0:
+        raise FileNotFoundError(f"Can't find any HYRAS files for '{variable}' in {hyras_path}")
+    return fnames
+
+
+def _grid_crs(ds: xr.Dataset, variable: str, default: str = HYRAS_CRS) -> str:
+    """Get the CRS of the grid from the CF grid_mapping, or use the default."""
+    mapping_name = ds[variable].attrs.get('grid_mapping')
+    if mapping_name is not None and mapping_name in ds.variables:
+        attrs = ds[mapping_name].attrs
+        for key in ('crs_wkt', 'spatial_ref'):
+            if key in attrs:
+                return attrs[key]
+    return default
+
+
+def _overlapping(centers: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    """Indices of the regular grid cells along one axis, that overlap [lo, hi]."""
+    half = abs(centers[1] - centers[0]) / 2
+    return np.flatnonzero((centers + half > lo) & (centers - half < hi))
+
+
+def _polygon_weights(polygon, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the share of the polygon's area covered by each grid cell.
+    Returns the flat cell indices and the weights, which sum up to 1.
+    """
+    xmin, ymin, xmax, ymax = polygon.bounds
+    ix = _overlapping(x, xmin, xmax)
+    iy = _overlapping(y, ymin, ymax)
+    if ix.size == 0 or iy.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+
+    # build all candidate cells at once
+    IX, IY = np.meshgrid(ix, iy)
+    IX, IY = IX.ravel(), IY.ravel()
+    dx, dy = abs(x[1] - x[0]) / 2, abs(y[1] - y[0]) / 2
+    cells = shapely.box(x[IX] - dx, y[IY] - dy, x[IX] + dx, y[IY] + dy)
+
+    # vectorized intersection
+    shapely.prepare(polygon)
+    area = shapely.area(shapely.intersection(cells, polygon))
+    mask = area > 0
+    if not mask.any():
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+
+    return (IY[mask] * x.size + IX[mask]).astype(np.int64), area[mask] / area[mask].sum()
+
+
+def _grid_key(x: np.ndarray, y: np.ndarray, crs: str) -> str:
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(y, dtype=float).tobytes())
+    h.update(str(crs).encode())
+    return h.hexdigest()[:16]
+
+
+def _catchment_path(camels_id: str, datasource: str, base_path: str = OUTPUT_PATH) -> str:
+    """The path of a catchment geometry, as written by Station.save_catchment_geometry."""
+    return os.path.join(base_path, camels_id[:3], camels_id, f"{camels_id}_{datasource}_catchment.geojson")
+
+
+def _read_catchments(paths: Dict[str, str]) -> gpd.GeoDataFrame:
+    """
+    Read the catchment geometries of all stations into one GeoDataFrame
+    with a camels_id column. Stations without catchment file are omitted.
+    """
+    frames = [gpd.read_file(path).assign(camels_id=camels_id)[['camels_id', 'geometry']] for camels_id, path in paths.items() if os.path.exists(path)]
+    if len(frames) == 0:
+        return gpd.GeoDataFrame({'camels_id': []}, geometry=gpd.GeoSeries([]), crs='EPSG:4326')
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), geometry='geometry', crs=frames[0].crs)
+
+
+def catchment_weights(x: np.ndarray, y: np.ndarray, crs: str, datasource: str, camels_ids: List[str] = None, hyras_path: str = HYRAS_PATH, cache: bool = True, base_path: str = OUTPUT_PATH) -> Tuple[sparse.csr_matrix, List[str]]:
+    """
+    Build the sparse (catchment x grid cell) weight matrix of the area
+    overlap between each station's catchment and the grid. Multiplying
+    the matrix with a flattened field yields all catchment means at once.
+    The matrix is cached per grid and datasource in the 'weights' folder
+    of the HYRAS path, along with the modification time and size of each
+    catchment file. If any of them changed, the matrix is rebuilt.
+
+    Parameters
+    ----------
+    x, y : numpy.ndarray
+        Cell center coordinates of the regular grid.
+    crs : str
+        CRS of the grid.
+    datasource : str
+        The catchment datasource, see Station.get_catchment.
+    camels_ids : list, optional
+        The stations to include. Defaults to all stations in the metadata.
+    hyras_path : str
+        The HYRAS folder, which holds the cache.
+    cache : bool
+        If False, the cache is neither read nor written.
+    base_path : str
+        The output root folder, which holds the catchment geometries.
+
+    Returns
+    -------
+    weights : scipy.sparse.csr_matrix
+        Matrix of shape (n_catchments, y.size * x.size), rows sum up to 1.
+    camels_ids : list
+        The CAMELS-DE ids of the rows. Stations without catchment are omitted.
+
+    """
+    # build the cache file name
+    key = _grid_key(x, y, crs)
+    cache_path = os.path.join(hyras_path, 'weights', f'{key}_{datasource}')
+
+    # get the stations
+    if camels_ids is None:
+        camels_ids = get_metadata(base_path=base_path).camels_id.astype(str).tolist()
+    paths = {camels_id: _catchment_path(camels_id, datasource, base_path) for camels_id in camels_ids}
+    signatures = {camels_id: _signature(path) for camels_id, path in paths.items()}
+
+    # load from cache, if all stations were requested before and their catchments did not change
+    if cache and os.path.exists(f'{cache_path}.npz'):
+        with open(f'{cache_path}.json', 'r') as f:
+            cached = json.load(f)
+        cached_signatures = cached.get('signatures', {})
+        if set(camels_ids).issubset(set(cached['requested'])) and all(cached_signatures.get(camels_id, False) == signatures[camels_id] for camels_id in camels_ids):
+            weights = sparse.load_npz(f'{cache_path}.npz').tocsr()
+            rows = {camels_id: i for i, camels_id in enumerate(cached['ids'])}
+            keep = [camels_id for camels_id in camels_ids if camels_id in rows]
+            return weights[[rows[camels_id] for camels_id in keep]], keep
+
+    # read all catchments and transform them to the grid CRS at once
+    catchments = _read_catchments(paths).to_crs(crs)
+    geometries = catchments.geometry.values
+    groups = catchments.groupby('camels_id').indices
+
+    # calculate the weights for each catchment
+    row_idx, col_idx, values, ids = [], [], [], []
+    for camels_id in camels_ids:
+        if camels_id not in groups:
+            warnings.warn(f"{camels_id};NoCatchment;There is no {datasource} catchment for this station.")
+            continue
+
+        polygon = shapely.union_all(geometries[groups[camels_id]])
+        cols, w = _polygon_weights(polygon, x, y)
+        if cols.size == 0:
+            warnings.warn(f"{camels_id};OutsideGrid;The {datasource} catchment does not overlap the grid.")
+            continue
+
+        row_idx.append(np.full(cols.size, len(ids)))
+        col_idx.append(cols)
+        values.append(w)
+        ids.append(camels_id)
+
+    if len(ids) == 0:
+        raise ValueError(f"None of the stations has a {datasource} catchment within the grid")
+
+    weights = sparse.csr_matrix((np.concatenate(values), (np.concatenate(row_idx), np.concatenate(col_idx))), shape=(len(ids), y.size * x.size))
+
+    # save to cache
+    if cache:
+        if not os.path.exists(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        sparse.save_npz(f'{cache_path}.npz', weights)
+        with open(f'{cache_path}.json', 'w') as f:
+            json.dump({'requested': camels_ids, 'ids': ids, 'signatures': signatures}, f)
+
+    return weights, ids
+
+
+# the weight matrix of the worker process, set once by the pool initializer
+_WORKER_WEIGHTS: sparse.csr_matrix = None
+
+# the valid weights of the worker, by missing-cell mask
+_WORKER_NORMS: Dict[bytes, np.ndarray] = {}
+
+
+def _init_worker(weights: sparse.csr_matrix):
+    global _WORKER_WEIGHTS
+    _WORKER_WEIGHTS = weights
+    _WORKER_NORMS.clear()
+
+
+def _valid_weights(weights: sparse.csr_matrix, missing: np.ndarray, norms: Dict[bytes, np.ndarray] = None) -> np.ndarray:
+    """
+    Sum of the valid weights of each catchment for each field (time, cells).
+    If all fields miss the same cells, as the cells outside of the HYRAS 
+    domain, the sums are only calculated once and cached in norms by mask.
+    """
+    if all(np.array_equal(missing[0], m) for m in missing[1:]):
+        key = hashlib.sha1(np.packbits(missing[0])).digest()
+        norm = norms.get(key) if norms is not None else None
+        if norm is None:
+            norm = weights @ (~missing[0]).astype(weights.dtype)
+            if norms is not None:
+                norms[key] = norm
+        return np.broadcast_to(norm, (missing.shape[0], norm.size))
+    
+    return np.stack([weights @ (~m).astype(weights.dtype) for m in missing])
+
+
+def _catchment_means(weights: sparse.csr_matrix, fields: np.ndarray, norms: Dict[bytes, np.ndarray] = None) -> np.ndarray:
+    """
+    Calculate all catchment means of a stack of fields (time, y, x).
+    Missing cells are excluded and the remaining weights are re-normalized.
+    The fields keep their dtype and are modified in place: missing cells
+    are set to 0. norms caches the valid weights, see _valid_weights.
+    """
+    if not np.issubdtype(fields.dtype, np.floating):
+        fields = fields.astype(np.float64)
+    flat = fields.reshape(fields.shape[0], -1)
+    weights = weights.astype(flat.dtype, copy=False)
+
+    # exclude the missing cells from the sums
+    missing = np.isnan(flat)
+    np.nan_to_num(flat, copy=False, nan=0.0)
+
+    # one sparse matrix-vector product per field, on the contiguous rows
+    sums = np.empty((flat.shape[0], weights.shape[0]), dtype=flat.dtype)
+    for t in range(flat.shape[0]):
+        sums[t] = weights @ flat[t]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / _valid_weights(weights, missing, norms)
+
+
+def _extract_chunk(fname: str, variable: str, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Extract the catchment means of one time chunk of one file. Runs in a worker process."""
+    with xr.open_dataset(fname) as ds:
+        da = ds[variable].isel(time=slice(start, stop))
+        fields = da.transpose('time', 'y', 'x').values
+        dates = da.time.values
+    return dates, _catchment_means(_WORKER_WEIGHTS, fields, norms=_WORKER_NORMS)
+
+
+def extract_forcing(variable: str, datasource: str = 'merit_hydro', fnames: List[str] = None, camels_ids: List[str] = None, chunk_size: int = 365, max_workers: int = None, hyras_path: str = HYRAS_PATH, base_path: str = OUTPUT_PATH) -> pd.DataFrame:
+    """
+    Extract the area-weighted catchment means of a HYRAS variable for all
+    stations. The weight matrix is computed once (and cached), then each
+    daily field is reduced to all catchment means by one sparse
+    matrix-vector product. The files are processed in time chunks across
+    a process pool.
+
+    Parameters
+    ----------
+    variable : str
+        The HYRAS variable, ie. 'pr' or 'tas'.
+    datasource : str
+        The catchment datasource, see Station.get_catchment.
+    fnames : list, optional
+        The HYRAS netCDF files. Defaults to all files of the variable in
+        the HYRAS folder. All files need to share the same grid.
+    camels_ids : list, optional
+        The stations to extract. Defaults to all stations in the metadata.
+    chunk_size : int
+        Number of time steps processed in one task.
+    max_workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    hyras_path : str
+        The HYRAS folder.
+    base_path : str
+        The output root folder, which holds the catchment geometries.
+
+    Returns
+    -------
+    forcing : pandas.DataFrame
+        The catchment means, indexed by date, one column per camels_id.
+
+    """
+    if fnames is None:
+        fnames = open_hyras(variable, hyras_path=hyras_path)
+
+    # read the grid and the time chunks from the files
+    tasks = []
+    for i, fname in enumerate(fnames):
+        with xr.open_dataset(fname) as ds:
+            if i == 0:
+                x, y = ds['x'].values, ds['y'].values
+                crs = _grid_crs(ds, variable)
+            n_time = ds.sizes['time']
+        tasks.extend([(fname, variable, start, min(start + chunk_size, n_time)) for start in range(0, n_time, chunk_size)])
+
+    # get the weights
+    weights, ids = catchment_weights(x, y, crs, datasource, camels_ids=camels_ids, hyras_path=hyras_path, base_path=base_path)
+
+    # process the chunks
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(weights, )) as executor:
+        results = list(executor.map(_extract_chunk, *zip(*tasks)))
+
+    dates = np.concatenate([r[0] for r in results])
+    means = np.concatenate([r[1] for r in results], axis=0)
+
+    forcing = pd.DataFrame(means, index=pd.DatetimeIndex(dates, name='date'), columns=ids)
+    return forcing.sort_index()
+
+
+def save_forcing(forcing: pd.DataFrame, name: str) -> List[str]:
+    """
+    Save extracted forcing next to q and w, using Bundesland.save_timeseries.
+
+    Parameters
+    ----------
+    forcing : pandas.DataFrame
+        The output of extract_forcing.
+    name : str
+        The column name of the forcing variable in the station data files.
+
+    Returns
+    -------
+    paths : list
+        The paths of all written files
+
+    """
+    paths = []
+
+    # handle each state with one Bundesland instance
+    states = sorted(set(c[:3] for c in forcing.columns))
+    for NUTS in states:
+        with Bundesland(NUTS) as bl:
+            for camels_id in [c for c in forcing.columns if c.startswith(NUTS)]:
+                df = pd.DataFrame({'date': forcing.index, name: forcing[camels_id].values})
+                paths.append(bl.save_timeseries(df, series_id=camels_id))
+
+    return paths
@@ -0,0 +1,201 @@
+from typing import Tuple, List, Union
+import os
+import json
+
+import pandas as pd
+import numpy as np
+import plotly.express as px
+
+from .util import OUTPUT_PATH, SENTINELS, _NUTS_LVL2_NAMES, get_metadata
+from .executor import Executor, run
+from .flags import has_flag_table
+
+
+def valid_intervals(dates: np.ndarray, values: np.ndarray, normalized: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the intervals of consecutive days with valid values as day numbers
+    (days since 1970-01-01). NaN and sentinel values are not valid.
+    Duplicated dates are counted only once.
+
+    Parameters
+    ----------
+    dates : numpy.ndarray
+        datetime64 array of the observation dates
+    values : numpy.ndarray
+        The observed values
+    normalized : bool
+        If True, the sentinels were already replaced by NaN on ingest and
+        the values are not searched for them.
+
+    Returns
+    -------
+    starts, ends : numpy.ndarray
+        First and last day number of each interval. Both bounds are inclusive.
+
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values) if normalized else ~(np.isnan(values) | np.isin(values, SENTINELS))
+
+    # unique, sorted day numbers of the valid values
+    days = np.unique(np.asarray(dates, dtype='datetime64[D]')[valid].astype(np.int64))
+    if days.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # an interval breaks, wherever more than one day is missing
+    breaks = np.flatnonzero(np.diff(days) > 1)
+    starts = days[np.concatenate(([0], breaks + 1))]
+    ends = days[np.concatenate((breaks, [days.size - 1]))]
+
+    return starts, ends
+
+
+def _state_intervals(base_path: str, nuts_lvl2: str, variable: str, camels_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Collect the valid intervals of all given stations in one state.
+    This function is run in a worker process.
+    """
+    starts, ends = [], []
+    for camels_id in camels_ids:
+        path = os.path.join(base_path, nuts_lvl2, camels_id, f'{camels_id}_data.csv')
+
+        # read only the needed columns
+        try:
+            df = pd.read_csv(path, usecols=['date', variable], parse_dates=['date'])
+        except (FileNotFoundError, ValueError):
+            # no data file, or the variable is not in the file
+            continue
+
+        s, e = valid_intervals(df['date'].values, df[variable].values, normalized=has_flag_table(path))
+        starts.append(s)
+        ends.append(e)
+
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def gauge_density(variable: str = 'q', freq: str = 'D', base_path: str = OUTPUT_PATH, executor: Union[str, Executor] = 'process') -> pd.Series:
+    """
+    Calculate the number of active gauges over time for the given variable.
+    A gauge is active on each day it has a valid value.
+    Instead of aligning all stations into one large DataFrame, only the
+    start and end of each interval of valid values are collected and
+    accumulated into a single integer array (sweep-line), thus the memory
+    needed is proportional to the date range, not to the number of stations.
+    The states are processed in parallel.
+
+    Parameters
+    ----------
+    variable : str
+        The variable to calculate the density for. Usually 'q' or 'w'.
+    freq : str
+        Pandas offset alias of the output resolution. For anything else
+        than 'D', the mean number of active gauges per period is returned.
+    base_path : str
+        The output root folder to read the metadata from.
+    executor : str, Executor, dask.distributed.Client
+        Execution backend of the per-state tasks, see
+        camelsp.executor.get_executor. Defaults to a local process pool.
+
+    Returns
+    -------
+    density : pandas.Series
+        The number of active gauges, indexed by date.
+
+    """
+    # get the stations of each state from the metadata
+    meta = get_metadata(base_path=base_path)
+    jobs = [(base_path, NUTS, variable, meta.loc[meta.nuts_lvl2 == NUTS, 'camels_id'].tolist()) for NUTS in _NUTS_LVL2_NAMES.keys()]
+    jobs = [job for job in jobs if len(job[3]) > 0]
+
+    # collect all intervals - one task per state
+    results = run(_state_intervals, [job[1] for job in jobs], jobs, executor=executor)
+    failed = [r for r in results if r.error is not None]
+    if len(failed) > 0:
+        raise RuntimeError(f"Collecting the intervals failed for {', '.join(r.key for r in failed)}:\n{failed[0].traceback}")
+    results = [r.value for r in results]
+
+    starts = np.concatenate([r[0] for r in results]) if len(results) > 0 else np.empty(0, dtype=np.int64)
+    ends = np.concatenate([r[1] for r in results]) if len(results) > 0 else np.empty(0, dtype=np.int64)
+
+    # no data at all
+    if starts.size == 0:
+        return pd.Series([], index=pd.DatetimeIndex([], name='date'), dtype=int, name=variable)
+
+    # sweep-line: +1 on each start, -1 on the day after each end
+    first, last = starts.min(), ends.max()
+    n_days = int(last - first + 1)
+    events = np.bincount(starts - first, minlength=n_days + 1) - np.bincount(ends - first + 1, minlength=n_days + 1)
+    counts = np.cumsum(events[:n_days])
+
+    # build the series
+    index = pd.date_range(pd.Timestamp(np.datetime64(int(first), 'D')), periods=n_days, freq='D', name='date')
+    density = pd.Series(counts, index=index, name=variable)
+
+    # resample if needed
+    if freq.upper() != 'D':
+        density = density.resample(freq).mean()
+
+    return density
+
+
+def export_gauge_density(output_folder: str = None, freq: str = 'D', base_path: str = OUTPUT_PATH, executor: Union[str, Executor] = 'process', q_density: pd.Series = None, w_density: pd.Series = None) -> str:
+    """
+    Calculate the gauge density for discharge and water level and export
+    the plotly figure and its description as JSON, as consumed by the website.
+
+    Parameters
+    ----------
+    output_folder : str, optional
+        Alternative output location. The default location is the
+        'metrics' folder in the base output location.
+    freq : str
+        Pandas offset alias of the output resolution.
+    base_path : str
+        The output root folder.
+    executor : str, Executor, dask.distributed.Client
+        Execution backend of the per-state tasks, see
+        camelsp.executor.get_executor. Defaults to a local process pool.
+    q_density, w_density : pandas.Series, optional
+        Already calculated results of gauge_density for discharge and
+        water level. Only the missing ones are calculated.
+
+    Returns
+    -------
+    path : str
+        Path of the plotly JSON file
+
+    """
+    # build the path
+    if output_folder is None:
+        output_folder = os.path.join(base_path, 'metrics')
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    # calculate the density for both variables, if not given
+    if q_density is None:
+        q_density = gauge_density('q', freq=freq, base_path=base_path, executor=executor)
+    if w_density is None:
+        w_density = gauge_density('w', freq=freq, base_path=base_path, executor=executor)
+    q = q_density.rename('Q gauges')
+    w = w_density.rename('W gauges')
+    merge = pd.merge(q, w, left_index=True, right_index=True, how='outer')
+
+    # build the figure
+    fig = px.line(merge)
+    fig.update_layout(legend=dict(orientation='h'), template='plotly_dark')
+
+    path = os.path.join(output_folder, 'gauge_density.plotly.json')
+    with open(path, 'w') as f:
+        f.write(fig.to_json())
+
+    # add description
+    resolution = 'daily resolution' if freq.upper() == 'D' else f"'{freq}' resolution (mean of daily counts)"
+    with open(os.path.join(output_folder, 'gauge_density.description.json'), 'w') as f:
+        json.dump({
+            'title': 'CAMELS-de gauge density over time',
+            'body': f'The graph shows the amount of active gauges from the CAMELS-de processing dataset over time on {resolution} for water level and discharge each. Note that this graph is generated from the processing dataset that will change over time.',
+            'actions': [{'href': 'https://github.com/CAMELS-DE/camelsp/blob/main/scripts/density.ipynb', 'title': 'Resource on Github'}]
+        }, f)
+
+    return path
@@ -1,14 +1,17 @@
 from __future__ import annotations
-from typing import Union, Dict, List
+from typing import Union, Dict, List, Mapping, Iterable, Iterator, Tuple
 from types import TracebackType
 from contextlib import AbstractContextManager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
 import os
 import json
 import warnings
 import shutil
 import glob
-import io
 import hashlib
+from functools import lru_cache
 
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -16,7 +19,184 @@ import numpy as np
 from ydata_profiling import ProfileReport
 import geopandas as gpd
 
-from .util import nuts, get_output_path, BASEPATH, get_input_path, get_full_nuts_mapping, _get_logo, _NUTS_LVL2_NAMES, get_metadata, update_metadata
+from .util import nuts, get_output_path, BASEPATH, get_input_path, get_full_nuts_mapping, _get_logo, _NUTS_LVL2_NAMES, get_metadata, update_metadata, lookup_station, SENTINELS, _use_sqlite
+from .util import get_column_mapping, update_column_mapping, rename_columns, atomic_path
+from .summary import summarize_timeseries, read_summary, update_summary_file, summary_to_frame
+from .events import EventLog
+from .executor import Executor, run, summarize
+from .store import MetadataStore
+from .batch import run_batch
+from .report import native_report, render_html
+from .flags import UNCHECKED, normalize_sentinels, station_flags, stored_sentinels, flag_share, read_flags, write_flags, sentinel_counts, has_flag_table
+
+
+@lru_cache(maxsize=1024)
+def _daily_dates(start: pd.Timestamp, periods: int) -> np.ndarray:
+    """The cached, read-only dates of a daily date range."""
+    dates = pd.date_range(start, periods=periods, freq='D').values
+    dates.flags.writeable = False
+    return dates
+
+
+def _daily_index(start: pd.Timestamp, periods: int) -> pd.DatetimeIndex:
+    """
+    Return a daily DatetimeIndex. The dates are cached, thus all stations
+    with identical date ranges share the same memory. Each call returns a 
+    new index object, so that changing the name of one index does not 
+    change the others.
+    """
+    return pd.DatetimeIndex(_daily_dates(start, periods), name='date', copy=False)
+
+
+def _read_data(path: str, date_index: bool = True, compact: bool = False, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Read a station data file. If compact is True, the variables are
+    returned as float32 and the flags as int8 (1: True, 0: False, -1: NA).
+    Stations with a complete, daily date index share the memory of the index.
+    If columns is given, only these columns (and the date) are read.
+    Requested columns, that are not in the file, are omitted.
+    
+    float32 keeps about 7 significant digits, which is sufficient for the
+    measurement precision of discharge and water level, but values are not
+    bit-identical to the file anymore. Use compact=False, if data is written back.
+    """
+    usecols = None if columns is None else (lambda c: c == 'date' or c in columns)
+    if not compact:
+        df = pd.read_csv(path, usecols=usecols, parse_dates=['date'], dtype={'q': float, 'q_flag': 'boolean', 'w': float, 'w_flag': 'boolean'})
+    else:
+        df = pd.read_csv(path, usecols=usecols, parse_dates=['date'], dtype={'q': 'float32', 'q_flag': 'boolean', 'w': 'float32', 'w_flag': 'boolean'})
+
+        # reduce all other columns as well
+        for col in df.columns:
+            if col == 'date':
+                continue
+            elif col.endswith('_flag'):
+                df[col] = df[col].astype('boolean').astype('Int8').fillna(-1).astype('int8')
+            else:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+
+    if date_index:
+        df.set_index('date', inplace=True)
+
+        # share the index memory, if the station has a complete daily index
+        if compact and len(df) > 0 and df.index.is_monotonic_increasing and df.index.is_unique and (df.index[-1] - df.index[0]).days == len(df) - 1:
+            df.index = _daily_index(df.index[0], len(df))
+    
+    return df
+
+
+def _metadata_by_id(meta: pd.DataFrame, event_log: EventLog = None) -> pd.DataFrame:
+    """
+    Index the metadata by camels_id. Duplicated ids are reported as
+    warning (or event) and only the first row of each id is kept.
+    """
+    meta = meta.set_index(meta.camels_id.astype(str), drop=False)
+    duplicated = meta.index.duplicated(keep='first')
+    if duplicated.any():
+        for camels_id, n in meta.index[meta.index.duplicated(keep=False)].value_counts().items():
+            message = f"The station has {n} metadata rows, using the first one"
+            if event_log is not None:
+                event_log.log(provider_id=camels_id, warning_type='DuplicatedMetadata', message=message, context='iter_stations')
+            else:
+                warnings.warn(f"{camels_id};DuplicatedMetadata;{message};iter_stations")
+        meta = meta[~duplicated]
+    return meta
+
+
+def _iter_data(items: Iterable[Tuple[str, str, Union[pd.Series, None]]], columns: List[str] = None, date_index: bool = True, compact: bool = False, prefetch: int = 4, event_log: EventLog = None) -> Iterator[Tuple[str, Union[pd.Series, None], pd.DataFrame]]:
+    """
+    Read the station data files on a background thread pool, while the
+    caller processes the previous stations. At most prefetch files are
+    read ahead, thus at most prefetch + 1 DataFrames are held in memory.
+    Missing files and files that can't be parsed are skipped and reported
+    as warning, or as event if an EventLog is given. Other errors, ie.
+    of the requested columns, are raised.
+
+    items are (camels_id, path, metadata) tuples.
+    """
+    def skip(camels_id: str, warning_type: str, message: str):
+        if event_log is not None:
+            event_log.log(provider_id=camels_id, warning_type=warning_type, message=message, context='iter_stations')
+        else:
+            warnings.warn(f"{camels_id};{warning_type};{message};iter_stations")
+
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, prefetch)) as pool:
+        def submit(item):
+            camels_id, path, meta = item
+            pending.append((camels_id, path, meta, pool.submit(_read_data, path, date_index=date_index, compact=compact, columns=columns)))
+
+        try:
+            # fill the read-ahead queue
+            for item in islice(items, max(1, prefetch)):
+                submit(item)
+
+            while len(pending) > 0:
+                camels_id, path, meta, future = pending.popleft()
+
+                # read the next station, before this one is processed
+                item = next(items, None)
+                if item is not None:
+                    submit(item)
+                
+                try:
+                    df = future.result()
+                except FileNotFoundError:
+                    skip(camels_id, 'MissingFile', f"There is no data file at {path}")
+                    continue
+                except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+                    skip(camels_id, 'BadFile', f"{type(e).__name__}: {e}")
+                    continue
+                
+                yield camels_id, meta, df
+        finally:
+            # the caller stopped early
+            for *_, future in pending:
+                future.cancel()
+
+
+def iter_stations(nuts_ids: Union[List[str], str] = 'all', columns: List[str] = None, date_index: bool = True, compact: bool = False, prefetch: int = 4, event_log: EventLog = None) -> Iterator[Tuple[str, Union[pd.Series, None], pd.DataFrame]]:
+    """
+    Iterate over the data of all stations of all federal states, while the
+    next stations are read in the background. See Bundesland.iter_stations.
+
+    Parameters
+    ----------
+    nuts_ids : list, str
+        A list of CAMELS-DE IDs, or 'all' for all stations in the nuts mapping.
+    columns : list, optional
+        Only read these columns, ie. ['q', 'q_flag'].
+    date_index : bool
+        If True (default), the date is used as index.
+    compact : bool
+        If True, read float32 values and int8 flags, see Bundesland.get_data.
+    prefetch : int
+        Number of stations read ahead.
+    event_log : EventLog, optional
+        If given, skipped stations are logged as events instead of warnings.
+
+    Yields
+    ------
+    camels_id : str
+        The CAMELS-DE ID of the station.
+    metadata : pandas.Series
+        The metadata row of the station, or None if it has no metadata.
+    data : pandas.DataFrame
+        The station data.
+
+    """
+    base_path = get_output_path()
+    if nuts_ids == 'all':
+        nuts_ids = [m['nuts_id'] for m in get_full_nuts_mapping(base_path, format='json') if len(m) > 0]
+    elif isinstance(nuts_ids, str):
+        nuts_ids = [nuts_ids]
+
+    # metadata by camels_id
+    meta = _metadata_by_id(get_metadata(base_path), event_log=event_log)
+
+    items = ((nuts_id, os.path.join(base_path, nuts_id[:3], nuts_id, f'{nuts_id}_data.csv'), meta.loc[nuts_id] if nuts_id in meta.index else None) for nuts_id in nuts_ids)
+    yield from _iter_data(items, columns=columns, date_index=date_index, compact=compact, prefetch=prefetch, event_log=event_log)
 
 
 class Bundesland(AbstractContextManager):
@@ -45,34 +225,20 @@ class Bundesland(AbstractContextManager):
         return super().__exit__(__exc_type, __exc_value, __traceback)
 
     @property
-    def column_mapping(self) -> Dict[str, str]:
-        with open(os.path.join(BASEPATH, 'column_mapping.json'), 'r') as f:
-            return json.load(f)
+    def column_mapping(self) -> Mapping[str, str]:
+        return get_column_mapping(self.base_path)
     
     @column_mapping.setter
     def column_mapping(self, new_map: Dict[str, str]):
-        # get the current mapping
-        mapping = self.column_mapping
-
-        # check if we have conflicting column names
-        conflicts = [(k, v, ) for k, v in new_map.items() if k in mapping and mapping[k] != v.lower()]
-        if len(conflicts) > 0:
-            conf_str = [f'{k} -> {v}' for (k, v) in conflicts]
-            warnings.warn(f"CONFLICTING HEADER RENAMES. The following header can't be set as they are already defined: {', '.join(conf_str)}")
-
-        # use only lower-case values and ignore conflicts
-        conficting_keys = [t[0] for t in conflicts]
-        updates = {k: v.lower() for k, v in new_map.items() if k not in conficting_keys}
-
-        # update
-        mapping.update(updates)
-
-        # save
-        with open(os.path.join(BASEPATH, 'column_mapping.json'), 'w') as f:
-            json.dump(mapping, f, indent=4)
+        # new renames are stored in the output tree, not in the package
+        update_column_mapping(new_map, base_path=self.base_path)
 
     @property
     def nuts_mapping(self) -> List[Dict[str, str]]:
+        # query the database
+        if _use_sqlite():
+            return MetadataStore(self.base_path).get_nuts_mapping(nuts_lvl2=self.NUTS)
+
         # check if the final metadata directly exists
         if not os.path.exists(self.meta_path):
             os.makedirs(self.meta_path)
@@ -95,8 +261,19 @@ class Bundesland(AbstractContextManager):
 
     @nuts_mapping.setter
     def nuts_mapping(self, new_nuts: List[Dict[str, str]]):
-        # generate a list of nuts_ids we want to create / update
-        nuts_ids = [c['nuts_id'] for c in new_nuts]
+        self._update_nuts_mapping(new_nuts)
+
+    def _update_nuts_mapping(self, new_nuts: List[Dict[str, str]], drop: List[str] = None):
+        if drop is None:
+            drop = []
+        
+        # generate a list of nuts_ids we want to create / update or remove
+        nuts_ids = set([c['nuts_id'] for c in new_nuts]) | set(drop)
+
+        # update the database in one transaction
+        if _use_sqlite():
+            MetadataStore(self.base_path).update_nuts_mapping(new_nuts, drop=drop)
+            return
         
         # here we need to load all nuts
         all_nuts = get_full_nuts_mapping(self.base_path, format='json')
@@ -121,11 +298,8 @@ class Bundesland(AbstractContextManager):
 
     @property
     def metadata(self) -> pd.DataFrame:
-        # get all metadata
-        meta = get_metadata(self.base_path)
-        
-        # filter for this BL
-        return meta.where(meta.nuts_lvl2 == self.NUTS).dropna(axis=0, how='all')
+        # get the metadata of this BL
+        return get_metadata(self.base_path, nuts_lvl2=self.NUTS)
     
     @metadata.setter
     def metadata(self, new_metadata: pd.DataFrame):
@@ -135,11 +309,12 @@ class Bundesland(AbstractContextManager):
             self.update_metadata(new_metadata=new_metadata)
     
     def update_metadata(self, new_metadata: pd.DataFrame, id_column: str = 'camels_id'):
-        update_metadata(new_metadata, id_column=id_column)
+        update_metadata(new_metadata, base_path=self.base_path, id_column=id_column)
 
     def save_warnings(self, warns: List[warnings.WarningMessage], posfix: str = '') -> str:
         """
         Create a error log in the metadata directory for the current BL.
+        Prefer event_log, which writes structured events while processing.
         """
         # get the path
         path = os.path.join(self.meta_path, f"{self.NUTS}_error{posfix}.log")
@@ -147,20 +322,100 @@ class Bundesland(AbstractContextManager):
         # write a log - overwrite if it already exists
         with open(path, 'w') as f:
             # use only the message, it has ;-separated format
-            f.write("provider_id;warning_type;message;additional_context")
-            f.write('\n'.join([w.message.args[0] for w in warns]))
+            f.write("provider_id;warning_type;message;additional_context\n")
+            f.write('\n'.join([str(w.message.args[0]) for w in warns]))
         
         return path         
 
-    def save_raw_metadata(self, meta: pd.DataFrame, id_column: Union[str, int], overwrite: bool = False) -> str:
+    def event_log(self, run: str = None, buffer_size: int = 100, flush_interval: float = 5.0) -> EventLog:
+        """
+        Open a structured, append-only event log for this Bundesland.
+        The events are written as JSON lines to 'metadata/events/<NUTS>_<run>.jsonl'
+        while processing. Use camelsp.load_events to load the events of all
+        states into one DataFrame.
+
+        Parameters
+        ----------
+        run : str, optional
+            Name of the processing run. Defaults to the current timestamp.
+        buffer_size : int
+            Number of buffered events, that trigger a write.
+        flush_interval : float
+            Maximum number of seconds between two writes.
+
+        Returns
+        -------
+        log : EventLog
+            The event log. Use it as a context manager to make sure all 
+            events are written. log.capture() writes all warnings issued
+            within the context to the log.
+        """
+        return EventLog(self.NUTS, run=run, base_path=self.base_path, buffer_size=buffer_size, flush_interval=flush_interval)
+
+    def diff_raw_metadata(self, meta: pd.DataFrame, id_column: Union[str, int]) -> pd.DataFrame:
+        """
+        Generate the nuts mapping for a raw metadata dump and compare it to 
+        the existing mapping of this Bundesland, without changing anything.
+
+        Parameters
+        ----------
+        meta : pandas.DataFrame
+            Raw metadata dump.
+        id_column : str, int
+            Identifies the vendor's ID column in the dump.
+
+        Returns
+        -------
+        diff : pandas.DataFrame
+            One row per nuts_id, with the old and new provider_id and path
+            and the status 'added', 'removed', 'changed' or 'unchanged'.
+            'changed' means, that the nuts_id now belongs to another provider_id.
+        """
+        # extract the meta-ids and force provider ids to be strings
+        if isinstance(id_column, int):
+            meta_ids = meta.iloc[:, id_column].astype(str).values
+        else:
+            meta_ids = meta.loc[:, id_column].astype(str).values
+        
+        # generate the nuts ids
+        numbers = (10000 + np.arange(len(meta_ids)) * 10).astype(str)
+        nuts_ids = np.char.add(self.NUTS, np.char.zfill(numbers, 5))
+
+        # create the file names relative to the output root
+        if self.fname_template == '{nuts_id}_data.csv':
+            fnames = np.char.add(nuts_ids, '_data.csv')
+        else:
+            fnames = np.array([self.fname_template.format(nuts_id=nuts_id, nuts=self.NUTS) for nuts_id in nuts_ids], dtype=str)
+        paths = np.char.add(np.char.add(np.char.add(f'./{self.NUTS}/', nuts_ids), '/'), fnames)
+
+        new = pd.DataFrame({'nuts_id': nuts_ids, 'provider_id': meta_ids, 'path': paths}, dtype=str)
+        
+        # load the existing mapping
+        old = self.nuts_table
+        if len(old) == 0:
+            old = pd.DataFrame(columns=['nuts_id', 'provider_id', 'path'], dtype=str)
+        
+        # compare
+        diff = pd.merge(old[['nuts_id', 'provider_id', 'path']], new, on='nuts_id', how='outer', suffixes=('_old', '_new'), indicator=True)
+        diff['status'] = np.select(
+            [diff['_merge'] == 'right_only', diff['_merge'] == 'left_only', (diff.provider_id_old != diff.provider_id_new) | (diff.path_old != diff.path_new)],
+            ['added', 'removed', 'changed'],
+            default='unchanged'
+        )
+        
+        return diff.drop(columns='_merge').sort_values('nuts_id').reset_index(drop=True)
+
+    def save_raw_metadata(self, meta: pd.DataFrame, id_column: Union[str, int], overwrite: bool = False, dry_run: bool = False) -> Union[str, pd.DataFrame]:
         """
         Pass the raw metadata dump to save it to the output locations.
         A raw dump is stored to the processing folder and the ids 
         are added to the third-party-id <-> nuts_id lookup table.
 
-        This function will overwrite existing raw metadata and possibly
-        empty existing data output directories, if overwrite is set to
-        True.
+        The new ids are compared to the existing mapping and only the
+        affected data output directories are touched: directories for new 
+        nuts_ids are created. If overwrite is set to True, directories of 
+        nuts_ids, which now belong to another provider_id or were removed,
+        are emptied. Directories of unchanged nuts_ids are always kept.
 
         Parameters
         ----------
@@ -171,61 +426,65 @@ class Bundesland(AbstractContextManager):
             Identifies the vendor's ID column in the dump.
             This is necessary to map these IDs to out NUTS ids.
         overwrite : bool
-            If True, any existing data output directory will be removed.
+            If True, the data output directory of changed and removed 
+            nuts_ids will be removed.
             This can be helpful, when the metadata changed and consequently
             the original provider_id have another associated nuts_id.
+        dry_run : bool
+            If True, nothing is written and the diff report is returned.
         
         Returns
         -------
         path : str
             Output path in the file system for reference
+        diff : pandas.DataFrame
+            If dry_run is True, the diff against the existing mapping is
+            returned instead, see diff_raw_metadata.
         """
+        # compare to the existing mapping
+        diff = self.diff_raw_metadata(meta, id_column)
+        if dry_run:
+            return diff
+
         # check if the raw metadata directory exists
         path = os.path.abspath(os.path.join(self.output_path, '..',  'raw_metadata'))
         if not os.path.exists(path):
             os.makedirs(path)
         
-        # extract the meta-ids
-        if isinstance(id_column, int):
-            meta_ids = meta.iloc[:, id_column].values
+        # get the existing data directories at once
+        if os.path.exists(self.output_path):
+            existing = set(e.name for e in os.scandir(self.output_path) if e.is_dir())
         else:
-            meta_ids = meta.loc[:, id_column].values
-        
-        # force provider ids to be strings
-        meta_ids = [str(_) for _ in meta_ids]
-        
-        # generate a mapping from original to NUTS 
-        nuts_mapping = list()
-        for i, meta_id in enumerate(meta_ids):
-            # generate nuts id
-            nuts_id = f"{self.NUTS}{'%.5d' % (10000 + i * 10)}"
-            out_dir = os.path.join(self.output_path, nuts_id)
-
-            # create the filename
-            fname = self.fname_template.format(nuts_id=nuts_id, nuts=self.NUTS)
-            # add the mapping
-            nuts_mapping.append({
-                'nuts_id': nuts_id,
-                'provider_id': meta_id, 
-                'path': './' + os.path.relpath(os.path.join(out_dir, fname), start=os.path.join(self.output_path, '..'))
-            })
-
-            # warn if the folder already exists
-            if os.path.exists(out_dir):
-                if overwrite:
-                    shutil.rmtree(out_dir)
-                else:
-                    warnings.warn(f"Generated NUTS id {nuts_id} for {meta_id}, which already exists."
-                         "Make sure that the mapping is still correct or use the overwirte=True flag to overwrite the data")
-
-            if not os.path.exists(out_dir):
-                os.makedirs(out_dir)
+            existing = set()
+
+        # handle the directories of changed and removed ids
+        affected = diff.loc[diff.status.isin(['changed', 'removed']) & diff.nuts_id.isin(existing)]
+        for nuts_id, status, provider_id in zip(affected.nuts_id, affected.status, affected.provider_id_new):
+            if overwrite:
+                shutil.rmtree(os.path.join(self.output_path, nuts_id))
+                existing.discard(nuts_id)
+            elif status == 'changed':
+                warnings.warn(f"Generated NUTS id {nuts_id} for {provider_id}, which already exists."
+                     "Make sure that the mapping is still correct or use the overwirte=True flag to overwrite the data")
+            else:
+                warnings.warn(f"NUTS id {nuts_id} is not in the new metadata anymore, but has data. Use the overwrite=True flag to remove it.")
+
+        # create all missing directories
+        for nuts_id in diff.loc[diff.status != 'removed', 'nuts_id']:
+            if nuts_id not in existing:
+                os.makedirs(os.path.join(self.output_path, nuts_id))
         
         # store raw metadata
         meta.to_csv(os.path.join(path, f'{self.NUTS}_raw_metadata.csv'), index=False)
 
-        # update the mapping
-        self.nuts_mapping = nuts_mapping
+        # update the mapping, if anything changed
+        if (diff.status != 'unchanged').any():
+            new = diff.loc[diff.status != 'removed', ['nuts_id', 'provider_id_new', 'path_new']]
+            new.columns = ['nuts_id', 'provider_id', 'path']
+
+            # removed ids are only dropped from the mapping, if their data was removed
+            drop = diff.loc[diff.status == 'removed', 'nuts_id'].tolist() if overwrite else []
+            self._update_nuts_mapping(new.to_dict(orient='records'), drop=drop)
 
         return path
 
@@ -280,18 +539,22 @@ class Bundesland(AbstractContextManager):
             data = pd.DataFrame(columns=['date'])
         
         # make some column magic
-        col_maps = self.column_mapping
-        timeseries.rename(col_maps, axis=1, inplace=True)
-
-        # TODO: handle a flag table here?
+        rename_columns(timeseries, base_path=self.base_path)
         
         # get the column that holds the variable
         var_col = [c for c in timeseries.columns if c not in ('date', 'flag', )][0]
 
         # TODO if we are creating one file per variable, we can skip this part
+        flag_col = None
         if 'flag' in timeseries.columns:
             flag_col = f'{var_col}_flag'
             timeseries.rename({'flag': flag_col}, axis=1, inplace=True)
+
+        # replace sentinels by NaN once, and keep their positions in the flag table
+        values = pd.to_numeric(timeseries[var_col], errors='coerce').to_numpy(dtype=float, copy=True)
+        sentinels = normalize_sentinels(values)
+        if sentinels.any():
+            timeseries.loc[sentinels, var_col] = np.nan
         
         # merge with data
         # If preprocessing is started multiple times this will result in duplicate columns with _x/_y suffixes 
@@ -299,15 +562,98 @@ class Bundesland(AbstractContextManager):
         
         # save
         merged.to_csv(spath, index=False, na_rep='NaN')
+
+        # rebuild the flag table of this station from the merged data
+        nuts_id = os.path.basename(os.path.dirname(spath))
+        flag_path = os.path.join(os.path.dirname(spath), f'{nuts_id}_flags.csv')
+        previous = read_flags(flag_path)
+        dates = merged['date'].values
+        masks = {var: stored_sentinels(previous, var, dates) for var in previous.variable.unique() if var != var_col}
+        masks[var_col] = merged['date'].isin(timeseries.loc[sentinels, 'date']).values
+        flag_table = station_flags(merged, masks)
+        write_flags(flag_path, flag_table)
+
+        # update the summary record of this station
+        record = summarize_timeseries(merged, nuts_id, sentinels=sentinel_counts(flag_table))
+        update_summary_file(self.summary_path, {nuts_id: record})
         
         return spath
 
-    def get_data(self, nuts_id: str, date_index: bool = True) -> pd.DataFrame:
+    @property
+    def summary_path(self) -> str:
+        return os.path.join(self.meta_path, f"{self.NUTS}_summary.json")
+
+    @property
+    def summary(self) -> pd.DataFrame:
         """
-        Read the data from the output folder and return as pandas dataframe.
-        Pass the CAMELS-de nuts_id. If date_index is False, 'date' will be a
-        data column and a generic range-index is used.
+        The precomputed summary statistics of all stations in this 
+        Bundesland, indexed by camels_id. The summary is updated on each
+        call of save_timeseries.
+        """
+        return summary_to_frame(list(read_summary(self.summary_path).values()))
+
+    def update_summary(self, nuts_ids: Union[List[str], str] = 'all', executor: Union[str, Executor] = None) -> str:
         """
+        Rebuild the summary records from the data files in the output folder.
+        This is only needed for data, that was saved before the summary was
+        introduced, as save_timeseries keeps the summary up to date.
+        All records are written at once.
+
+        Parameters
+        ----------
+        nuts_ids : list, str
+            Either a string (CAMELS-DE ID) or a list of strings. Additionally,
+            the the string literal 'all' is accepted, to look up all IDs.
+        executor : str, Executor, dask.distributed.Client, optional
+            Execution backend for the per-station tasks, see camelsp.executor.get_executor.
+            Defaults to the current process.
+        
+        Returns
+        -------
+        path : str
+            Path of the summary file
+        """
+        # get all nuts ids
+        if nuts_ids == 'all':
+            nuts_ids = self.nuts_table.nuts_id.values.tolist()
+        
+        # if only one nuts_id, make it iterable
+        if isinstance(nuts_ids, str):
+            nuts_ids = [nuts_ids]
+        
+        # calculate the records
+        results = run(self._summarize_station, nuts_ids, [(nuts_id, ) for nuts_id in nuts_ids], executor=executor)
+
+        # collect the new records
+        records = {}
+        for result in results:
+            if result.error is not None:
+                warnings.warn(f"{result.key};SummaryFailed;{result.error}")
+            elif result.value is None:
+                warnings.warn(f"ID: {result.key} has no data")
+            else:
+                records[result.key] = result.value
+        
+        # write all records at once
+        update_summary_file(self.summary_path, records)
+
+        return self.summary_path
+
+    def _summarize_station(self, nuts_id: str) -> Union[dict, None]:
+        try:
+            df = self.get_data(nuts_id, date_index=False)
+        except FileNotFoundError:
+            return None
+        return summarize_timeseries(df, nuts_id, sentinels=self._sentinel_counts(nuts_id))
+
+    def _sentinel_counts(self, nuts_id: str) -> Union[Dict[str, int], None]:
+        """The sentinel counts from the flag table, or None if the station has no flag table yet."""
+        if not has_flag_table(os.path.join(self.output_path, nuts_id, f'{nuts_id}_data.csv')):
+            return None
+        return sentinel_counts(self.get_flags(nuts_id))
+
+    def _resolve_id(self, nuts_id: str) -> str:
+        """Return the CAMELS-DE id of a provider_id. CAMELS-DE ids are returned as they are."""
         # get the mapping
         mapping = self.nuts_table
 
@@ -317,18 +663,192 @@ class Bundesland(AbstractContextManager):
             nuts_id = mapping.set_index('provider_id').loc[provider_id, 'nuts_id']
             warnings.warn(f"{nuts_id} is a provider_id and not a CAMELS-de NUTSID. provider_id might have duplicates, using the first one: {nuts_id}")
         
+        return nuts_id
+
+    def get_data(self, nuts_id: str, date_index: bool = True, compact: bool = False, columns: List[str] = None) -> pd.DataFrame:
+        """
+        Read the data from the output folder and return as pandas dataframe.
+        Pass the CAMELS-de nuts_id. If date_index is False, 'date' will be a
+        data column and a generic range-index is used.
+        If compact is True, the data is returned as float32 and the flags 
+        as int8 (1: True, 0: False, -1: NA), and stations with identical 
+        daily date ranges share the index memory. This needs less than half 
+        of the memory, at the cost of float32 precision (about 7 significant
+        digits). Do not use compact data to write back into the output folder.
+        If columns is given, only these columns (and the date) are read.
+        """
+        # check if nuts_id is actually a nuts_id or a provider_id
+        nuts_id = self._resolve_id(nuts_id)
+        
         # build the path
         path = os.path.join(self.output_path, nuts_id, f'{nuts_id}_data.csv')
 
         # read in
-        df = pd.read_csv(path, parse_dates=['date'], dtype={'q': float, 'q_flag': 'boolean', 'w': float, 'w_flag': 'boolean'})
+        return _read_data(path, date_index=date_index, compact=compact, columns=columns)
+
+    def iter_stations(self, nuts_ids: Union[List[str], str] = 'all', columns: List[str] = None, date_index: bool = True, compact: bool = False, prefetch: int = 4, event_log: EventLog = None) -> Iterator[Tuple[str, Union[pd.Series, None], pd.DataFrame]]:
+        """
+        Iterate over the data of the given stations. While the caller
+        processes a station, the next stations are read on a background
+        thread pool. Memory is bounded, as at most prefetch stations are
+        read ahead. Stations without data file, or with a file that can't
+        be read, are skipped and reported as warning (or event).
 
-        if date_index:
-            df.set_index('date', inplace=True)
+        Parameters
+        ----------
+        nuts_ids : list, str
+            Either a string (CAMELS-DE ID) or a list of strings. Additionally,
+            the the string literal 'all' is accepted, to look up all IDs.
+        columns : list, optional
+            Only read these columns, ie. ['q', 'q_flag'].
+        date_index : bool
+            If True (default), the date is used as index.
+        compact : bool
+            If True, read float32 values and int8 flags, see get_data.
+        prefetch : int
+            Number of stations read ahead.
+        event_log : EventLog, optional
+            If given, skipped stations are logged as events instead of warnings.
+
+        Yields
+        ------
+        camels_id : str
+            The CAMELS-DE ID of the station.
+        metadata : pandas.Series
+            The metadata row of the station, or None if it has no metadata.
+        data : pandas.DataFrame
+            The station data.
+
+        """
+        # get all nuts ids
+        if nuts_ids == 'all':
+            nuts_ids = [m['nuts_id'] for m in self.nuts_mapping]
         
-        return df
+        # if only one nuts_id, make it iterable
+        if isinstance(nuts_ids, str):
+            nuts_ids = [nuts_ids]
+
+        # metadata by camels_id
+        meta = _metadata_by_id(self.metadata, event_log=event_log)
+
+        items = ((nuts_id, os.path.join(self.output_path, nuts_id, f'{nuts_id}_data.csv'), meta.loc[nuts_id] if nuts_id in meta.index else None) for nuts_id in nuts_ids)
+        yield from _iter_data(items, columns=columns, date_index=date_index, compact=compact, prefetch=prefetch, event_log=event_log)
     
-    def generate_reports(self, nuts_ids: Union[List[str], str] = 'all', fmt: str = 'html', output_folder: str = None, if_exists: str = 'raise') -> Union[str, ProfileReport]:
+    def get_flags(self, nuts_id: str) -> pd.DataFrame:
+        """
+        Read the flag table of a station. The table holds the runs of
+        consecutive days with the same quality code (start and end are 
+        inclusive) for each variable. The codes are bitmasks of 
+        camelsp.flags.SENTINEL, MISSING, UNCHECKED and NO_FLAG.
+        Days without a run have no flag set.
+        Pass the CAMELS-DE nuts_id or the provider_id.
+        """
+        # check if nuts_id is actually a nuts_id or a provider_id
+        nuts_id = self._resolve_id(nuts_id)
+
+        return read_flags(os.path.join(self.output_path, nuts_id, f'{nuts_id}_flags.csv'))
+
+    def flag_share(self, variable: str = 'q', mask: int = UNCHECKED, freq: str = 'YS', nuts_ids: Union[List[str], str] = 'all') -> pd.DataFrame:
+        """
+        Calculate the share of days with any of the flag bits in mask set,
+        ie. the share of unchecked days per year, from the flag tables.
+
+        Parameters
+        ----------
+        variable : str
+            The variable, ie. 'q' or 'w'.
+        mask : int
+            Bitmask of the codes to count, ie. camelsp.flags.UNCHECKED | camelsp.flags.SENTINEL.
+        freq : str
+            Pandas offset alias of the periods. Defaults to years.
+        nuts_ids : list, str
+            Either a string (CAMELS-DE ID) or a list of strings. Additionally,
+            the the string literal 'all' is accepted, to look up all IDs.
+
+        Returns
+        -------
+        share : pandas.DataFrame
+            The share of flagged days, indexed by period, one column per station.
+
+        """
+        # get all nuts ids
+        if nuts_ids == 'all':
+            nuts_ids = [m['nuts_id'] for m in self.nuts_mapping]
+        
+        # if only one nuts_id, make it iterable
+        if isinstance(nuts_ids, str):
+            nuts_ids = [nuts_ids]
+
+        shares = {nuts_id: flag_share(self.get_flags(nuts_id), variable, mask=mask, freq=freq) for nuts_id in nuts_ids}
+        return pd.DataFrame(shares, columns=nuts_ids)
+
+    def update_flags(self, nuts_ids: Union[List[str], str] = 'all', executor: Union[str, Executor] = None) -> pd.DataFrame:
+        """
+        Rebuild the flag tables from the data files. Sentinel values, that
+        are still in the data files, are replaced by NaN and the files are
+        re-written. This is only needed for data, that was saved before 
+        save_timeseries normalized sentinels on ingest. Sentinel positions
+        already in a flag table are kept.
+
+        Parameters
+        ----------
+        nuts_ids : list, str
+            Either a string (CAMELS-DE ID) or a list of strings. Additionally,
+            the the string literal 'all' is accepted, to look up all IDs.
+        executor : str, Executor, dask.distributed.Client, optional
+            Execution backend for the per-station tasks, see camelsp.executor.get_executor.
+        
+        Returns
+        -------
+        summary : pandas.DataFrame
+            Summary of all tasks, see camelsp.executor.summarize.
+
+        """
+        # get all nuts ids
+        if nuts_ids == 'all':
+            nuts_ids = [m['nuts_id'] for m in self.nuts_mapping]
+        
+        # if only one nuts_id, make it iterable
+        if isinstance(nuts_ids, str):
+            nuts_ids = [nuts_ids]
+
+        results = run(self._update_station_flags, nuts_ids, [(nuts_id, ) for nuts_id in nuts_ids], executor=executor)
+        
+        # the sentinel counts of the summary may have changed
+        self.update_summary(nuts_ids=[r.key for r in results if r.error is None and r.value is not None])
+
+        return summarize(results)
+
+    def _update_station_flags(self, nuts_id: str) -> Union[str, None]:
+        path = os.path.join(self.output_path, nuts_id, f'{nuts_id}_data.csv')
+        if not os.path.exists(path):
+            warnings.warn(f"ID: {nuts_id} has no data")
+            return None
+        data = pd.read_csv(path, parse_dates=['date']).sort_values('date', kind='stable').reset_index(drop=True)
+        dates = data['date'].values
+
+        # replace remaining sentinels, and keep the ones already in the flag table
+        flag_path = os.path.join(self.output_path, nuts_id, f'{nuts_id}_flags.csv')
+        previous = read_flags(flag_path)
+        masks = {}
+        changed = False
+        for var in [c for c in data.columns if c != 'date' and not c.endswith('_flag')]:
+            values = pd.to_numeric(data[var], errors='coerce').to_numpy(dtype=float, copy=True)
+            sentinels = normalize_sentinels(values)
+            if sentinels.any():
+                data[var] = values
+                changed = True
+            masks[var] = sentinels | stored_sentinels(previous, var, dates)
+        
+        # write the normalized data
+        if changed:
+            with atomic_path(path) as tmp_path:
+                data.to_csv(tmp_path, index=False, na_rep='NaN')
+        
+        write_flags(flag_path, station_flags(data, masks))
+        return flag_path
+
+    def generate_reports(self, nuts_ids: Union[List[str], str] = 'all', fmt: str = 'html', output_folder: str = None, if_exists: str = 'raise', executor: Union[str, Executor] = None, journal: str = None, report_engine: str = 'ydata') -> Union[None, List[Union[ProfileReport, dict]], pd.DataFrame]:
         """
         Generate a JSON or HTML report of the data of the given nuts_ids.
 
@@ -347,8 +867,25 @@ class Bundesland(AbstractContextManager):
         if_exists : str
             The policy to handle existing files. Can be 'raise', 'replace' or
             'omit'.
+        executor : str, Executor, dask.distributed.Client, optional
+            Execution backend, see camelsp.executor.get_executor. If given,
+            each station is one task, failures do not stop the run and a 
+            summary of all tasks is returned for file formats.
+        journal : str, optional
+            Name of a resumable batch job, see camelsp.batch.run_batch. 
+            If given, the stations finished by an earlier run of the same
+            job are skipped and a summary is returned. On resume, existing
+            files are marked as finished, unless if_exists is 'replace'.
+        report_engine : str
+            'ydata' (default) uses ydata_profiling. 'native' calculates only
+            the statistics used by CAMELS-DE with numpy, which is much faster,
+            see camelsp.report.native_report. For fmt='object', the native
+            report is returned as dict.
 
         """
+        if report_engine not in ('ydata', 'native'):
+            raise ValueError(f"report_engine has to be 'ydata' or 'native', but is {report_engine}")
+
         # get all nuts ids
         if nuts_ids == 'all':
             nuts_ids = self.nuts_table.nuts_id.values.tolist()
@@ -357,12 +894,6 @@ class Bundesland(AbstractContextManager):
         if isinstance(nuts_ids, str):
             nuts_ids = [nuts_ids]
         
-        # reports container
-        reports = []
-
-        # load the logo
-        logo = _get_logo()
-
         # check format to interrupt before report is generated
         if fmt.lower() != 'object':
             # build the path
@@ -373,44 +904,84 @@ class Bundesland(AbstractContextManager):
             if not os.path.exists(output_folder):
                 os.makedirs(output_folder)
 
+        # run as resumable batch job
+        if journal is not None:
+            if fmt.lower() == 'object':
+                raise ValueError("A journal can only be used to write files, not with fmt='object'")
+            # existing reports are only written again, if they should be replaced
+            outputs = [os.path.join(output_folder, f"{nuts_id}.{fmt.lower()}") for nuts_id in nuts_ids] if if_exists != 'replace' else None
+            return run_batch(journal, self._generate_report, nuts_ids, [(nuts_id, fmt, output_folder, if_exists, report_engine) for nuts_id in nuts_ids], base_path=self.base_path, executor=executor, outputs=outputs)
+
+        # run all stations on the execution backend
+        if executor is not None:
+            results = run(self._generate_report, nuts_ids, [(nuts_id, fmt, output_folder, if_exists, report_engine) for nuts_id in nuts_ids], executor=executor)
+            if fmt.lower() == 'object':
+                return [r.value for r in results if r.value is not None]
+            return summarize(results)
+
+        # reports container
+        reports = []
+
         # instantiate all reports
         for nuts_id in nuts_ids:
-            # before reading data raise or skip if we need a report and already have it
-            if fmt.lower() != 'object':
-                filename = os.path.join(output_folder, f"{nuts_id}.{fmt.lower()}")
-                # check if the file already exists
-                if os.path.exists(filename):
-                    if if_exists == 'raise':
-                        raise FileExistsError(f"{filename} already exists and if_exists policy is 'raise'")
-                    elif if_exists == 'omit' or if_exists == 'skip':
-                        continue
-            
-            # load the data
-            try:
-                df = self.get_data(nuts_id, date_index=False)
-            except FileNotFoundError:
-                warnings.warn(f"ID: {nuts_id} has no data")
-                continue
-
-            # instantiate the report
-            #report = ProfileReport(df=df, title=nuts_id)
-            report = df.profile_report(html={'style': {'logo': logo, 'theme': 'flatly'}}, progress_bar=False, title=nuts_id, 
-                                       correlations={"pearson": {"calculate": True},
-                                                     "spearman": {"calculate": True}})
+            report = self._generate_report(nuts_id, fmt, output_folder, if_exists, report_engine)
             
             # if return, then append to container
-            if fmt.lower() == 'object':
+            if fmt.lower() == 'object' and report is not None:
                 reports.append(report)
-            
-            #else write a file
-            else:
-                report.to_file(filename)
 
         # check the format type
         if fmt.lower() == 'object':
             return reports
 
-    def generate_scatter_plots(self, nuts_ids: Union[List[str], str] = 'all', fmt: str = 'png', output_folder: str = None, if_exists: str = 'replace') -> Union[None, List[plt.Figure]]:
+    def _generate_report(self, nuts_id: str, fmt: str, output_folder: str, if_exists: str, report_engine: str = 'ydata') -> Union[None, str, ProfileReport, dict]:
+        """Generate the report of one station. Returns the report, the filename or None if skipped."""
+        # before reading data raise or skip if we need a report and already have it
+        if fmt.lower() != 'object':
+            filename = os.path.join(output_folder, f"{nuts_id}.{fmt.lower()}")
+            # check if the file already exists
+            if os.path.exists(filename):
+                if if_exists == 'raise':
+                    raise FileExistsError(f"{filename} already exists and if_exists policy is 'raise'")
+                elif if_exists == 'omit' or if_exists == 'skip':
+                    return None
+        
+        # load the data
+        try:
+            df = self.get_data(nuts_id, date_index=False)
+        except FileNotFoundError:
+            warnings.warn(f"ID: {nuts_id} has no data")
+            return None
+
+        # the native report
+        if report_engine == 'native':
+            report = native_report(df, nuts_id, sentinels=self._sentinel_counts(nuts_id))
+            if fmt.lower() == 'object':
+                return report
+            with atomic_path(filename) as tmp_path:
+                with open(tmp_path, 'w') as f:
+                    if fmt.lower() == 'json':
+                        json.dump(report, f, indent=4)
+                    else:
+                        f.write(render_html(report))
+            return filename
+
+        # instantiate the report
+        #report = ProfileReport(df=df, title=nuts_id)
+        report = df.profile_report(html={'style': {'logo': _get_logo(), 'theme': 'flatly'}}, progress_bar=False, title=nuts_id, 
+                                   correlations={"pearson": {"calculate": True},
+                                                 "spearman": {"calculate": True}})
+        
+        # if return, then return the report
+        if fmt.lower() == 'object':
+            return report
+        
+        #else write a file
+        with atomic_path(filename) as tmp_path:
+            report.to_file(tmp_path)
+        return filename
+
+    def generate_scatter_plots(self, nuts_ids: Union[List[str], str] = 'all', fmt: str = 'png', output_folder: str = None, if_exists: str = 'replace', executor: Union[str, Executor] = None, journal: str = None) -> Union[None, Dict[str, plt.Figure], pd.DataFrame]:
         """
         Generates scatterplots of the data of the given nuts_ids.
 
@@ -426,6 +997,15 @@ class Bundesland(AbstractContextManager):
         output_folder : str, optional
             Alternative output location. The default location is the 
             'report' folder in the base output location.
+        executor : str, Executor, dask.distributed.Client, optional
+            Execution backend, see camelsp.executor.get_executor. If given,
+            each station is one task, failures do not stop the run and a 
+            summary of all tasks is returned for file formats.
+        journal : str, optional
+            Name of a resumable batch job, see camelsp.batch.run_batch. 
+            If given, the stations finished by an earlier run of the same
+            job are skipped and a summary is returned. On resume, existing
+            files are marked as finished, unless if_exists is 'replace'.
         """
         # get all nuts ids
         if nuts_ids == 'all':
@@ -449,64 +1029,95 @@ class Bundesland(AbstractContextManager):
             if not os.path.exists(output_folder):
                 os.makedirs(output_folder)
 
+        # run as resumable batch job
+        if journal is not None:
+            if fmt.lower() == 'object':
+                raise ValueError("A journal can only be used to write files, not with fmt='object'")
+            # existing plots are only written again, if they should be replaced
+            outputs = [os.path.join(output_folder, f"{nuts_id}.{fmt.lower()}") for nuts_id in nuts_ids] if if_exists != 'replace' else None
+            return run_batch(journal, self._generate_scatter_plot, nuts_ids, [(nuts_id, fmt, output_folder, if_exists) for nuts_id in nuts_ids], base_path=self.base_path, executor=executor, outputs=outputs)
+
+        # run all stations on the execution backend
+        if executor is not None:
+            results = run(self._generate_scatter_plot, nuts_ids, [(nuts_id, fmt, output_folder, if_exists) for nuts_id in nuts_ids], executor=executor)
+            if fmt.lower() == 'object':
+                return {r.key: r.value for r in results if r.value is not None}
+            return summarize(results)
+
         # instantiate all plots
         n = len(nuts_ids)
         for i,nuts_id in enumerate(nuts_ids): # TODO maybe refactor to use tqdm in outer loop instead?
             print(f"{i:<4}/{n}",end='\r')
-            # before reading data raise or skip if we already have the plot
-            if fmt.lower() != 'object':
-                filename = os.path.join(output_folder, f"{nuts_id}.{fmt.lower()}")
-                # check if the file already exists
-                if os.path.exists(filename):
-                    if if_exists == 'raise':
-                        raise FileExistsError(f"{filename} already exists and if_exists policy is 'raise'")
-                    elif if_exists == 'omit' or if_exists == 'skip':
-                        continue
-
-            # load the data
-            try:
-                df = self.get_data(nuts_id)
-                    
-            except FileNotFoundError:
-                warnings.warn(f"ID: {nuts_id} has no data")
-                continue
+            fig = self._generate_scatter_plot(nuts_id, fmt, output_folder, if_exists)
 
-            # Replace -999 with NaN, -999 is sometimes used to indicate invalid values
-            df_nan = df.replace(-999, np.NaN)
-            
-            # Can't make a scatterplot, if we never have both q and w values
-            overlap = ((~df_nan['q'].isna()) & (~df_nan['w'].isna())).sum()
-            
-            if overlap == 0:
-                warnings.warn(f"{nuts_id} - Q and W were never measured at the same time.")
-            else:
-                
-                #Generate the plot
-                fig, ax = plt.subplots()
-                scatter = ax.scatter(df_nan['q'], df_nan['w'], c=df_nan.index.year)
-                legend1 = ax.legend(*scatter.legend_elements(),loc="lower right", title="Year")
-                ax.add_artist(legend1)
-                ax.set_title(nuts_id)
-                ax.grid(True)
-                ax.set_xlabel('q')
-                ax.set_ylabel('w')
-                fig.tight_layout()
-
-                # if return, then append to list
-                if fmt.lower() == 'object':
-                    scatter_plots[nuts_id] = fig
-
-                #else write a file
-                else:
-                    plt.savefig(filename, dpi='figure') #TODO metadata with ID, Gaugename etc. Needs a way to access more metadata
-                    # clear memory after saving
-                    fig.clear()
-                    plt.close(fig)
+            # if return, then append to list
+            if fmt.lower() == 'object' and fig is not None:
+                scatter_plots[nuts_id] = fig
 
         # check the format type
         if fmt.lower() == 'object':
             return scatter_plots
         return None
+
+    def _generate_scatter_plot(self, nuts_id: str, fmt: str, output_folder: str, if_exists: str) -> Union[None, str, plt.Figure]:
+        """Generate the scatter plot of one station. Returns the figure, the filename or None if skipped."""
+        # before reading data raise or skip if we already have the plot
+        if fmt.lower() != 'object':
+            filename = os.path.join(output_folder, f"{nuts_id}.{fmt.lower()}")
+            # check if the file already exists
+            if os.path.exists(filename):
+                if if_exists == 'raise':
+                    raise FileExistsError(f"{filename} already exists and if_exists policy is 'raise'")
+                elif if_exists == 'omit' or if_exists == 'skip':
+                    return None
+
+        # load the data
+        try:
+            df = self.get_data(nuts_id)
+                
+        except FileNotFoundError:
+            warnings.warn(f"ID: {nuts_id} has no data")
+            return None
+
+        # files saved before sentinels were replaced on ingest may still contain them, see update_flags
+        if not has_flag_table(os.path.join(self.output_path, nuts_id, f'{nuts_id}_data.csv')):
+            df = df.replace(list(SENTINELS), np.nan)
+
+        # Can't make a scatterplot, if the station has only one of q and w
+        missing = [c for c in ('q', 'w') if c not in df.columns]
+        if len(missing) > 0:
+            warnings.warn(f"{nuts_id} - has no {' and '.join(missing)} data.")
+            return None
+
+        # Can't make a scatterplot, if we never have both q and w values
+        overlap = ((~df['q'].isna()) & (~df['w'].isna())).sum()
+        
+        if overlap == 0:
+            warnings.warn(f"{nuts_id} - Q and W were never measured at the same time.")
+            return None
+            
+        #Generate the plot
+        fig, ax = plt.subplots()
+        scatter = ax.scatter(df['q'], df['w'], c=df.index.year)
+        legend1 = ax.legend(*scatter.legend_elements(),loc="lower right", title="Year")
+        ax.add_artist(legend1)
+        ax.set_title(nuts_id)
+        ax.grid(True)
+        ax.set_xlabel('q')
+        ax.set_ylabel('w')
+        fig.tight_layout()
+
+        # if return, then return the figure
+        if fmt.lower() == 'object':
+            return fig
+
+        #else write a file
+        with atomic_path(filename) as tmp_path:
+            fig.savefig(tmp_path, dpi='figure') #TODO metadata with ID, Gaugename etc. Needs a way to access more metadata
+        # clear memory after saving
+        fig.clear()
+        plt.close(fig)
+        return filename
         
 
     @property
@@ -598,14 +1209,12 @@ class Bundesland(AbstractContextManager):
             if os.path.isdir(fname):
                 continue
             
-            # open the file
+            # calculate hash sum for file content, read in chunks
+            h = hashlib.sha256()
             with open(fname, 'rb') as f:
-                fstream = io.BytesIO()
-                fstream.write(f.read())
-                fstream.seek(0)
-            
-            # calculate hash sum for file content
-            hsum = hashlib.sha256(fstream.read()).hexdigest()
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            hsum = h.hexdigest()
 
             # store hash sum to output dictionary
             out[fname] = hsum
@@ -627,20 +1236,21 @@ class Station():
         """
         # set the station id
         # get the mapping
-        mapping = get_full_nuts_mapping(format='csv')
-
         # make sure that camels_id is a string
         camels_id = str(camels_id)
 
+        # look up the id
+        record = lookup_station(camels_id)
+
         # check if camels_id is actually a camels_id or a provider_id
-        if camels_id in mapping.provider_id.values:
+        if record is None:
+            raise ValueError(f"{camels_id} is neither a provider_id nor a CAMELS-DE NUTSID")
+        elif record['nuts_id'] != camels_id:
             provider_id = camels_id
-            self.camels_id = mapping.set_index('provider_id').loc[provider_id, 'nuts_id']
+            self.camels_id = record['nuts_id']
             warnings.warn(f"{provider_id} is a provider_id and not a CAMELS-DE NUTSID. provider_id might have duplicates, using the first one: {camels_id}")
-        elif camels_id in mapping.nuts_id.values:
-            self.camels_id = camels_id
         else:
-            raise ValueError(f"{camels_id} is neither a provider_id nor a CAMELS-DE NUTSID")
+            self.camels_id = camels_id
 
         # get and set the Bundesland
         self.bl = Bundesland(self.camels_id[0:3])
@@ -669,21 +1279,18 @@ class Station():
         self.nuts_table = self.bl.nuts_table[self.bl.nuts_table.nuts_id == self.camels_id]
 
 
-    def get_data(self, date_index: bool = True) -> pd.DataFrame:
+    def get_data(self, date_index: bool = True, compact: bool = False) -> pd.DataFrame:
         """
         Read the data from the output folder and return as pandas dataframe.
         Pass the CAMELS-DE nuts_id. 
         If date_index is False, 'date' will be a
         data column and a generic range-index is used.
+        If compact is True, the data is returned as float32 and the flags
+        as int8 (1: True, 0: False, -1: NA), see Bundesland.get_data.
 
         """
         # read in
-        df = pd.read_csv(self.data_path, parse_dates=['date'], dtype={'q': float, 'q_flag': 'boolean', 'w': float, 'w_flag': 'boolean'})
-
-        if date_index:
-            df.set_index('date', inplace=True)
-        
-        return df
+        return _read_data(self.data_path, date_index=date_index, compact=compact)
     
 
     def save_catchment_geometry(self, catchment_geometry: gpd.GeoDataFrame, datasource: str, if_exists: str = 'raise') -> str:
@@ -0,0 +1,204 @@
+from typing import Dict, List, Union
+import os
+import json
+import hashlib
+import zipfile
+import tarfile
+
+import pandas as pd
+
+from .__version__ import __version__
+from .util import OUTPUT_PATH, RELEASE_PATH, _NUTS_LVL2_NAMES, nuts, export_metadata
+from .output import Bundesland
+from .executor import Executor, run
+
+
+# archive formats and their file extension
+FORMATS = {'zip': '.zip', 'tar': '.tar', 'tar.gz': '.tar.gz', 'tar.xz': '.tar.xz'}
+
+# files of the metadata folder, that are not released
+_EXCLUDE = ('.db', '.db-wal', '.db-shm', '.tmp', '.lock')
+
+
+def _is_released(fname: str) -> bool:
+    """Check if a file belongs into the release. Temporary files of util.atomic_path ('<root>.<pid>.tmp<ext>') are half-written."""
+    return not fname.endswith(_EXCLUDE) and '.tmp.' not in os.path.basename(fname)
+
+
+def _list_files(root: str, recursive: bool = True) -> List[str]:
+    """List all files below root, sorted."""
+    fnames = []
+    if not os.path.exists(root):
+        return fnames
+    if recursive:
+        for dirpath, _, files in os.walk(root):
+            fnames.extend([os.path.join(dirpath, fname) for fname in files])
+    else:
+        fnames = [entry.path for entry in os.scandir(root) if entry.is_file()]
+    return sorted([f for f in fnames if _is_released(f)])
+
+
+def release_parts(base_path: str = OUTPUT_PATH, states: List[str] = None, extras: bool = True) -> Dict[str, List[str]]:
+    """
+    Collect the files of each part of the release. Each state is one part
+    with all station folders, additionally the metadata, reports and
+    scatter plots are one part each.
+
+    Parameters
+    ----------
+    base_path : str
+        The output root folder.
+    states : list, optional
+        The NUTS level 2 codes of the states to release. Defaults to all
+        states with an output folder.
+    extras : bool
+        If True (default), add the metadata, reports and scatter plots.
+
+    Returns
+    -------
+    parts : dict
+        The files of each part, by part name.
+
+    """
+    if states is None:
+        states = [NUTS for NUTS in _NUTS_LVL2_NAMES.keys() if os.path.exists(os.path.join(base_path, NUTS))]
+
+    parts = {NUTS: _list_files(os.path.join(base_path, NUTS)) for NUTS in states}
+    if extras:
+        parts['metadata'] = _list_files(os.path.join(base_path, 'metadata'), recursive=False)
+        parts['reports'] = _list_files(os.path.join(base_path, 'reports'))
+        parts['scatter_plots'] = _list_files(os.path.join(base_path, 'scatter_plots'))
+
+    # omit empty parts
+    return {name: fnames for name, fnames in parts.items() if len(fnames) > 0}
+
+
+def _part_hash(digests: Dict[str, str]) -> str:
+    """Hash of a part, calculated from the relative paths and digests of its files."""
+    return hashlib.sha256(json.dumps(digests, sort_keys=True).encode()).hexdigest()
+
+
+def _write_archive(fnames: List[str], base_path: str, archive_path: str, fmt: str):
+    """
+    Stream the files into the archive. The archive is written next to the
+    target and moved into place, once it is complete.
+    """
+    tmp_path = f"{archive_path}.tmp"
+    if fmt == 'zip':
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for fname in fnames:
+                archive.write(fname, arcname=os.path.relpath(fname, base_path))
+    else:
+        mode = 'w' if fmt == 'tar' else f"w:{fmt.split('.')[1]}"
+        with tarfile.open(tmp_path, mode) as archive:
+            for fname in fnames:
+                archive.add(fname, arcname=os.path.relpath(fname, base_path), recursive=False)
+    os.replace(tmp_path, archive_path)
+
+
+def _release_part(name: str, fnames: List[str], base_path: str, release_path: str, fmt: str, previous_hash: str = None) -> dict:
+    """
+    Hash the files of one part and write its archive, if the part changed.
+    This function is run on the execution backend.
+    """
+    # reuse the digests of Bundesland.gethash, by path relative to the output root
+    digests = {os.path.relpath(fname, base_path): digest for fname, digest in Bundesland.gethash(fnames).items()}
+    part_hash = _part_hash(digests)
+
+    # skip unchanged parts
+    archive_path = os.path.join(release_path, f"{name}{FORMATS[fmt]}")
+    if part_hash == previous_hash and os.path.exists(archive_path):
+        status = 'unchanged'
+    else:
+        _write_archive(fnames, base_path, archive_path, fmt)
+        status = 'written'
+
+    return dict(
+        archive=os.path.basename(archive_path),
+        hash=part_hash,
+        sha256=Bundesland.gethash([archive_path])[archive_path],
+        status=status,
+        files=digests
+    )
+
+
+def build_release(release_path: str = RELEASE_PATH, base_path: str = OUTPUT_PATH, states: List[str] = None, fmt: str = 'zip', extras: bool = True, force: bool = False, executor: Union[str, Executor] = 'process') -> pd.DataFrame:
+    """
+    Package the output tree into one archive per state, plus archives for
+    the metadata, reports and scatter plots. The files are streamed into
+    the archives without temporary copies, and the archives are written
+    in parallel. A manifest.json with the SHA256 digest of each file and
+    archive, and a SHA256SUMS file are written to the release folder.
+    Parts whose files did not change since the last release are skipped.
+
+    Parameters
+    ----------
+    release_path : str
+        The release folder. Defaults to the RELEASE_DIR environment variable.
+    base_path : str
+        The output root folder.
+    states : list, optional
+        The states to release. Anything camelsp.nuts understands.
+        Defaults to all states with an output folder.
+    fmt : str
+        Archive format. One of 'zip', 'tar', 'tar.gz' or 'tar.xz'.
+    extras : bool
+        If True (default), the metadata, reports and scatter plots are released.
+    force : bool
+        If True, all archives are written, even if unchanged.
+    executor : str, Executor, dask.distributed.Client
+        Execution backend of the per-archive tasks, see
+        camelsp.executor.get_executor. Defaults to a local process pool.
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        One row per archive with its status ('written', 'unchanged' or
+        'failed'), the number of files and the error, if any.
+
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt has to be one of {', '.join(FORMATS.keys())}, but is {fmt}")
+    if states is not None:
+        states = [nuts(state) for state in states]
+    if not os.path.exists(release_path):
+        os.makedirs(release_path)
+
+    # make sure the flat metadata files are up to date
+    if extras:
+        export_metadata(base_path=base_path)
+
+    # load the last manifest
+    manifest_path = os.path.join(release_path, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    else:
+        manifest = dict(archives={})
+    previous = {} if force or manifest.get('format') != fmt else {name: part['hash'] for name, part in manifest['archives'].items()}
+
+    # one task per part
+    parts = release_parts(base_path=base_path, states=states, extras=extras)
+    names = list(parts.keys())
+    results = run(_release_part, names, [(name, parts[name], base_path, release_path, fmt, previous.get(name)) for name in names], executor=executor)
+
+    # update the manifest, keep failed and not requested parts from the last release
+    for result in results:
+        if result.error is None:
+            manifest['archives'][result.key] = {k: v for k, v in result.value.items() if k != 'status'}
+    manifest.update(version=__version__, created=pd.Timestamp.now().isoformat(), format=fmt)
+
+    with open(f"{manifest_path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    # checksums of the archives, in sha256sum format
+    with open(os.path.join(release_path, 'SHA256SUMS'), 'w') as f:
+        f.write(''.join([f"{part['sha256']}  {part['archive']}\n" for _, part in sorted(manifest['archives'].items())]))
+
+    return pd.DataFrame({
+        'archive': [result.key for result in results],
+        'status': ['failed' if result.error is not None else result.value['status'] for result in results],
+        'n_files': [len(parts[result.key]) for result in results],
+        'error': [result.error for result in results],
+    }).set_index('archive')
@@ -0,0 +1,259 @@
+from typing import Dict, List, Tuple, Union
+from string import Template
+import html
+
+import pandas as pd
+import numpy as np
+
+from .util import SENTINELS, _get_logo
+
+
+# quantiles of the distribution section
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def _rank(values: np.ndarray) -> np.ndarray:
+    """Ranks starting at 1, ties get the average rank."""
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    average = np.cumsum(counts) - (counts - 1) / 2
+    return average[inverse]
+
+
+def _pearson(x: np.ndarray, y: np.ndarray) -> Union[float, None]:
+    if x.size < 2 or np.std(x) == 0 or np.std(y) == 0:
+        return None
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+def _gaps(dates: np.ndarray, valid: np.ndarray) -> Tuple[int, int]:
+    """Number and longest length in days of the gaps between the first and last valid value."""
+    days = np.unique(dates[valid].astype('datetime64[D]').astype(np.int64))
+    if days.size < 2:
+        return 0, 0
+    steps = np.diff(days) - 1
+    steps = steps[steps > 0]
+    return int(steps.size), int(steps.max()) if steps.size > 0 else 0
+
+
+def _variable_stats(dates: np.ndarray, values: np.ndarray, bins: int, n_sentinel: int = None) -> Dict[str, Union[int, float, str, list, None]]:
+    """
+    The statistics of one data variable. NaN and sentinels are missing.
+    If n_sentinel is given, the sentinels were replaced by NaN on ingest
+    and the values are not searched for them.
+    """
+    nan_mask = np.isnan(values)
+    if n_sentinel is None:
+        sentinel_mask = np.isin(values, SENTINELS)
+        n_sentinel = int(sentinel_mask.sum())
+        n_missing = int(nan_mask.sum())
+        valid = ~(nan_mask | sentinel_mask)
+    else:
+        n_missing = int(nan_mask.sum()) - n_sentinel
+        valid = ~nan_mask
+    v = values[valid]
+
+    n_gaps, longest_gap = _gaps(dates, valid)
+    stats = dict(
+        n=int(values.size),
+        count=int(v.size),
+        n_missing=n_missing,
+        n_sentinel=n_sentinel,
+        p_missing=float((~valid).mean()) if values.size > 0 else None,
+        first=str(pd.Timestamp(dates[valid][0]).date()) if v.size > 0 else None,
+        last=str(pd.Timestamp(dates[valid][-1]).date()) if v.size > 0 else None,
+        n_gaps=n_gaps,
+        longest_gap=longest_gap,
+    )
+
+    # distribution
+    if v.size > 0:
+        counts, edges = np.histogram(v, bins=bins)
+        stats.update(
+            mean=float(v.mean()),
+            std=float(v.std(ddof=1)) if v.size > 1 else None,
+            min=float(v.min()),
+            max=float(v.max()),
+            n_zeros=int(np.sum(v == 0)),
+            n_negative=int(np.sum(v < 0)),
+            quantiles={f'{int(q * 100)}%': float(x) for q, x in zip(QUANTILES, np.quantile(v, QUANTILES))},
+            histogram=dict(counts=counts.tolist(), bin_edges=edges.tolist())
+        )
+    else:
+        stats.update(mean=None, std=None, min=None, max=None, n_zeros=0, n_negative=0, quantiles={}, histogram=dict(counts=[], bin_edges=[]))
+
+    # missing values per year
+    years = dates.astype('datetime64[Y]').astype(int) + 1970
+    unique_years, inverse = np.unique(years, return_inverse=True)
+    stats['missing_by_year'] = {str(year): int(n) for year, n in zip(unique_years, np.bincount(inverse, weights=~valid, minlength=unique_years.size))}
+
+    return stats
+
+
+def _flag_stats(flags: pd.Series) -> Dict[str, Union[int, float, None]]:
+    """The summary of one flag column."""
+    flags = flags.astype('boolean')
+    n_true = int(flags.sum())
+    n_missing = int(flags.isna().sum())
+    n_false = int(len(flags) - n_true - n_missing)
+    return dict(
+        n=int(len(flags)),
+        n_true=n_true,
+        n_false=n_false,
+        n_missing=n_missing,
+        p_true=float(n_true / (n_true + n_false)) if n_true + n_false > 0 else None
+    )
+
+
+def _correlation_matrix(r: Union[float, None]) -> List[Dict[str, Union[float, None]]]:
+    """The q-w correlation as list of records, in the structure ydata_profiling uses."""
+    return [{'q': 1.0, 'w': r}, {'q': r, 'w': 1.0}]
+
+
+def native_report(data: pd.DataFrame, camels_id: str, bins: int = 30, sentinels: Dict[str, int] = None) -> dict:
+    """
+    Calculate the data report of one station, without ydata_profiling.
+    Only the statistics used by CAMELS-DE are calculated: the missing value
+    patterns, distribution of each variable, flag summaries and the
+    Pearson and Spearman correlation between q and w. NaN and sentinel
+    values are counted as missing and excluded from all statistics.
+    The correlations use the same structure as the ydata_profiling JSON
+    report, thus existing readers keep working.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The station data. 'date' has to be a data column.
+    camels_id : str
+        The CAMELS-DE id of the station.
+    bins : int
+        Number of histogram bins.
+    sentinels : dict, optional
+        Number of sentinel values per variable, that were already replaced
+        by NaN on ingest, see camelsp.flags.sentinel_counts. Only if not
+        given, ie. for data without flag table, the values are searched
+        for sentinels.
+
+    Returns
+    -------
+    report : dict
+        The report. All values are JSON serializable.
+
+    """
+    dates = pd.to_datetime(data['date']).values
+    variables = [c for c in data.columns if c != 'date' and not c.endswith('_flag')]
+    flag_columns = [c for c in data.columns if c.endswith('_flag')]
+
+    report = dict(
+        analysis=dict(title=camels_id, engine='native', generated=pd.Timestamp.now().isoformat(timespec='seconds')),
+        table=dict(
+            n=int(len(data)),
+            n_var=int(len(data.columns)),
+            start=str(pd.Timestamp(dates.min()).date()) if len(data) > 0 else None,
+            end=str(pd.Timestamp(dates.max()).date()) if len(data) > 0 else None,
+            n_duplicated_dates=int(len(dates) - np.unique(dates).size),
+        ),
+        variables={},
+        flags={},
+        correlations={},
+    )
+
+    # the variables
+    valid_values = {}
+    for var in variables:
+        values = pd.to_numeric(data[var], errors='coerce').values.astype(float)
+        if sentinels is None:
+            report['variables'][var] = _variable_stats(dates, values, bins)
+            valid_values[var] = np.where(np.isin(values, SENTINELS), np.nan, values)
+        else:
+            report['variables'][var] = _variable_stats(dates, values, bins, n_sentinel=sentinels.get(var, 0))
+            valid_values[var] = values
+
+    # the flags
+    for col in flag_columns:
+        report['flags'][col] = _flag_stats(data[col])
+
+    # correlation between q and w
+    if 'q' in valid_values and 'w' in valid_values:
+        both = ~(np.isnan(valid_values['q']) | np.isnan(valid_values['w']))
+        q, w = valid_values['q'][both], valid_values['w'][both]
+        report['correlations']['pearson'] = _correlation_matrix(_pearson(q, w))
+        report['correlations']['spearman'] = _correlation_matrix(_pearson(_rank(q), _rank(w)) if q.size > 1 else None)
+
+    return report
+
+
+_HTML = Template("""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>
+body { font-family: sans-serif; margin: 2em auto; max-width: 1000px; color: #222; }
+header { display: flex; align-items: center; gap: 1em; }
+header img { height: 48px; }
+table { border-collapse: collapse; margin: 0.5em 0 1.5em 0; }
+td, th { border-bottom: 1px solid #ddd; padding: 0.25em 0.75em; text-align: right; }
+th:first-child, td:first-child { text-align: left; }
+section { margin-bottom: 2em; }
+svg rect { fill: #2c3e50; }
+.muted { color: #777; font-size: 0.9em; }
+</style>
+</head>
+<body>
+<header><img src="$logo" alt="CAMELS-DE"><h1>$title</h1></header>
+<p class="muted">Generated $generated</p>
+<section><h2>Overview</h2>$table</section>
+$variables
+<section><h2>Flags</h2>$flags</section>
+<section><h2>Correlations</h2>$correlations</section>
+</body>
+</html>
+""")
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.4g}'
+    return html.escape(str(value))
+
+
+def _html_table(rows: Dict[str, object], header: List[str] = None) -> str:
+    head = f"<tr>{''.join(f'<th>{html.escape(h)}</th>' for h in header)}</tr>" if header is not None else ''
+    body = ''.join(f"<tr><td>{html.escape(str(key))}</td>{''.join(f'<td>{_fmt(v)}</td>' for v in (value if isinstance(value, (list, tuple)) else [value]))}</tr>" for key, value in rows.items())
+    return f"<table>{head}{body}</table>"
+
+
+def _html_histogram(counts: List[int], width: int = 600, height: int = 120) -> str:
+    if len(counts) == 0 or max(counts) == 0:
+        return ''
+    bar = width / len(counts)
+    rects = ''.join(f'<rect x="{i * bar:.1f}" y="{height - c / max(counts) * height:.1f}" width="{bar * 0.9:.1f}" height="{c / max(counts) * height:.1f}"/>' for i, c in enumerate(counts))
+    return f'<svg width="{width}" height="{height}">{rects}</svg>'
+
+
+def render_html(report: dict) -> str:
+    """Render a native report to a single, self-contained HTML page."""
+    variables = []
+    for var, stats in report['variables'].items():
+        rows = {k: stats[k] for k in ('count', 'n_missing', 'n_sentinel', 'p_missing', 'first', 'last', 'n_gaps', 'longest_gap', 'mean', 'std', 'min', 'max', 'n_zeros', 'n_negative')}
+        rows.update(stats['quantiles'])
+        edges = stats['histogram']['bin_edges']
+        caption = f"<p class='muted'>Histogram {_fmt(edges[0])} - {_fmt(edges[-1])}</p>" if len(edges) > 0 else ''
+        years = {year: n for year, n in stats['missing_by_year'].items() if n > 0}
+        missing = f"<h3>Missing values per year</h3>{_html_table(years, ['year', 'missing'])}" if len(years) > 0 else ''
+        variables.append(f"<section><h2>{html.escape(var)}</h2>{_html_table(rows)}{_html_histogram(stats['histogram']['counts'])}{caption}{missing}</section>")
+
+    flags = {col: [s['n_true'], s['n_false'], s['n_missing'], s['p_true']] for col, s in report['flags'].items()}
+    correlations = {method: matrix[0]['w'] for method, matrix in report['correlations'].items()}
+
+    return _HTML.substitute(
+        title=html.escape(report['analysis']['title']),
+        logo=_get_logo(),
+        generated=report['analysis']['generated'],
+        table=_html_table(report['table']),
+        variables='\n'.join(variables),
+        flags=_html_table(flags, ['flag', 'true', 'false', 'missing', 'share true']) if len(flags) > 0 else '<p>No flags</p>',
+        correlations=_html_table(correlations, ['q ~ w', 'r']) if len(correlations) > 0 else '<p>No correlation, q and w are not both present</p>'
+    )
@@ -0,0 +1,334 @@
+from typing import Callable, Dict, List, Tuple, Union
+import os
+
+import pandas as pd
+import numpy as np
+
+from .util import OUTPUT_PATH, _NUTS_LVL2_NAMES, get_metadata, update_metadata
+from .cube import open_cube, build_cube, _read_station
+from .executor import Executor, run
+
+
+# All signatures take the date-aligned discharge array of shape (stations, days)
+# with NaN for missing values and the DatetimeIndex of the columns. They return
+# one value per station.
+
+def q_mean(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Mean daily discharge."""
+    return np.nanmean(Q, axis=1)
+
+
+def q5(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """5% flow quantile (low flow)."""
+    return np.nanpercentile(Q, 5, axis=1)
+
+
+def q95(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """95% flow quantile (high flow)."""
+    return np.nanpercentile(Q, 95, axis=1)
+
+
+def lyne_hollick(Q: np.ndarray, alpha: float = 0.925, passes: int = 3) -> np.ndarray:
+    """
+    Separate the baseflow with the recursive digital filter of Lyne & Hollick
+    (1979). The passes alternate between forward and backward. The recursion
+    runs along the days, while each step is vectorized across all stations.
+    The filter restarts after each gap of missing values.
+
+    Parameters
+    ----------
+    Q : numpy.ndarray
+        Discharge of shape (stations, days). NaN for missing values.
+    alpha : float
+        The filter parameter.
+    passes : int
+        Number of filter passes.
+
+    Returns
+    -------
+    baseflow : numpy.ndarray
+        The baseflow, same shape as Q.
+
+    """
+    baseflow = np.asarray(Q, dtype=float)
+    n_days = baseflow.shape[1]
+
+    for p in range(passes):
+        q = baseflow
+        baseflow = np.full_like(q, np.nan)
+
+        # quickflow and discharge of the last step, for all stations
+        quickflow = np.zeros(q.shape[0])
+        previous = np.full(q.shape[0], np.nan)
+
+        days = range(n_days) if p % 2 == 0 else range(n_days - 1, -1, -1)
+        for t in days:
+            current = q[:, t]
+            with np.errstate(invalid='ignore'):
+                quickflow = alpha * quickflow + (1 + alpha) / 2 * (current - previous)
+
+                # restart after gaps and keep the quickflow positive
+                quickflow = np.where(np.isnan(quickflow), 0.0, np.maximum(quickflow, 0.0))
+                baseflow[:, t] = np.clip(current - quickflow, 0.0, current)
+            previous = current
+
+    return baseflow
+
+
+def baseflow_index(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Ratio of the baseflow (Lyne-Hollick filter) to the total discharge."""
+    baseflow = lyne_hollick(Q)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(baseflow, axis=1) / np.nansum(Q, axis=1)
+
+
+def _frequency(mask: np.ndarray, Q: np.ndarray) -> np.ndarray:
+    """Number of days per year, on which the mask is True."""
+    n_valid = np.sum(~np.isnan(Q), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return mask.sum(axis=1) / n_valid * 365.25
+
+
+def _mean_duration(mask: np.ndarray) -> np.ndarray:
+    """Mean length of the runs of consecutive True values in each row."""
+    n_runs = mask[:, 0].astype(int) + np.sum(mask[:, 1:] & ~mask[:, :-1], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n_runs > 0, mask.sum(axis=1) / n_runs, np.nan)
+
+
+def _high_flow(Q: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid='ignore'):
+        return Q > 9 * np.nanmedian(Q, axis=1, keepdims=True)
+
+
+def _low_flow(Q: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid='ignore'):
+        return Q < 0.2 * np.nanmean(Q, axis=1, keepdims=True)
+
+
+def high_q_freq(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Frequency of high-flow days (> 9 times the median daily flow) in days per year."""
+    return _frequency(_high_flow(Q), Q)
+
+
+def high_q_dur(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Mean duration of high-flow events (> 9 times the median daily flow) in days."""
+    return _mean_duration(_high_flow(Q))
+
+
+def low_q_freq(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Frequency of low-flow days (< 0.2 times the mean daily flow) in days per year."""
+    return _frequency(_low_flow(Q), Q)
+
+
+def low_q_dur(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Mean duration of low-flow events (< 0.2 times the mean daily flow) in days."""
+    return _mean_duration(_low_flow(Q))
+
+
+def zero_q_freq(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Share of days with zero discharge."""
+    n_valid = np.sum(~np.isnan(Q), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sum(Q == 0, axis=1) / n_valid
+
+
+def slope_fdc(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Slope of the flow duration curve between the 33% and 66% exceedance probability of the log-transformed flows."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        q33 = np.log(np.nanpercentile(Q, 67, axis=1))
+        q66 = np.log(np.nanpercentile(Q, 34, axis=1))
+        slope = (q33 - q66) / (0.66 - 0.33)
+    return np.where(np.isfinite(slope), slope, np.nan)
+
+
+def hfd_mean(Q: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Mean half-flow date: the day of the hydrological year (starting on
+    1 November), on which the cumulative discharge reaches half of the
+    annual discharge. Only complete years are used.
+    """
+    total = np.zeros(Q.shape[0])
+    count = np.zeros(Q.shape[0])
+
+    # the hydrological year starting on 1 November
+    years = dates.year + (dates.month >= 11)
+    for year in np.unique(years):
+        cols = np.flatnonzero(years == year)
+        if cols.size < 365:
+            continue
+
+        # only stations without missing values in this year
+        Qy = Q[:, cols]
+        complete = ~np.isnan(Qy).any(axis=1) & (np.sum(Qy, axis=1) > 0)
+        if not complete.any():
+            continue
+
+        cumulative = np.cumsum(Qy[complete], axis=1)
+        day = np.argmax(cumulative >= cumulative[:, -1:] / 2, axis=1)
+        total[complete] += day
+        count[complete] += 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+SIGNATURES: Dict[str, Callable[[np.ndarray, pd.DatetimeIndex], np.ndarray]] = {
+    'q_mean': q_mean,
+    'q5': q5,
+    'q95': q95,
+    'baseflow_index': baseflow_index,
+    'high_q_freq': high_q_freq,
+    'high_q_dur': high_q_dur,
+    'low_q_freq': low_q_freq,
+    'low_q_dur': low_q_dur,
+    'zero_q_freq': zero_q_freq,
+    'slope_fdc': slope_fdc,
+    'hfd_mean': hfd_mean,
+}
+
+
+def calculate_signatures(Q: np.ndarray, dates: pd.DatetimeIndex, camels_ids: List[str], signatures: List[str] = None, min_days: int = 365) -> pd.DataFrame:
+    """
+    Calculate the hydrological signatures of all stations at once.
+
+    Parameters
+    ----------
+    Q : numpy.ndarray
+        Date-aligned discharge of shape (stations, days). NaN for missing values.
+    dates : pandas.DatetimeIndex
+        The dates of the columns of Q. Consecutive days.
+    camels_ids : list
+        The CAMELS-DE ids of the rows of Q.
+    signatures : list, optional
+        The names of the signatures to calculate, see SIGNATURES.
+        Defaults to all signatures.
+    min_days : int
+        Stations with less valid days get NaN for all signatures.
+
+    Returns
+    -------
+    signatures : pandas.DataFrame
+        One row per station, one column per signature, indexed by camels_id.
+
+    """
+    if signatures is None:
+        signatures = list(SIGNATURES.keys())
+    unknown = [name for name in signatures if name not in SIGNATURES]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown signatures: {', '.join(unknown)}. Available are: {', '.join(SIGNATURES.keys())}")
+
+    # mask stations with too little data
+    Q = np.asarray(Q, dtype=float)
+    enough = np.sum(~np.isnan(Q), axis=1) >= min_days
+
+    result = pd.DataFrame(index=pd.Index(camels_ids, name='camels_id'), columns=signatures, dtype=float)
+    if enough.any():
+        for name in signatures:
+            result.loc[enough, name] = SIGNATURES[name](Q[enough], dates)
+
+    return result
+
+
+def _state_array(base_path: str, nuts_lvl2: str, camels_ids: List[str], start: str = None, end: str = None, use_cube: bool = False) -> Tuple[np.ndarray, pd.DatetimeIndex]:
+    """
+    Load the date-aligned discharge of the given stations, either from the
+    cube, or from the data files.
+    """
+    if use_cube:
+        cube = open_cube('q', base_path=base_path)
+        first = cube.column(start) if start is not None else 0
+        last = cube.column(end) + 1 if end is not None else len(cube.dates)
+        rows = [cube.row(camels_id) for camels_id in camels_ids]
+        return np.asarray(cube.values[rows, first:last], dtype=float), cube.dates[first:last]
+
+    # read all stations of the state
+    data = [_read_station(os.path.join(base_path, nuts_lvl2, camels_id, f'{camels_id}_data.csv'), 'q') for camels_id in camels_ids]
+    days = [d[0] for d in data if d[0].size > 0]
+    if len(days) == 0:
+        return np.full((len(camels_ids), 0), np.nan), pd.DatetimeIndex([], name='date')
+
+    # the date range
+    first = np.datetime64(start, 'D').astype(np.int64) if start is not None else min(d.min() for d in days)
+    last = np.datetime64(end, 'D').astype(np.int64) if end is not None else max(d.max() for d in days)
+
+    # fill the array
+    Q = np.full((len(camels_ids), max(last - first + 1, 0)), np.nan)
+    for row, (d, values, _) in enumerate(data):
+        inside = (d >= first) & (d <= last)
+        Q[row, d[inside] - first] = values[inside]
+
+    dates = pd.date_range(pd.Timestamp(np.datetime64(int(first), 'D')), periods=Q.shape[1], freq='D', name='date')
+    return Q, dates
+
+
+def _state_signatures(base_path: str, nuts_lvl2: str, camels_ids: List[str], signatures: List[str], start: str, end: str, min_days: int, use_cube: bool) -> pd.DataFrame:
+    """
+    Calculate the signatures of all stations in one state.
+    This function is run on the execution backend.
+    """
+    Q, dates = _state_array(base_path, nuts_lvl2, camels_ids, start=start, end=end, use_cube=use_cube)
+    return calculate_signatures(Q, dates, camels_ids, signatures=signatures, min_days=min_days)
+
+
+def station_signatures(signatures: List[str] = None, start: str = None, end: str = None, min_days: int = 365, use_cube: bool = None, base_path: str = OUTPUT_PATH, executor: Union[str, Executor] = 'process', save: bool = True) -> pd.DataFrame:
+    """
+    Calculate the hydrological signatures of all stations and add them to
+    the metadata. The signatures are calculated on the date-aligned array
+    of each state, vectorized across the stations. The states are
+    processed in parallel and the metadata is updated once at the end.
+
+    Parameters
+    ----------
+    signatures : list, optional
+        The names of the signatures to calculate, see SIGNATURES.
+        Defaults to all signatures.
+    start, end : str, optional
+        Restrict the calculation to this period.
+    min_days : int
+        Stations with less valid days get NaN for all signatures.
+    use_cube : bool, optional
+        If True, the discharge is read from the national data cube, which
+        is updated first. If False, the data files are read.
+        Defaults to True, if a discharge cube exists.
+    base_path : str
+        The output root folder.
+    executor : str, Executor, dask.distributed.Client
+        Execution backend of the per-state tasks, see
+        camelsp.executor.get_executor. Defaults to a local process pool.
+    save : bool
+        If True (default), the signatures are written to the metadata.
+
+    Returns
+    -------
+    signatures : pandas.DataFrame
+        One row per station, one column per signature, indexed by camels_id.
+
+    """
+    # use the cube if it exists
+    if use_cube is None:
+        use_cube = os.path.exists(os.path.join(base_path, 'cube', 'q', 'index.json'))
+    if use_cube:
+        build_cube('q', base_path=base_path)
+
+    # get the stations of each state from the metadata
+    meta = get_metadata(base_path=base_path)
+    jobs = [(base_path, NUTS, meta.loc[meta.nuts_lvl2 == NUTS, 'camels_id'].astype(str).tolist(), signatures, start, end, min_days, use_cube) for NUTS in _NUTS_LVL2_NAMES.keys()]
+    jobs = [job for job in jobs if len(job[2]) > 0]
+
+    # one task per state
+    results = run(_state_signatures, [job[1] for job in jobs], jobs, executor=executor)
+    failed = [r for r in results if r.error is not None]
+    if len(failed) > 0:
+        raise RuntimeError(f"Calculating the signatures failed for {', '.join(r.key for r in failed)}:\n{failed[0].traceback}")
+
+    if len(results) > 0:
+        result = pd.concat([r.value for r in results])
+    else:
+        result = calculate_signatures(np.empty((0, 0)), pd.DatetimeIndex([]), [], signatures=signatures)
+
+    # write all signatures with one metadata update
+    if save and len(result) > 0:
+        update_metadata(result.reset_index(), base_path=base_path, id_column='camels_id')
+
+    return result
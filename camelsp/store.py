@@ -0,0 +1,270 @@
+from typing import Any, Dict, List, Union
+from contextlib import contextmanager
+import os
+import json
+import sqlite3
+
+import pandas as pd
+import numpy as np
+
+
+# columns of the metadata table, that are always stored as text
+_TEXT_COLUMNS = ('camels_id', 'provider_id', 'camels_path', 'nuts_lvl2', 'federal_state')
+
+# keys of a nuts mapping record
+_MAPPING_KEYS = ('nuts_id', 'provider_id', 'path')
+
+
+def _quote(name: str) -> str:
+    """Quote a column name for SQLite."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _to_sql(value: Any) -> Any:
+    """Convert a pandas / numpy scalar into a value SQLite can store."""
+    if value is None:
+        return None
+    if isinstance(value, (float, np.floating)) and np.isnan(value):
+        return None
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class MetadataStore():
+    """
+    SQLite store of the metadata table and the nuts mapping of all states.
+    The database is located at 'metadata/metadata.db' in the output folder.
+    Both tables are indexed on the CAMELS-DE id, the provider_id and the
+    NUTS level 2 code. Every update runs in one transaction, thus parallel
+    writers are safe.
+
+    On first use, an existing metadata.csv and nuts_mapping.json are imported.
+    Use export to write the flat files for a release.
+
+    """
+    def __init__(self, base_path: str, timeout: float = 30.0):
+        """
+        Parameters
+        ----------
+        base_path : str
+            The output root folder.
+        timeout : float
+            Seconds to wait for a lock held by another writer.
+        """
+        self.base_path = base_path
+        self.meta_path = os.path.join(base_path, 'metadata')
+        self.path = os.path.join(self.meta_path, 'metadata.db')
+        self.timeout = timeout
+
+        # create the database. sqlite creates the file on connect, thus
+        # check for the schema, and check again within the write transaction,
+        # in case another process created it in between
+        if not os.path.exists(self.meta_path):
+            os.makedirs(self.meta_path, exist_ok=True)
+        with self._read() as conn:
+            initialized = self._has_schema(conn)
+        if not initialized:
+            with self.transaction() as conn:
+                if not self._has_schema(conn):
+                    self._create_schema(conn)
+                    self._import_files(conn)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction. Other writers wait until it is committed."""
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _read(self):
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _has_schema(self, conn: sqlite3.Connection) -> bool:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'nuts_mapping'").fetchone() is not None
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        conn.execute('CREATE TABLE IF NOT EXISTS nuts_mapping (nuts_id TEXT PRIMARY KEY, provider_id TEXT, path TEXT, nuts_lvl2 TEXT)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_nuts_mapping_provider_id ON nuts_mapping (provider_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_nuts_mapping_nuts_lvl2 ON nuts_mapping (nuts_lvl2)')
+
+    def _create_metadata_table(self, conn: sqlite3.Connection, columns: List[str]):
+        # keep the column order of the first metadata
+        definitions = [f"{_quote(c)} TEXT PRIMARY KEY" if c == 'camels_id' else f"{_quote(c)} TEXT" if c in _TEXT_COLUMNS else _quote(c) for c in columns]
+        conn.execute(f"CREATE TABLE metadata ({', '.join(definitions)})")
+        conn.execute('CREATE INDEX ix_metadata_provider_id ON metadata (provider_id)')
+        conn.execute('CREATE INDEX ix_metadata_nuts_lvl2 ON metadata (nuts_lvl2)')
+
+    def _import_files(self, conn: sqlite3.Connection):
+        """Import an existing nuts_mapping.json and metadata.csv."""
+        fname = os.path.join(self.meta_path, 'nuts_mapping.json')
+        if os.path.exists(fname):
+            with open(fname, 'r') as f:
+                mapping = [m for m in json.load(f) if len(m) > 0]
+            self._upsert_mapping(conn, mapping)
+
+        fname = os.path.join(self.meta_path, 'metadata.csv')
+        if os.path.exists(fname):
+            self._insert_metadata(conn, pd.read_csv(fname, dtype={'provider_id': str}))
+
+    def _metadata_columns(self, conn: sqlite3.Connection) -> List[str]:
+        return [row[1] for row in conn.execute('PRAGMA table_info(metadata)')]
+
+    def _insert_metadata(self, conn: sqlite3.Connection, metadata: pd.DataFrame):
+        columns = self._metadata_columns(conn)
+        if len(columns) == 0:
+            self._create_metadata_table(conn, metadata.columns.tolist())
+        rows = [[_to_sql(v) for v in row] for row in metadata.itertuples(index=False, name=None)]
+        placeholders = ', '.join(['?'] * len(metadata.columns))
+        # upsert in place, so that the stations keep their position
+        updates = ', '.join(f"{_quote(c)} = excluded.{_quote(c)}" for c in metadata.columns if c != 'camels_id')
+        conflict = f"ON CONFLICT (camels_id) DO UPDATE SET {updates}" if len(updates) > 0 else "ON CONFLICT (camels_id) DO NOTHING"
+        conn.executemany(f"INSERT INTO metadata ({', '.join(_quote(c) for c in metadata.columns)}) VALUES ({placeholders}) {conflict}", rows)
+
+    def _upsert_mapping(self, conn: sqlite3.Connection, mapping: List[Dict[str, str]]):
+        rows = [(m['nuts_id'], m.get('provider_id'), m.get('path'), m['nuts_id'][:3]) for m in mapping]
+        # upsert in place, so that the stations keep their position
+        conn.executemany(
+            'INSERT INTO nuts_mapping (nuts_id, provider_id, path, nuts_lvl2) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (nuts_id) DO UPDATE SET provider_id = excluded.provider_id, path = excluded.path, nuts_lvl2 = excluded.nuts_lvl2',
+            rows
+        )
+
+    # nuts mapping
+
+    def get_nuts_mapping(self, nuts_lvl2: str = None) -> List[Dict[str, str]]:
+        """Get the nuts mapping records of all states, or only of the given state."""
+        with self._read() as conn:
+            if nuts_lvl2 is None:
+                rows = conn.execute('SELECT nuts_id, provider_id, path FROM nuts_mapping ORDER BY rowid').fetchall()
+            else:
+                rows = conn.execute('SELECT nuts_id, provider_id, path FROM nuts_mapping WHERE nuts_lvl2 = ? ORDER BY rowid', (nuts_lvl2, )).fetchall()
+        return [dict(zip(_MAPPING_KEYS, row)) for row in rows]
+
+    def update_nuts_mapping(self, new_nuts: List[Dict[str, str]], drop: List[str] = None):
+        """Insert or replace the given records and remove the nuts_ids in drop, in one transaction."""
+        if drop is None:
+            drop = []
+        with self.transaction() as conn:
+            conn.executemany('DELETE FROM nuts_mapping WHERE nuts_id = ?', [(nuts_id, ) for nuts_id in drop])
+            self._upsert_mapping(conn, new_nuts)
+
+    def lookup(self, key: str) -> Union[Dict[str, str], None]:
+        """
+        Find the nuts mapping record of a CAMELS-DE id, or of a provider_id.
+        If the provider_id is not unique, the first record is returned.
+        """
+        with self._read() as conn:
+            row = conn.execute('SELECT nuts_id, provider_id, path FROM nuts_mapping WHERE nuts_id = ?', (key, )).fetchone()
+            if row is None:
+                row = conn.execute('SELECT nuts_id, provider_id, path FROM nuts_mapping WHERE provider_id = ? ORDER BY rowid LIMIT 1', (key, )).fetchone()
+        return dict(zip(_MAPPING_KEYS, row)) if row is not None else None
+
+    # metadata
+
+    def has_metadata(self) -> bool:
+        with self._read() as conn:
+            return len(self._metadata_columns(conn)) > 0
+
+    def get_metadata(self, nuts_lvl2: str = None) -> pd.DataFrame:
+        """Get the metadata of all stations, or only of the given state."""
+        with self._read() as conn:
+            if nuts_lvl2 is None:
+                df = pd.read_sql_query('SELECT * FROM metadata ORDER BY rowid', conn)
+            else:
+                df = pd.read_sql_query('SELECT * FROM metadata WHERE nuts_lvl2 = ? ORDER BY rowid', conn, params=(nuts_lvl2, ))
+
+        # columns without any value are returned as NaN, like from a CSV
+        for col in df.columns:
+            if col not in _TEXT_COLUMNS and df[col].isna().all():
+                df[col] = df[col].astype(float)
+        return df
+
+    def update_metadata(self, new_metadata: pd.DataFrame, id_column: str, seed: pd.DataFrame = None):
+        """
+        Update the metadata in one transaction. Missing columns are added.
+        Existing values are only overwritten by non-NA values, and only
+        stations already in the metadata are updated.
+        If the metadata is empty, it is created from seed first.
+        """
+        with self.transaction() as conn:
+            columns = self._metadata_columns(conn)
+            if len(columns) == 0:
+                if seed is None:
+                    raise RuntimeError('The metadata table is empty and no seed was given.')
+                self._insert_metadata(conn, seed)
+                columns = self._metadata_columns(conn)
+
+            # add missing columns
+            for col in new_metadata.columns:
+                if col not in columns:
+                    conn.execute(f"ALTER TABLE metadata ADD COLUMN {_quote(col)}")
+
+            # update each column, keep existing values for NA
+            values = [c for c in new_metadata.columns if c != id_column]
+            if len(values) == 0:
+                return
+            assignment = ', '.join(f"{_quote(c)} = COALESCE(?, {_quote(c)})" for c in values)
+            rows = [[_to_sql(v) for v in row] + [_to_sql(key)] for key, row in zip(new_metadata[id_column].astype(str), new_metadata[values].itertuples(index=False, name=None))]
+            conn.executemany(f"UPDATE metadata SET {assignment} WHERE {_quote(id_column)} = ?", rows)
+
+    def export(self, output_folder: str = None) -> List[str]:
+        """
+        Export the metadata and nuts mapping as metadata.csv, nuts_mapping.json
+        and nuts_mapping.csv, ie. for a release.
+
+        Parameters
+        ----------
+        output_folder : str, optional
+            Defaults to the metadata folder.
+
+        Returns
+        -------
+        paths : list
+            The paths of the written files.
+        """
+        if output_folder is None:
+            output_folder = self.meta_path
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        paths = []
+
+        # nuts mapping
+        mapping = self.get_nuts_mapping()
+        path = os.path.join(output_folder, 'nuts_mapping.json')
+        with open(path, 'w') as f:
+            json.dump(mapping, f, indent=4)
+        paths.append(path)
+        path = os.path.join(output_folder, 'nuts_mapping.csv')
+        pd.DataFrame(mapping, columns=list(_MAPPING_KEYS)).to_csv(path, index=False)
+        paths.append(path)
+
+        # metadata
+        if self.has_metadata():
+            path = os.path.join(output_folder, 'metadata.csv')
+            self.get_metadata().to_csv(path, index=False)
+            paths.append(path)
+
+        return paths
@@ -0,0 +1,159 @@
+from typing import Dict, List, Union
+import os
+import glob
+import json
+
+import pandas as pd
+import numpy as np
+
+from .util import OUTPUT_PATH, SENTINELS, file_lock
+
+
+def summarize_timeseries(data: pd.DataFrame, camels_id: str, sentinels: Dict[str, int] = None) -> Dict[str, Union[str, int, float, None]]:
+    """
+    Calculate the summary record of one station's timeseries. The record
+    holds, for each variable in data, the number of valid values, the
+    first and last valid date, minimum and maximum as well as the number
+    of NaN and sentinel values. If q and w are both present, the Pearson
+    and Spearman correlation between them is added.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The merged station data as it is written to the output folder.
+        'date' has to be a data column.
+    camels_id : str
+        The CAMELS-DE id of the station.
+    sentinels : dict, optional
+        Number of sentinel values per variable, that were already replaced
+        by NaN on ingest, see camelsp.flags.sentinel_counts. Only if not
+        given, ie. for data without flag table, the values are searched
+        for sentinels.
+
+    Returns
+    -------
+    record : dict
+        The summary record. All values are JSON serializable.
+
+    """
+    record = {'camels_id': camels_id, 'updated': pd.Timestamp.now().isoformat(timespec='seconds')}
+
+    # get the dates once
+    dates = pd.to_datetime(data['date']).values
+
+    # get the variable columns
+    variables = [c for c in data.columns if c != 'date' and not c.endswith('_flag')]
+
+    valid_values = {}
+    for var in variables:
+        values = pd.to_numeric(data[var], errors='coerce').values.astype(float)
+
+        # mask NaN and sentinels
+        nan_mask = np.isnan(values)
+        if sentinels is None:
+            sentinel_mask = np.isin(values, SENTINELS)
+            n_sentinel = int(sentinel_mask.sum())
+            valid = ~(nan_mask | sentinel_mask)
+            n_nan = int(nan_mask.sum())
+        else:
+            # sentinels replaced on ingest are NaN now, but still counted as sentinels
+            n_sentinel = sentinels.get(var, 0)
+            valid = ~nan_mask
+            n_nan = int(nan_mask.sum()) - n_sentinel
+        valid_values[var] = np.where(valid, values, np.nan)
+
+        record[f'{var}_count'] = int(valid.sum())
+        record[f'{var}_nan'] = n_nan
+        record[f'{var}_sentinel'] = n_sentinel
+
+        # start, end and range are only defined if there is valid data
+        if valid.any():
+            valid_dates = dates[valid]
+            record[f'{var}_start'] = str(pd.Timestamp(valid_dates.min()).date())
+            record[f'{var}_end'] = str(pd.Timestamp(valid_dates.max()).date())
+            record[f'{var}_min'] = float(values[valid].min())
+            record[f'{var}_max'] = float(values[valid].max())
+        else:
+            record[f'{var}_start'] = None
+            record[f'{var}_end'] = None
+            record[f'{var}_min'] = None
+            record[f'{var}_max'] = None
+
+    # correlation between q and w
+    if 'q' in valid_values and 'w' in valid_values:
+        pair = pd.DataFrame({'q': valid_values['q'], 'w': valid_values['w']}).dropna()
+        if len(pair) > 1:
+            pearson = pair.q.corr(pair.w, method='pearson')
+            spearman = pair.q.corr(pair.w, method='spearman')
+        else:
+            pearson, spearman = np.nan, np.nan
+        record['q_w_pearson'] = None if np.isnan(pearson) else float(pearson)
+        record['q_w_spearman'] = None if np.isnan(spearman) else float(spearman)
+
+    return record
+
+
+def read_summary(path: str) -> Dict[str, dict]:
+    """Read a summary sidecar file. Returns an empty mapping if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_summary(path: str, summary: Dict[str, dict]):
+    """
+    Write a summary sidecar file. The file is written to a temporary file
+    first and moved into place afterwards, so that readers never see a
+    half-written summary.
+    """
+    # make sure the directory exists
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def update_summary_file(path: str, records: Dict[str, dict]):
+    """
+    Add or replace the given records, by camels_id, in a summary sidecar
+    file. The read-modify-write cycle holds a file lock, thus parallel 
+    writers of the same state do not lose each other's records.
+    """
+    with file_lock(path):
+        summary = read_summary(path)
+        summary.update(records)
+        write_summary(path, summary)
+
+
+def get_summary(base_path: str = OUTPUT_PATH) -> pd.DataFrame:
+    """
+    Get the precomputed summary statistics of all stations of all states
+    as a single DataFrame, indexed by camels_id.
+    The summaries are maintained by Bundesland.save_timeseries and can be
+    rebuilt for existing data by Bundesland.update_summary.
+    """
+    # find all summary sidecar files
+    fnames = sorted(glob.glob(os.path.join(base_path, 'metadata', '*_summary.json')))
+
+    records: List[dict] = []
+    for fname in fnames:
+        records.extend(read_summary(fname).values())
+
+    return summary_to_frame(records)
+
+
+def summary_to_frame(records: List[dict]) -> pd.DataFrame:
+    """Build a DataFrame indexed by camels_id from a list of summary records."""
+    if len(records) == 0:
+        return pd.DataFrame(columns=['camels_id']).set_index('camels_id')
+    df = pd.DataFrame.from_records(records).set_index('camels_id')
+
+    # parse the dates
+    for col in [c for c in df.columns if c.endswith('_start') or c.endswith('_end')]:
+        df[col] = pd.to_datetime(df[col])
+
+    return df
@@ -1,8 +1,22 @@
+from typing import Dict, Tuple, Mapping, List, Union
+from types import MappingProxyType
+from contextlib import contextmanager
 import os
 import json 
+import shutil
+import warnings
 import pandas as pd
 import numpy as np
 
+# file locks are only available on the platform specific modules
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from .store import MetadataStore
+
 # This package is intended to be installed along with the data folder
 BASEPATH = os.path.abspath(os.path.dirname(__file__))
 
@@ -10,6 +24,63 @@ _DEFAULT_INPUT_PATH = os.path.abspath(os.path.join(BASEPATH, '..', 'input_data')
 _DEFAULT_OUTPUT_PATH = os.path.abspath(os.path.join(BASEPATH, '..', 'output_data'))
 INPUT_PATH = os.environ.get('INPUT_DIR', _DEFAULT_INPUT_PATH)
 OUTPUT_PATH = os.environ.get('OUTPUT_DIR', _DEFAULT_OUTPUT_PATH)
+_DEFAULT_HYRAS_PATH = os.path.abspath(os.path.join(BASEPATH, '..', 'hyras'))
+HYRAS_PATH = os.environ.get('HYRAS_DIR', _DEFAULT_HYRAS_PATH)
+_DEFAULT_RELEASE_PATH = os.path.abspath(os.path.join(BASEPATH, '..', 'release'))
+RELEASE_PATH = os.environ.get('RELEASE_DIR', _DEFAULT_RELEASE_PATH)
+
+# metadata and nuts mapping are stored as flat files ('csv') or in a SQLite database ('sqlite')
+METADATA_BACKEND = os.environ.get('METADATA_BACKEND', 'csv').lower()
+
+# some providers use sentinel values to indicate invalid values
+SENTINELS = (-999, )
+
+
+@contextmanager
+def atomic_path(path: str):
+    """
+    Context manager, that yields a temporary path next to path. Write the
+    output to the temporary path; it is moved to path once the context
+    exits without error, and removed otherwise. Thus, path is either the
+    complete old or the complete new file, never a half-written one.
+    The file extension is kept, for writers that infer the format from it.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Context manager, that holds an exclusive lock on '<path>.lock' across
+    processes. Wrap read-modify-write cycles of files shared by parallel 
+    writers into the lock. The lock is released when the context exits,
+    or the process dies.
+    """
+    lock_path = f"{path}.lock"
+    if not os.path.exists(os.path.dirname(os.path.abspath(lock_path))):
+        os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    
+    with open(lock_path, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
 
 def _get_logo():
@@ -17,6 +88,140 @@ def _get_logo():
         return f"data:image/png;base64,{f.read()}"
 
 
+class _CompiledColumnMapping():
+    """
+    Immutable column mapping along with the compiled rename plans for
+    each header that was already renamed.
+    """
+    def __init__(self, mapping: Mapping[str, str]):
+        self.mapping = MappingProxyType(dict(mapping))
+        self._plans: Dict[Tuple[str, ...], List[str]] = {}
+
+    def plan(self, columns: Tuple[str, ...]) -> List[str]:
+        """Return the renamed header. Each distinct header is only compiled once."""
+        if columns not in self._plans:
+            self._plans[columns] = [self.mapping.get(c, c) for c in columns]
+        return self._plans[columns]
+
+
+# cache of the parsed mapping files: path -> (stamp, mapping)
+_MAPPING_FILE_CACHE: Dict[str, Tuple[Tuple[int, int, int], Mapping[str, str]]] = {}
+
+# cache of the merged and compiled mappings: (base_path, package stamp, override stamp) -> compiled mapping
+_COMPILED_MAPPING_CACHE: Dict[Tuple[str, Tuple[int, int, int], Tuple[int, int, int]], _CompiledColumnMapping] = {}
+
+
+def _mapping_stamp(path: str) -> Tuple[int, int, int]:
+    """
+    Identify the version of a mapping file by mtime, size and inode. The 
+    inode changes on every atomic replace, thus a rewrite is detected even
+    on filesystems with coarse timestamps.
+    """
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    except FileNotFoundError:
+        return (-1, -1, -1)
+
+
+def _read_mapping_file(path: str) -> Dict[str, str]:
+    """Read a mapping file without the cache. Returns an empty mapping if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _load_mapping_file(path: str) -> Mapping[str, str]:
+    """Load a mapping file. The file is only parsed again, if it changed."""
+    stamp = _mapping_stamp(path)
+    if stamp[0] == -1:
+        return MappingProxyType({})
+
+    cached = _MAPPING_FILE_CACHE.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, MappingProxyType(_read_mapping_file(path)))
+        _MAPPING_FILE_CACHE[path] = cached
+    return cached[1]
+
+
+def _column_mapping_override_path(base_path: str = OUTPUT_PATH) -> str:
+    return os.path.join(base_path, 'metadata', 'column_mapping.json')
+
+
+def _get_compiled_column_mapping(base_path: str = OUTPUT_PATH) -> _CompiledColumnMapping:
+    # get the two files
+    package_path = os.path.join(BASEPATH, 'column_mapping.json')
+    override_path = _column_mapping_override_path(base_path)
+
+    # check the cache
+    key = (base_path, _mapping_stamp(package_path), _mapping_stamp(override_path))
+    if key not in _COMPILED_MAPPING_CACHE:
+        # project-specific overrides take precedence over the packaged mapping
+        mapping = dict(_load_mapping_file(package_path))
+        mapping.update(_load_mapping_file(override_path))
+
+        # drop outdated mappings of this output tree
+        for old_key in [k for k in _COMPILED_MAPPING_CACHE.keys() if k[0] == base_path]:
+            del _COMPILED_MAPPING_CACHE[old_key]
+        _COMPILED_MAPPING_CACHE[key] = _CompiledColumnMapping(mapping)
+    
+    return _COMPILED_MAPPING_CACHE[key]
+
+
+def get_column_mapping(base_path: str = OUTPUT_PATH) -> Mapping[str, str]:
+    """
+    Get the column mapping used to rename headers of new timeseries.
+    The packaged 'column_mapping.json' is merged with the project-specific
+    overrides in the 'metadata' folder of the output tree.
+    The mapping is loaded once per process and only re-loaded if one of 
+    the files changed. The returned mapping is read-only.
+    """
+    return _get_compiled_column_mapping(base_path).mapping
+
+
+def rename_columns(df: pd.DataFrame, base_path: str = OUTPUT_PATH) -> pd.DataFrame:
+    """
+    Rename the header of df in place, using the column mapping.
+    The renamed header is compiled once for each distinct header.
+    """
+    df.columns = _get_compiled_column_mapping(base_path).plan(tuple(df.columns))
+    return df
+
+
+def update_column_mapping(new_map: Dict[str, str], base_path: str = OUTPUT_PATH) -> Mapping[str, str]:
+    """
+    Add new column renames to the project-specific column mapping, which is
+    stored in the 'metadata' folder of the output tree. Renames, that 
+    conflict with existing renames are ignored with a warning.
+    """
+    path = _column_mapping_override_path(base_path)
+
+    # hold the lock for the whole read-modify-write, so that parallel updates are not lost
+    with file_lock(path):
+        # get the current mapping, the overrides are read from disk
+        overrides = _read_mapping_file(path)
+        mapping = dict(_load_mapping_file(os.path.join(BASEPATH, 'column_mapping.json')))
+        mapping.update(overrides)
+
+        # check if we have conflicting column names
+        conflicts = [(k, v, ) for k, v in new_map.items() if k in mapping and mapping[k] != v.lower()]
+        if len(conflicts) > 0:
+            conf_str = [f'{k} -> {v}' for (k, v) in conflicts]
+            warnings.warn(f"CONFLICTING HEADER RENAMES. The following header can't be set as they are already defined: {', '.join(conf_str)}")
+
+        # use only lower-case values and ignore conflicts
+        conficting_keys = [t[0] for t in conflicts]
+        overrides.update({k: v.lower() for k, v in new_map.items() if k not in conficting_keys})
+
+        # save - write to a temporary file first, so that concurrent readers never see a half-written file
+        with atomic_path(path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(overrides, f, indent=4)
+
+    return get_column_mapping(base_path)
+
+
 # helper 
 __BL_TRANS = {
     'bw': 'bw',
@@ -166,19 +371,29 @@ def get_input_path(bl: str = None):
     return os.path.join(INPUT_PATH, "Q_and_W", bl_folder)
 
 
+def _use_sqlite() -> bool:
+    return METADATA_BACKEND == 'sqlite'
+
+
 def get_full_nuts_mapping(base_path = OUTPUT_PATH, format='json'):
     """Get the NUTS mapping to provider_id for ALL states"""
-    # build file name
-    fname = os.path.join(base_path, 'metadata', 'nuts_mapping.json')
-
-    # if nuts_mapping does not exist, create empty mapping
-    if not os.path.exists(fname):
-        js = [{}]
-        print(f"Can't find the nuts_mapping at {fname}, returning empty mapping.")
-    # nuts_mapping exists: read
+    # get the mapping from the database
+    if _use_sqlite():
+        js = MetadataStore(base_path).get_nuts_mapping()
+        if len(js) == 0:
+            js = [{}]
     else:
-        with open(fname, 'r') as f:
-            js = json.load(f)
+        # build file name
+        fname = os.path.join(base_path, 'metadata', 'nuts_mapping.json')
+
+        # if nuts_mapping does not exist, create empty mapping
+        if not os.path.exists(fname):
+            js = [{}]
+            print(f"Can't find the nuts_mapping at {fname}, returning empty mapping.")
+        # nuts_mapping exists: read
+        else:
+            with open(fname, 'r') as f:
+                js = json.load(f)
     
     # return
     if format.lower() == 'json':
@@ -187,28 +402,94 @@ def get_full_nuts_mapping(base_path = OUTPUT_PATH, format='json'):
         return pd.DataFrame(js)
 
 
-def get_metadata(base_path = OUTPUT_PATH) -> pd.DataFrame:
-    """Get the current state of overall metadata"""
-    # get the path
-    path = os.path.join(base_path, 'metadata', 'metadata.csv')
+def lookup_station(key: str, base_path = OUTPUT_PATH) -> Union[Dict[str, str], None]:
+    """
+    Find the nuts mapping record of a CAMELS-DE id or a provider_id.
+    If the provider_id is not unique, the first record is returned.
+    Returns None, if the key is unknown.
+    """
+    key = str(key)
+    if _use_sqlite():
+        return MetadataStore(base_path).lookup(key)
+    
+    mapping = [m for m in get_full_nuts_mapping(base_path=base_path, format='json') if len(m) > 0]
+    for id_key in ('nuts_id', 'provider_id'):
+        for m in mapping:
+            if str(m[id_key]) == key:
+                return m
+    return None
 
-    if os.path.exists(path):
-        return pd.read_csv(path, dtype={'provider_id': str})
-    else:
-        # generate
-        mapping =  get_full_nuts_mapping(base_path=base_path, format='df')
-        
-        # rename header
-        mapping.columns = ['camels_id', 'provider_id', 'camels_path']
 
-        # bugfix for early stages of the mapping
-        #mapping['provider_id'] = mapping.provider_id.astype(str)
+def export_metadata(output_folder: str = None, base_path = OUTPUT_PATH) -> List[str]:
+    """
+    Export the metadata and nuts mapping as metadata.csv, nuts_mapping.json
+    and nuts_mapping.csv, ie. as release artifacts. With the sqlite backend,
+    the files are written from the database, otherwise the flat files are
+    copied. Returns the paths of the exported files.
+    """
+    if _use_sqlite():
+        return MetadataStore(base_path).export(output_folder=output_folder)
+    
+    # the flat files are already up to date
+    meta_path = os.path.join(base_path, 'metadata')
+    paths = [os.path.join(meta_path, fname) for fname in ('nuts_mapping.json', 'nuts_mapping.csv', 'metadata.csv')]
+    paths = [path for path in paths if os.path.exists(path)]
+    if output_folder is None or os.path.abspath(output_folder) == os.path.abspath(meta_path):
+        return paths
 
-        # some extra columns for convenience
-        mapping['nuts_lvl2'] = [nid[:3] for nid in mapping.camels_id]
-        mapping['federal_state'] = [_NUTS_LVL2_NAMES[nid[:3]] for nid in mapping.camels_id]
+    # copy
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    return [shutil.copy(path, output_folder) for path in paths]
 
-        return mapping
+
+def _metadata_from_mapping(base_path = OUTPUT_PATH) -> pd.DataFrame:
+    """Generate the initial metadata from the nuts mapping"""
+    mapping =  get_full_nuts_mapping(base_path=base_path, format='df')
+
+    # no stations yet
+    if len(mapping.columns) == 0:
+        return pd.DataFrame(columns=['camels_id', 'provider_id', 'camels_path', 'nuts_lvl2', 'federal_state'])
+    
+    # rename header
+    mapping.columns = ['camels_id', 'provider_id', 'camels_path']
+
+    # bugfix for early stages of the mapping
+    #mapping['provider_id'] = mapping.provider_id.astype(str)
+
+    # some extra columns for convenience
+    mapping['nuts_lvl2'] = [nid[:3] for nid in mapping.camels_id]
+    mapping['federal_state'] = [_NUTS_LVL2_NAMES[nid[:3]] for nid in mapping.camels_id]
+
+    return mapping
+
+
+def get_metadata(base_path = OUTPUT_PATH, nuts_lvl2: str = None) -> pd.DataFrame:
+    """
+    Get the current state of overall metadata. If nuts_lvl2 is given, only
+    the stations of this federal state are returned.
+    """
+    # use the database, if it has metadata
+    if _use_sqlite():
+        store = MetadataStore(base_path)
+        if store.has_metadata():
+            return store.get_metadata(nuts_lvl2=nuts_lvl2)
+        metadata = _metadata_from_mapping(base_path=base_path)
+    else:
+        # get the path
+        path = os.path.join(base_path, 'metadata', 'metadata.csv')
+
+        if os.path.exists(path):
+            metadata = pd.read_csv(path, dtype={'provider_id': str})
+        else:
+            # generate
+            metadata = _metadata_from_mapping(base_path=base_path)
+    
+    # filter for the federal state
+    if nuts_lvl2 is not None:
+        metadata = metadata[metadata.nuts_lvl2 == nuts_lvl2]
+    
+    return metadata
 
 
 def update_metadata(new_metadata: pd.DataFrame, base_path = OUTPUT_PATH, id_column: str = None):
@@ -219,10 +500,8 @@ def update_metadata(new_metadata: pd.DataFrame, base_path = OUTPUT_PATH, id_colu
     table. Existing columns will be updated, missing columns will be added and filled with
     NA for all IDs that are not present in new_metadata.
     If index_col is not provided
+    With the sqlite backend, the update is one transaction.
     """
-    # get metadata
-    metadata = get_metadata(base_path=base_path)
-    
     if new_metadata.index.name in ['provider_id', 'camels_id', id_column if id_column is not None else 'FOOBAR']:
         new_metadata.reset_index(inplace=True)
 
@@ -237,6 +516,16 @@ def update_metadata(new_metadata: pd.DataFrame, base_path = OUTPUT_PATH, id_colu
     if id_column is None:
         raise AttributeError("You need to specify the id_column, or 'camels_id' or 'provider_id' has to be present.")
     
+    # update in the database
+    if _use_sqlite():
+        store = MetadataStore(base_path)
+        seed = None if store.has_metadata() else _metadata_from_mapping(base_path=base_path)
+        store.update_metadata(new_metadata, id_column=id_column, seed=seed)
+        return
+
+    # get metadata
+    metadata = get_metadata(base_path=base_path)
+    
     # update none existing columns
     for col in new_metadata.columns:
         if col not in metadata.columns:
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import warnings
+
+import pytest
+import numpy as np
+import pandas as pd
+
+# the output root is read on import of camelsp, thus it has to be set first
+_OUTPUT_DIR = tempfile.mkdtemp(prefix='camelsp_test_')
+os.environ['OUTPUT_DIR'] = _OUTPUT_DIR
+
+from camelsp import Bundesland
+
+
+@pytest.fixture
+def output_dir() -> str:
+    """An empty output tree for each test."""
+    for name in os.listdir(_OUTPUT_DIR):
+        path = os.path.join(_OUTPUT_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    yield _OUTPUT_DIR
+
+
+def make_state(NUTS: str = 'DE1', n: int = 2, days: int = 400, seed: int = 42) -> Bundesland:
+    """
+    Save n synthetic stations with q and w to the output tree. The first
+    station has a NaN gap at rows 100-109 and -999 sentinels at rows
+    200-202 of q, the last station is clean: no gaps, no sentinels and all
+    flags are True.
+    """
+    rng = np.random.default_rng(seed)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with Bundesland(NUTS) as bl:
+            meta = pd.DataFrame({'pid': [f'{NUTS}p{i}' for i in range(n)], 'name': [f'gauge {i}' for i in range(n)]})
+            bl.save_raw_metadata(meta, 'pid', overwrite=True)
+            for i, pid in enumerate(meta.pid):
+                dates = pd.date_range('2000-01-01', periods=days, freq='D')
+                q = rng.gamma(2, 2, days)
+                clean = i == n - 1
+                if not clean:
+                    q[100:110] = np.nan
+                    q[200:203] = -999
+                w = np.where(np.isnan(q) | (q == -999), np.nan, q * 10)
+                flags = np.ones(days, dtype=bool) if clean else rng.random(days) > .2
+                bl.save_timeseries(pd.DataFrame({'date': dates, 'q': q, 'flag': flags}), pid)
+                bl.save_timeseries(pd.DataFrame({'date': dates, 'w': w, 'flag': flags}), pid)
+    return Bundesland(NUTS)
+
+
+@pytest.fixture
+def state(output_dir) -> Bundesland:
+    """A state DE1 with one station with gaps and sentinels (DE110000) and one clean station (DE110010)."""
+    return make_state('DE1', n=2)
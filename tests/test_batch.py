@@ -0,0 +1,114 @@
+import os
+import warnings
+
+import pandas as pd
+import pytest
+
+from camelsp.batch import Journal, run_batch
+from camelsp.util import atomic_path
+
+
+def _write(folder: str, key: str) -> str:
+    """Write one output, like the report generators with if_exists='raise'."""
+    path = os.path.join(folder, f'{key}.txt')
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    with atomic_path(path) as tmp:
+        with open(tmp, 'w') as f:
+            f.write(key)
+    return path
+
+
+def _flaky(folder: str, key: str) -> str:
+    """Fail with an OSError on the first attempt."""
+    marker = os.path.join(folder, f'{key}.attempted')
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        raise OSError('network file system not available')
+    return key
+
+
+def _missing_column(key: str):
+    return pd.DataFrame({'q': [1.]})['w']
+
+
+def _missing_input(folder: str, key: str):
+    return pd.read_csv(os.path.join(folder, f'{key}_data.csv'))
+
+
+def test_missing_input_is_not_retried(output_dir):
+    summary = run_batch('input', _missing_input, ['a'], [(output_dir, 'a')], base_path=output_dir)
+    assert summary.loc['a', 'status'] == 'failed'
+    assert summary.loc['a', 'attempts'] == 1
+    assert summary.loc['a', 'error'].startswith('FileNotFoundError')
+
+
+def test_empty_batch(output_dir):
+    summary = run_batch('empty', _write, [], base_path=output_dir)
+    assert len(summary) == 0
+    assert len(Journal('empty', base_path=output_dir).to_frame()) == 0
+
+
+def test_journal_roundtrip(output_dir):
+    keys = ['a', 'b', 'c']
+    summary = run_batch('job', _write, keys, [(output_dir, key) for key in keys], base_path=output_dir)
+    assert (summary.status == 'done').all() and summary.ran.all()
+
+    journal = Journal('job', base_path=output_dir)
+    df = journal.to_frame()
+    assert sorted(df.key) == keys
+    assert (df.status == 'done').all() and not df.transient.any()
+
+    # a second run skips everything
+    summary = run_batch('job', _write, keys, [(output_dir, key) for key in keys], base_path=output_dir)
+    assert (summary.status == 'done').all() and not summary.ran.any()
+
+
+def test_transient_errors_are_retried(output_dir):
+    summary = run_batch('flaky', _flaky, ['a'], [(output_dir, 'a')], base_path=output_dir)
+    assert summary.loc['a', 'status'] == 'done'
+    assert summary.loc['a', 'attempts'] == 2
+
+
+def test_non_transient_errors_are_not_retried(output_dir):
+    summary = run_batch('missing', _missing_column, ['a'], base_path=output_dir)
+    assert summary.loc['a', 'status'] == 'failed'
+    assert summary.loc['a', 'attempts'] == 1
+    assert summary.loc['a', 'error'].startswith('KeyError')
+
+    # also not on resume
+    summary = run_batch('missing', _missing_column, ['a'], base_path=output_dir)
+    assert summary.loc['a', 'attempts'] == 1 and not summary.loc['a', 'ran']
+
+
+def test_resume_after_crash(output_dir):
+    keys = ['a', 'b']
+    args = [(output_dir, key) for key in keys]
+    outputs = [os.path.join(output_dir, f'{key}.txt') for key in keys]
+
+    # the job crashed after writing 'a', but before journaling it
+    Journal('crash', base_path=output_dir).touch()
+    _write(output_dir, 'a')
+
+    summary = run_batch('crash', _write, keys, args, base_path=output_dir, outputs=outputs)
+    assert (summary.status == 'done').all()
+    assert summary.ran.to_dict() == {'a': False, 'b': True}
+
+    # without a journal, the existing output is not taken as done
+    summary = run_batch('fresh', _write, ['a'], [(output_dir, 'a')], base_path=output_dir, outputs=outputs[:1])
+    assert summary.loc['a', 'status'] == 'failed'
+    assert summary.loc['a', 'error'].startswith('FileExistsError')
+
+
+def test_scatter_plots_without_w(output_dir):
+    from camelsp import Bundesland
+
+    with Bundesland('DE1') as bl:
+        bl.save_raw_metadata(pd.DataFrame({'pid': ['p0']}), 'pid', overwrite=True)
+        bl.save_timeseries(pd.DataFrame({'date': pd.date_range('2000-01-01', periods=3), 'q': [1., 2., 3.]}), 'p0')
+
+        with warnings.catch_warnings(record=True) as warns:
+            warnings.simplefilter('always')
+            summary = bl.generate_scatter_plots(journal='scatter')
+    assert summary.loc['DE110000', 'status'] == 'done'
+    assert any('has no w data' in str(w.message) for w in warns)
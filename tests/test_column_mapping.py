@@ -0,0 +1,53 @@
+import os
+import json
+
+import pytest
+import pandas as pd
+
+from camelsp.util import get_column_mapping, update_column_mapping, rename_columns, _column_mapping_override_path
+from camelsp.executor import run, ProcessExecutor
+
+
+def _add_rename(base_path: str, i: int):
+    update_column_mapping({f'header {i}': f'var{i}'}, base_path=base_path)
+
+
+def test_rename_columns(output_dir):
+    update_column_mapping({'Abflussmenge': 'Q'}, base_path=output_dir)
+    assert get_column_mapping(output_dir)['Abflussmenge'] == 'q'
+
+    df = pd.DataFrame(columns=['date', 'Abflussmenge', 'flag'])
+    rename_columns(df, base_path=output_dir)
+    assert df.columns.tolist() == ['date', 'q', 'flag']
+
+
+def test_conflicting_renames_are_ignored(output_dir):
+    update_column_mapping({'Pegel': 'w'}, base_path=output_dir)
+    with pytest.warns(UserWarning, match='CONFLICTING'):
+        update_column_mapping({'Pegel': 'q'}, base_path=output_dir)
+    assert get_column_mapping(output_dir)['Pegel'] == 'w'
+
+
+def test_rewrite_within_the_same_tick(output_dir):
+    update_column_mapping({'a': 'x'}, base_path=output_dir)
+    assert get_column_mapping(output_dir)['a'] == 'x'
+
+    # rewrite the file with the same size and timestamp, as on a coarse filesystem
+    path = _column_mapping_override_path(output_dir)
+    stat = os.stat(path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'a': 'y'}, f, indent=4)
+    os.replace(tmp_path, path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(path).st_size == stat.st_size
+
+    assert get_column_mapping(output_dir)['a'] == 'y'
+
+
+def test_parallel_updates_are_kept(output_dir):
+    n = 24
+    results = run(_add_rename, [str(i) for i in range(n)], [(output_dir, i) for i in range(n)], executor=ProcessExecutor(max_workers=6))
+    assert all(r.error is None for r in results)
+    mapping = get_column_mapping(output_dir)
+    assert all(mapping[f'header {i}'] == f'var{i}' for i in range(n))
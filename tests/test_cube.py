@@ -0,0 +1,83 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from camelsp import build_cube, open_cube
+from camelsp.cube import _cube_path
+
+
+def test_open_missing_cube(output_dir):
+    with pytest.raises(FileNotFoundError):
+        open_cube('q', base_path=output_dir)
+
+
+def test_build_empty(output_dir):
+    build_cube('q', base_path=output_dir)
+    cube = open_cube('q', base_path=output_dir)
+    assert cube.shape == (0, 0)
+
+
+def test_build_and_open(state):
+    build_cube('q', base_path=state.base_path)
+    cube = open_cube('q', base_path=state.base_path)
+    assert cube.camels_ids == ['DE110000', 'DE110010']
+    assert cube.shape == (2, 400)
+    assert cube.dates[0] == pd.Timestamp('2000-01-01')
+
+    # values round-trip, sentinels are NaN
+    for camels_id in cube.camels_ids:
+        q = state.get_data(camels_id)['q'].replace(-999, np.nan).astype(np.float32)
+        np.testing.assert_array_equal(cube.to_series(camels_id).values, q.values)
+    assert np.isnan(cube.station('DE110000')[200:203]).all()
+
+    # flags of the clean station are all True
+    assert (cube.flags[cube.row('DE110010')] == 1).all()
+    assert cube.date('2000-01-02').shape == (2, )
+    with pytest.raises(IndexError):
+        cube.column('1999-12-31')
+
+
+def test_incremental_update(state):
+    path = build_cube('q', base_path=state.base_path)
+    with open(os.path.join(path, 'index.json')) as f:
+        before = json.load(f)
+
+    # an unchanged tree is not touched
+    build_cube('q', base_path=state.base_path)
+    with open(os.path.join(path, 'index.json')) as f:
+        assert json.load(f) == before
+
+    # change one station in place
+    data_path = os.path.join(state.base_path, 'DE1', 'DE110010', 'DE110010_data.csv')
+    df = pd.read_csv(data_path)
+    df.loc[0, 'q'] = 42.
+    df.to_csv(data_path, index=False)
+
+    build_cube('q', base_path=state.base_path)
+    cube = open_cube('q', base_path=state.base_path)
+    assert cube.station('DE110010')[0] == 42.
+    assert cube.shape == (2, 400)
+
+
+def test_interrupted_rebuild_keeps_old_cube(state, monkeypatch):
+    build_cube('q', base_path=state.base_path)
+    expected = np.array(open_cube('q', base_path=state.base_path).values)
+
+    # fail while writing the index of a forced rebuild
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(json, 'dump', fail)
+    with pytest.raises(OSError):
+        build_cube('q', base_path=state.base_path, force=True)
+    monkeypatch.undo()
+
+    cube = open_cube('q', base_path=state.base_path)
+    np.testing.assert_array_equal(np.array(cube.values), expected)
+
+    # a build stopped in between the two renames is recovered
+    path = _cube_path('q', state.base_path)
+    os.rename(path, f'{path}.old')
+    np.testing.assert_array_equal(np.array(open_cube('q', base_path=state.base_path).values), expected)
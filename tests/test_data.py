@@ -0,0 +1,112 @@
+import os
+
+import pytest
+import numpy as np
+import pandas as pd
+
+from camelsp import iter_stations
+from camelsp.events import load_events
+from conftest import make_state
+
+
+def test_get_data(state):
+    df = state.get_data('DE110000')
+    assert df.index.name == 'date'
+    assert df.columns.tolist() == ['q', 'q_flag', 'w', 'w_flag']
+    assert df.q.dtype == float and df.q_flag.dtype == 'boolean'
+
+    df = state.get_data('DE110000', date_index=False, columns=['q'])
+    assert df.columns.tolist() == ['date', 'q']
+
+
+def test_get_data_compact(state):
+    full = state.get_data('DE110010')
+    compact = state.get_data('DE110010', compact=True)
+    assert compact.q.dtype == np.float32 and compact.q_flag.dtype == np.int8
+    np.testing.assert_allclose(compact.q.values, full.q.values, rtol=1e-6)
+    assert (compact.q_flag == 1).all()
+
+    df = state.get_data('DE110000', compact=True)
+    assert set(df.q_flag.unique()) <= {-1, 0, 1}
+    assert df.q.isna().sum() == 13
+
+
+def test_compact_index_is_not_shared(state):
+    a = state.get_data('DE110000', compact=True)
+    b = state.get_data('DE110010', compact=True)
+    
+    # identical date ranges share the memory, but not the index object
+    assert a.index is not b.index
+    assert np.shares_memory(a.index.values, b.index.values)
+
+    a.index.name = 'day'
+    assert b.index.name == 'date'
+    assert state.get_data('DE110000', compact=True).index.name == 'date'
+
+
+def test_iter_stations(state):
+    ids = [camels_id for camels_id, _, _ in state.iter_stations(columns=['q'])]
+    assert ids == ['DE110000', 'DE110010']
+
+    # missing files are skipped
+    os.remove(os.path.join(state.output_path, 'DE110010', 'DE110010_data.csv'))
+    with pytest.warns(UserWarning, match='DE110010;MissingFile'):
+        stations = list(iter_stations(columns=['q']))
+    assert [s[0] for s in stations] == ['DE110000']
+    assert stations[0][2].columns.tolist() == ['q']
+
+
+def test_iter_stations_empty(output_dir):
+    from camelsp import Bundesland
+
+    assert list(Bundesland('DE1').iter_stations()) == []
+    assert list(iter_stations([])) == []
+
+
+def test_iter_stations_roundtrip(output_dir):
+    bl = make_state('DE1', n=5)
+    ids = [m['nuts_id'] for m in bl.nuts_mapping]
+
+    # the order is kept, no matter how far is read ahead
+    for prefetch in (0, 1, 10):
+        stations = list(bl.iter_stations(prefetch=prefetch))
+        assert [s[0] for s in stations] == ids
+        for camels_id, meta, df in stations:
+            pd.testing.assert_frame_equal(df, bl.get_data(camels_id))
+            assert meta is None or str(meta['camels_id']) == camels_id
+
+
+def test_iter_stations_bad_files_and_early_stop(state, output_dir):
+    with open(os.path.join(state.output_path, 'DE110000', 'DE110000_data.csv'), 'w') as f:
+        f.write('date,q\n2000-01-01,1\n"unterminated')
+
+    with state.event_log(run='iter') as log:
+        stations = list(state.iter_stations(event_log=log))
+    assert [s[0] for s in stations] == ['DE110010']
+    assert load_events(base_path=output_dir, run='iter').warning_type.tolist() == ['BadFile']
+
+    # stopping early does not block
+    for camels_id, _, _ in state.iter_stations(['DE110010', 'DE110010', 'DE110010'], prefetch=1):
+        break
+    assert camels_id == 'DE110010'
+
+
+def test_iter_stations_duplicated_metadata(state):
+    meta = state.metadata
+    pd.concat([meta, meta.iloc[[0]]], ignore_index=True).to_csv(os.path.join(state.meta_path, 'metadata.csv'), index=False)
+
+    with pytest.warns(UserWarning, match='DE110000;DuplicatedMetadata'):
+        stations = list(state.iter_stations())
+    assert [s[0] for s in stations] == ['DE110000', 'DE110010']
+    assert all(isinstance(meta, pd.Series) for _, meta, _ in stations)
+
+
+def test_iter_stations_raises_other_errors(state, monkeypatch):
+    from camelsp import output
+
+    # a programming error is not a bad file
+    def broken(path, **kwargs):
+        raise ValueError('Usecols do not match columns')
+    monkeypatch.setattr(output, '_read_data', broken)
+    with pytest.raises(ValueError, match='Usecols'):
+        list(state.iter_stations())
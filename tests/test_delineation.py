@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+
+from camelsp.delineation import D8, TileReader, upstream_mask, snap_outlet
+
+
+def _river_network(size: int = 20, river: int = 10) -> np.ndarray:
+    """All cells flow east or west into one river column, which flows south."""
+    fdir = np.where(np.arange(size)[None, :] < river, 1, 16).repeat(size, axis=0).astype(np.uint8)
+    fdir[:, river] = 4
+    return fdir
+
+
+def _upstream_area(fdir: np.ndarray, cell_area: float = 1.) -> np.ndarray:
+    return np.array([[upstream_mask(fdir, r, c).sum() * cell_area for c in range(fdir.shape[1])] for r in range(fdir.shape[0])])
+
+
+def test_upstream_mask():
+    fdir = _river_network()
+    mask = upstream_mask(fdir, 5, 10)
+    assert mask.sum() == 6 * 20
+    assert mask[:6].all() and not mask[6:].any()
+
+    # a hillslope cell only drains itself and its upstream neighbors
+    mask = upstream_mask(fdir, 3, 2)
+    assert mask.sum() == 3 and mask[3, :3].all()
+
+    # every D8 direction is traced
+    for code, (dr, dc) in D8.items():
+        fdir = np.zeros((3, 3), dtype=np.uint8)
+        fdir[1 - dr, 1 - dc] = code
+        assert upstream_mask(fdir, 1, 1).sum() == 2
+
+
+def test_snap_outlet_without_area():
+    upa = np.ones((11, 11))
+    upa[:, 8] = 100.
+
+    # the river wins over the reported hillslope cell
+    assert snap_outlet(upa, 5, 5) == (5, 8)
+
+    # two equal cells: the closer one wins
+    upa[:, 2] = 100.
+    assert snap_outlet(upa, 5, 4) == (5, 2)
+    assert snap_outlet(upa, 5, 6) == (5, 8)
+
+
+def test_snap_outlet_with_area():
+    upa = np.ones((11, 11))
+    upa[:, 2] = 50.
+    upa[:, 8] = 500.
+
+    # the larger river exceeds the reported area
+    assert snap_outlet(upa, 5, 7, area=55.) == (5, 2)
+
+    # if no cell is below the tolerance, the closest area wins
+    assert snap_outlet(upa, 5, 5, area=0.5) == (5, 5)
+    assert snap_outlet(upa, 5, 5, area=450.) == (5, 8)
+
+
+def test_snap_outlet_empty_window():
+    assert snap_outlet(np.zeros((5, 5)), 2, 2) == (2, 2)
+    assert snap_outlet(np.full((5, 5), np.nan), 2, 2, area=10.) == (2, 2)
+
+
+def test_tile_reader(tmp_path):
+    data = np.arange(30 * 20, dtype=np.int32).reshape(30, 20)
+    path = str(tmp_path / 'raster.tif')
+    with rasterio.open(path, 'w', driver='GTiff', height=30, width=20, count=1, dtype='int32', crs='EPSG:3035', transform=rasterio.transform.from_origin(0, 3000, 100, 100)) as dst:
+        dst.write(data, 1)
+
+    reader = TileReader(path, tile_size=7, cache_size=4, fill_value=-1)
+    np.testing.assert_array_equal(reader.read(3, 4, 10, 12), data[3:13, 4:16])
+
+    # outside of the raster
+    window = reader.read(-2, 15, 5, 10)
+    assert (window[:2] == -1).all() and (window[:, 5:] == -1).all()
+    np.testing.assert_array_equal(window[2:, :5], data[:3, 15:20])
+    assert reader.index(150, 2950) == (0, 1)
+    reader.close()
+
+
+def _write_raster(path: str, data: np.ndarray):
+    with rasterio.open(path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1], count=1, dtype=data.dtype, crs='EPSG:3035', transform=rasterio.transform.from_origin(0, 4000, 100, 100)) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def merit(state, tmp_path):
+    """Flow direction and upstream area rasters, and the metadata of the outlets."""
+
+    from camelsp import get_metadata
+
+    fdir = _river_network(size=40, river=20)
+    upa = _upstream_area(fdir, cell_area=0.01)
+    dir_path, upa_path = str(tmp_path / 'dir.tif'), str(tmp_path / 'upa.tif')
+    _write_raster(dir_path, fdir)
+    _write_raster(upa_path, upa.astype(np.float32))
+
+    # DE110000 is reported two cells off the river at row 30, DE110010 on the river at row 10
+    meta = get_metadata()
+    meta['lon'] = [2250., 2050.]
+    meta['lat'] = [4000. - 3050., 4000. - 1050.]
+    meta['area'] = [upa[30, 20], upa[10, 20]]
+    meta['gauge_name'] = meta['camels_id']
+    meta.to_csv(os.path.join(state.meta_path, 'metadata.csv'), index=False)
+    return dir_path, upa_path, upa
+
+
+def test_delineate_catchments(merit):
+    from camelsp import Station
+    from camelsp.delineation import delineate_catchments
+
+    dir_path, upa_path, upa = merit
+    result = delineate_catchments(dir_path, upa_path, max_workers=1)
+    assert result.error.isna().all()
+    assert result.upa.tolist() == pytest.approx([upa[30, 20], upa[10, 20]])
+    assert result.n_cells.tolist() == [31 * 40, 11 * 40]
+    assert len(Station('DE110000').get_catchment('merit_hydro')) == 1
+
+    # existing catchments are skipped by default
+    with pytest.warns(UserWarning, match='Skipping 2 stations'):
+        assert len(delineate_catchments(dir_path, upa_path, max_workers=1)) == 0
+
+    # and raise before any delineation is done
+    with pytest.raises(FileExistsError):
+        delineate_catchments('does_not_exist.tif', upa_path, if_exists='raise')
+
+
+def test_delineate_catchments_collects_save_errors(merit):
+    import shutil
+    from camelsp import Bundesland
+    from camelsp.delineation import delineate_catchments
+
+    dir_path, upa_path, _ = merit
+    shutil.rmtree(os.path.join(Bundesland('DE1').output_path, 'DE110010'))
+
+    result = delineate_catchments(dir_path, upa_path, max_workers=1).set_index('camels_id')
+    assert result.loc['DE110000', 'error'] is None or pd.isna(result.loc['DE110000', 'error'])
+    assert isinstance(result.loc['DE110010', 'error'], str)
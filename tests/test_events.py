@@ -0,0 +1,74 @@
+import os
+import warnings
+
+import pytest
+
+from camelsp import Bundesland
+from camelsp.events import EventLog, load_events, parse_warning_message
+
+
+def test_parse_warning_message():
+    assert parse_warning_message('p1;EmptyFile;no data;file.csv') == dict(provider_id='p1', warning_type='EmptyFile', message='no data', context='file.csv')
+    assert parse_warning_message(';Type;message') == dict(provider_id=None, warning_type='Type', message='message', context=None)
+    assert parse_warning_message('plain message') == dict(provider_id=None, warning_type=None, message='plain message', context=None)
+
+
+def test_load_events_empty(output_dir):
+    df = load_events(base_path=output_dir)
+    assert len(df) == 0
+    assert 'warning_type' in df.columns
+
+
+def test_buffering(output_dir):
+    log = EventLog('DE1', run='buffer', base_path=output_dir, buffer_size=2, flush_interval=3600)
+    log.log(provider_id='p1', warning_type='A', message='first')
+    assert not os.path.exists(log.path)
+
+    # the second event fills the buffer
+    log.log(provider_id='p2', warning_type='B', message='second')
+    assert len(load_events(base_path=output_dir)) == 2
+
+    log.log(message='third')
+    log.close()
+    assert load_events(base_path=output_dir).message.tolist() == ['first', 'second', 'third']
+
+
+def test_capture_and_timed(output_dir):
+    with Bundesland('DE1') as bl:
+        with bl.event_log(run='run1') as log:
+            with log.capture():
+                warnings.warn('p1;EmptyFile;no data;file.csv')
+                warnings.warn('something else', RuntimeWarning)
+            with log.timed(provider_id='p1', message='processing'):
+                pass
+
+    df = load_events(base_path=output_dir, bl='DE1', run='run1')
+    assert df.warning_type.tolist() == ['EmptyFile', 'RuntimeWarning', 'timing']
+    assert df.category.tolist()[:2] == ['UserWarning', 'RuntimeWarning']
+    assert df.duration.iloc[2] >= 0
+    assert (df.nuts_lvl2 == 'DE1').all()
+
+
+def test_aborted_run_and_filters(output_dir):
+    with pytest.raises(ValueError):
+        with EventLog('DE1', run='aborted', base_path=output_dir) as log:
+            log.log(message='started')
+            raise ValueError('broken input')
+    with EventLog('DE2', run='other', base_path=output_dir) as log:
+        log.log(message='other state')
+
+    df = load_events(base_path=output_dir, run='aborted')
+    assert df.warning_type.isna().tolist() == [True, False]
+    assert df.warning_type.iloc[-1] == 'ValueError'
+    assert df.context.iloc[-1] == 'run aborted'
+    assert load_events(base_path=output_dir, bl='DE2').message.tolist() == ['other state']
+    assert len(load_events(base_path=output_dir)) == 3
+
+
+def test_truncated_line(output_dir):
+    with EventLog('DE1', run='crash', base_path=output_dir) as log:
+        log.log(message='complete')
+    with open(log.path, 'a') as f:
+        f.write('{"timestamp": "2000')
+
+    assert load_events(base_path=output_dir).message.tolist() == ['complete']
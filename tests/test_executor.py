@@ -0,0 +1,72 @@
+import warnings
+
+import pytest
+
+from camelsp.executor import get_executor, run, summarize, run_task, SerialExecutor, ProcessExecutor
+from camelsp.events import EventLog
+
+
+def _task(key: str) -> str:
+    if key == 'bad':
+        raise ValueError('bad station')
+    warnings.warn(f"{key};TestWarning;issued by {key}")
+    return key.upper()
+
+
+def test_run_task():
+    result = run_task(_task, 'a', ('a', ))
+    assert result.value == 'A' and result.error is None
+    assert result.warnings == ['a;TestWarning;issued by a']
+
+    result = run_task(_task, 'bad', ('bad', ))
+    assert result.value is None
+    assert result.error == 'ValueError: bad station'
+    assert 'Traceback' in result.traceback
+
+
+@pytest.mark.parametrize('executor', ['serial', 'process'])
+def test_run_and_summarize(executor):
+    keys = ['a', 'bad', 'c']
+    with pytest.warns(UserWarning):
+        results = run(_task, keys, [(key, ) for key in keys], executor=executor)
+    assert [r.key for r in results] == keys
+    assert [r.value for r in results] == ['A', None, 'C']
+
+    summary = summarize(results)
+    assert summary.status.tolist() == ['ok', 'failed', 'ok']
+    assert summary.n_warnings.tolist() == [1, 0, 1]
+
+
+@pytest.mark.parametrize('executor', ['serial', 'process'])
+def test_warnings_reach_the_caller(executor):
+    keys = ['a', 'c']
+
+    # the caller's filters apply
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter('always')
+        run(_task, keys, [(key, ) for key in keys], executor=executor)
+    assert sorted(str(w.message) for w in warns) == ['a;TestWarning;issued by a', 'c;TestWarning;issued by c']
+
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter('ignore')
+        results = run(_task, keys, [(key, ) for key in keys], executor=executor)
+    assert len(warns) == 0
+    assert summarize(results).n_warnings.tolist() == [1, 1]
+
+
+def test_warnings_reach_event_log(output_dir):
+    with EventLog('DE1', run='test', base_path=output_dir) as log:
+        with log.capture():
+            list(get_executor('process').as_completed(_task, ['a'], [('a', )]))
+
+    with open(log.path) as f:
+        assert 'TestWarning' in f.read()
+
+
+def test_get_executor():
+    assert isinstance(get_executor(), SerialExecutor)
+    assert isinstance(get_executor('process', max_workers=2), ProcessExecutor)
+    backend = SerialExecutor()
+    assert get_executor(backend) is backend
+    with pytest.raises(ValueError):
+        get_executor('threads')
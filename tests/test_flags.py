@@ -0,0 +1,172 @@
+import os
+
+import pytest
+import numpy as np
+import pandas as pd
+
+from camelsp.flags import SENTINEL, MISSING, UNCHECKED, NO_FLAG, FLAG_TABLE_COLUMNS
+from camelsp.flags import empty_flags, normalize_sentinels, flag_codes, encode_flags, decode_flags, expand_flags, flag_share
+from camelsp.flags import read_flags, write_flags, sentinel_counts
+
+
+def test_normalize_sentinels():
+    values = np.array([1., -999., np.nan, 2.])
+    mask = normalize_sentinels(values)
+    assert mask.tolist() == [False, True, False, False]
+    assert np.isnan(values[1]) and values[3] == 2.
+
+
+def test_flag_codes():
+    values = np.array([1., np.nan, np.nan, 2., 3.])
+    sentinels = np.array([False, True, False, False, False])
+    flags = pd.array([True, True, None, False, None], dtype='boolean')
+    codes = flag_codes(values, flags, sentinels)
+    assert codes.tolist() == [0, SENTINEL | MISSING, MISSING | NO_FLAG, UNCHECKED, NO_FLAG]
+    assert codes.dtype == np.uint8
+
+
+def test_encode_decode_roundtrip():
+    dates = pd.date_range('2000-01-01', periods=10, freq='D').values
+    codes = np.array([0, 4, 4, 0, 3, 3, 3, 4, 0, 0], dtype=np.uint8)
+    table = encode_flags(dates, codes, 'q')
+
+    assert table.columns.tolist() == FLAG_TABLE_COLUMNS
+    assert table.code.tolist() == [4, 3, 4]
+    assert table.start.dt.day.tolist() == [2, 5, 8]
+    assert table.end.dt.day.tolist() == [3, 7, 8]
+    np.testing.assert_array_equal(decode_flags(table, 'q', dates), codes)
+    assert decode_flags(table, 'w', dates).sum() == 0
+
+
+def test_encode_breaks_runs_on_missing_days():
+    dates = pd.to_datetime(['2000-01-01', '2000-01-02', '2000-01-05']).values
+    table = encode_flags(dates, np.array([2, 2, 2]), 'q')
+    assert len(table) == 2
+    np.testing.assert_array_equal(decode_flags(table, 'q', pd.date_range('2000-01-01', '2000-01-05').values), [2, 2, 0, 0, 2])
+
+
+def test_expand_flags():
+    dates = pd.date_range('2000-01-01', periods=6, freq='D').values
+    codes = np.array([1, 1, 0, 4, 4, 4], dtype=np.uint8)
+    expanded = expand_flags(encode_flags(dates, codes, 'q'), 'q')
+    assert expanded.index.tolist() == [pd.Timestamp(d) for d in dates[codes != 0]]
+    assert expanded.tolist() == [1, 1, 4, 4, 4]
+
+
+def test_flag_share():
+    dates = pd.date_range('2001-01-01', '2002-12-31', freq='D').values
+    codes = np.zeros(dates.size, dtype=np.uint8)
+    codes[:73] = UNCHECKED
+    codes[365:365 + 10] = SENTINEL | MISSING
+    table = encode_flags(dates, codes, 'q')
+
+    share = flag_share(table, 'q', mask=UNCHECKED)
+    assert share.loc['2001-01-01'] == 73 / 365
+    share = flag_share(table, 'q', mask=UNCHECKED | SENTINEL)
+    assert share.tolist() == [73 / 365, 10 / 365]
+
+
+def test_read_write_roundtrip(tmp_path):
+    path = os.path.join(tmp_path, 'flags.csv')
+    table = encode_flags(pd.date_range('2000-01-01', periods=4).values, np.array([1, 1, 0, 8]), 'q')
+    write_flags(path, table)
+    pd.testing.assert_frame_equal(read_flags(path), table)
+
+
+def test_empty_tables(tmp_path):
+    # missing file
+    table = read_flags(os.path.join(tmp_path, 'missing.csv'))
+    assert len(table) == 0 and sentinel_counts(table) == {}
+
+    # header-only file, ie. a clean station
+    path = os.path.join(tmp_path, 'flags.csv')
+    write_flags(path, encode_flags(pd.date_range('2000-01-01', periods=3).values, np.zeros(3), 'q'))
+    table = read_flags(path)
+    assert len(table) == 0
+    assert table.dtypes.tolist() == empty_flags().dtypes.tolist()
+    assert sentinel_counts(table) == {}
+    assert len(flag_share(table, 'q')) == 0
+    assert len(expand_flags(table, 'q')) == 0
+
+    # no dates at all
+    assert len(encode_flags(np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.uint8), 'q')) == 0
+
+
+def test_sentinel_counts():
+    dates = pd.date_range('2000-01-01', periods=5).values
+    table = pd.concat([
+        encode_flags(dates, np.array([3, 3, 0, 3, 2]), 'q'),
+        encode_flags(dates, np.array([2, 2, 0, 0, 0]), 'w')
+    ], ignore_index=True)
+    assert sentinel_counts(table) == {'q': 3}
+
+
+def test_station_without_flags(state):
+    # a clean station writes a header-only flag table
+    assert len(state.get_flags('DE110010')) == 0
+    
+    # stations without a flag file are summarized as well
+    os.remove(os.path.join(state.output_path, 'DE110010', 'DE110010_flags.csv'))
+    assert len(state.get_flags('DE110010')) == 0
+    state.update_summary()
+    summary = state.summary
+    assert summary.loc['DE110010', 'q_sentinel'] == 0
+    assert summary.loc['DE110000', 'q_sentinel'] == 3
+    assert summary.loc['DE110000', 'q_nan'] == 10
+
+
+def test_save_timeseries_normalizes_sentinels(state):
+    df = state.get_data('DE110000')
+    assert not (df[['q', 'w']] == -999).any().any()
+    assert df['q'].isna().sum() == 13
+
+    table = state.get_flags('DE110000')
+    sentinel = table[(table.code & SENTINEL) != 0]
+    assert len(sentinel) == 1
+    assert sentinel.start.iloc[0] == pd.Timestamp('2000-07-19') and sentinel.end.iloc[0] == pd.Timestamp('2000-07-21')
+
+
+def test_ingest_and_update_flags_agree(state):
+    # start from an empty station
+    for fname in ('DE110010_data.csv', 'DE110010_flags.csv'):
+        os.remove(os.path.join(state.output_path, 'DE110010', fname))
+    
+    # w is shorter than q, so the merged file has missing w days
+    dates = pd.date_range('2000-01-01', periods=60, freq='D')
+    q = np.arange(60, dtype=float)
+    q[5:8] = -999
+    state.save_timeseries(pd.DataFrame({'date': dates, 'q': q, 'flag': q % 7 != 0}), 'DE110010')
+    state.save_timeseries(pd.DataFrame({'date': dates[20:40], 'w': q[20:40], 'flag': True}), 'DE110010')
+    ingested = state.get_flags('DE110010')
+    
+    # the w runs cover the merged file, not only the saved rows
+    w = ingested[ingested.variable == 'w']
+    assert w.start.min() == pd.Timestamp('2000-01-01')
+
+    state.update_flags('DE110010')
+    pd.testing.assert_frame_equal(state.get_flags('DE110010'), ingested)
+    assert state.summary.loc['DE110010', 'q_sentinel'] == 3
+
+
+def test_update_flags_migrates_old_files(state):
+    # put sentinels back, as in files saved before normalization
+    path = os.path.join(state.output_path, 'DE110010', 'DE110010_data.csv')
+    data = pd.read_csv(path)
+    data.loc[10:11, 'w'] = -999
+    data.to_csv(path, index=False, na_rep='NaN')
+    os.remove(os.path.join(state.output_path, 'DE110010', 'DE110010_flags.csv'))
+
+    summary = state.update_flags()
+    assert (summary.status == 'ok').all()
+    assert not (pd.read_csv(path)[['q', 'w']] == -999).any().any()
+    assert sentinel_counts(state.get_flags('DE110010')) == {'w': 2}
+
+    # sentinels already in the table are kept
+    assert sentinel_counts(state.get_flags('DE110000')) == {'q': 3}
+
+
+def test_get_flags_by_provider_id(state):
+    with pytest.warns(UserWarning):
+        by_provider = state.get_flags('DE1p0')
+    assert len(by_provider) > 0
+    pd.testing.assert_frame_equal(by_provider, state.get_flags('DE110000'))
@@ -0,0 +1,130 @@
+import numpy as np
+import shapely
+from scipy import sparse
+
+from camelsp.forcing import _catchment_means, _polygon_weights
+
+
+def _naive_means(weights: sparse.csr_matrix, fields: np.ndarray) -> np.ndarray:
+    W = weights.toarray()
+    means = np.empty((fields.shape[0], W.shape[0]))
+    for t, field in enumerate(fields.reshape(fields.shape[0], -1)):
+        valid = ~np.isnan(field)
+        means[t] = (W[:, valid] @ field[valid]) / W[:, valid].sum(axis=1)
+    return means
+
+
+def _random_weights(n: int, n_cells: int, seed: int = 0) -> sparse.csr_matrix:
+    rng = np.random.default_rng(seed)
+    W = rng.random((n, n_cells)) * (rng.random((n, n_cells)) > .7)
+    return sparse.csr_matrix(W / W.sum(axis=1, keepdims=True))
+
+
+def test_polygon_weights():
+    x, y = np.arange(0.5, 10), np.arange(0.5, 10)
+    cells, weights = _polygon_weights(shapely.box(1, 1, 3, 2), x, y)
+    assert sorted(cells.tolist()) == [11, 12]
+    np.testing.assert_allclose(weights, [.5, .5])
+
+    cells, weights = _polygon_weights(shapely.box(20, 20, 21, 21), x, y)
+    assert cells.size == 0 and weights.size == 0
+
+
+def test_catchment_means_static_mask():
+    rng = np.random.default_rng(1)
+    weights = _random_weights(4, 30)
+    fields = rng.random((10, 5, 6)).astype(np.float32)
+    fields[:, 0, :2] = np.nan
+    expected = _naive_means(weights, fields.astype(float))
+
+    norms = {}
+    means = _catchment_means(weights, fields.copy(), norms=norms)
+    assert means.dtype == np.float32 and means.shape == (10, 4)
+    np.testing.assert_allclose(means, expected, rtol=1e-5)
+    assert len(norms) == 1
+
+    # the cached valid weights are used for the next chunk
+    means = _catchment_means(weights, fields.copy(), norms=norms)
+    np.testing.assert_allclose(means, expected, rtol=1e-5)
+    assert len(norms) == 1
+
+
+def test_catchment_means_changing_mask():
+    rng = np.random.default_rng(2)
+    weights = _random_weights(3, 20)
+    fields = rng.random((6, 4, 5))
+    fields[rng.random(fields.shape) > .8] = np.nan
+    expected = _naive_means(weights, fields)
+
+    norms = {}
+    means = _catchment_means(weights, fields.copy(), norms=norms)
+    np.testing.assert_allclose(means, expected)
+    assert len(norms) == 0
+
+
+def test_catchment_means_all_missing():
+    weights = _random_weights(2, 4)
+    fields = np.full((3, 2, 2), np.nan)
+    assert np.isnan(_catchment_means(weights, fields)).all()
+
+
+def test_extract_chunk(tmp_path):
+    import pandas as pd
+    import xarray as xr
+    from camelsp import forcing
+
+    rng = np.random.default_rng(3)
+    fields = rng.random((8, 4, 5)).astype(np.float32)
+    fields[:, 0, 0] = np.nan
+    ds = xr.Dataset({'pr': (('time', 'y', 'x'), fields)}, coords={'time': pd.date_range('2000-01-01', periods=8), 'y': np.arange(4.), 'x': np.arange(5.)})
+    fname = str(tmp_path / 'pr_hyras_test.nc')
+    ds.to_netcdf(fname)
+
+    weights = _random_weights(3, 20)
+    forcing._init_worker(weights)
+    dates, means = forcing._extract_chunk(fname, 'pr', 2, 6)
+    np.testing.assert_array_equal(dates, ds.time.values[2:6])
+    assert means.dtype == np.float32
+    np.testing.assert_allclose(means, _naive_means(weights, fields[2:6].astype(float)), rtol=1e-5)
+
+
+def _save_catchment(base_path: str, camels_id: str, polygon, datasource: str = 'merit_hydro'):
+    import os
+    import geopandas as gpd
+
+    folder = os.path.join(base_path, camels_id[:3], camels_id)
+    os.makedirs(folder, exist_ok=True)
+    gpd.GeoDataFrame(geometry=[polygon], crs='EPSG:4326').to_file(os.path.join(folder, f'{camels_id}_merit_hydro_catchment.geojson'), driver='GeoJSON')
+
+
+def test_catchment_weights_cache(output_dir, tmp_path, monkeypatch):
+    import os
+    import time
+    import pytest
+    from camelsp import forcing
+
+    x, y = np.arange(0.5, 10), np.arange(0.5, 10)
+    _save_catchment(output_dir, 'DE110000', shapely.box(1, 1, 3, 2))
+    _save_catchment(output_dir, 'DE110010', shapely.box(5, 5, 6, 6))
+    ids = ['DE110000', 'DE110010', 'DE110020']
+
+    with pytest.warns(UserWarning, match='DE110020;NoCatchment'):
+        weights, found = forcing.catchment_weights(x, y, 'EPSG:4326', 'merit_hydro', camels_ids=ids, hyras_path=str(tmp_path), base_path=output_dir)
+    assert found == ['DE110000', 'DE110010']
+    assert sorted(weights[0].indices.tolist()) == [11, 12]
+    np.testing.assert_allclose(weights.sum(axis=1), 1)
+
+    # the cache is used, while no catchment changed
+    calls = []
+    polygon_weights = forcing._polygon_weights
+    monkeypatch.setattr(forcing, '_polygon_weights', lambda *args: calls.append(1) or polygon_weights(*args))
+    cached, _ = forcing.catchment_weights(x, y, 'EPSG:4326', 'merit_hydro', camels_ids=ids[:2], hyras_path=str(tmp_path), base_path=output_dir)
+    assert len(calls) == 0
+    assert (cached != weights).nnz == 0
+
+    # a changed geometry invalidates the cache
+    time.sleep(0.01)
+    _save_catchment(output_dir, 'DE110000', shapely.box(2, 2, 3, 3))
+    weights, _ = forcing.catchment_weights(x, y, 'EPSG:4326', 'merit_hydro', camels_ids=ids[:2], hyras_path=str(tmp_path), base_path=output_dir)
+    assert len(calls) == 2
+    assert weights[0].indices.tolist() == [22]
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from camelsp import Bundesland, get_full_nuts_mapping
+
+
+def test_save_raw_metadata(output_dir):
+    with Bundesland('DE1') as bl:
+        bl.save_raw_metadata(pd.DataFrame({'pid': ['a', 'b']}), 'pid')
+        assert [m['nuts_id'] for m in bl.nuts_mapping] == ['DE110000', 'DE110010']
+
+        # unchanged stations keep their ids, new ones are appended
+        diff = bl.diff_raw_metadata(pd.DataFrame({'pid': ['a', 'b', 'c']}), 'pid')
+        assert diff.set_index('nuts_id').status.to_dict() == {'DE110000': 'unchanged', 'DE110010': 'unchanged', 'DE110020': 'added'}
+
+
+def test_update_nuts_mapping_default_drop(output_dir):
+    with Bundesland('DE1') as bl:
+        bl._update_nuts_mapping([{'nuts_id': 'DE110000', 'provider_id': 'a', 'path': './DE1/DE110000/DE110000_data.csv'}])
+        bl._update_nuts_mapping([{'nuts_id': 'DE110010', 'provider_id': 'b', 'path': './DE1/DE110010/DE110010_data.csv'}])
+        assert [m['nuts_id'] for m in bl.nuts_mapping] == ['DE110010', 'DE110000']
+
+        bl._update_nuts_mapping([], drop=['DE110000'])
+        assert [m['nuts_id'] for m in bl.nuts_mapping] == ['DE110010']
+    
+    assert [m['nuts_id'] for m in get_full_nuts_mapping(output_dir) if len(m) > 0] == ['DE110010']
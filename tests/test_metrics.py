@@ -0,0 +1,65 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from camelsp.metrics import valid_intervals, gauge_density, export_gauge_density
+from conftest import make_state
+
+
+def test_valid_intervals_empty():
+    starts, ends = valid_intervals(np.array([], dtype='datetime64[D]'), np.array([]))
+    assert starts.size == 0 and ends.size == 0
+
+    # only invalid values
+    starts, ends = valid_intervals(np.array(['2000-01-01', '2000-01-02'], dtype='datetime64[D]'), np.array([np.nan, -999]))
+    assert starts.size == 0 and ends.size == 0
+
+
+def test_valid_intervals():
+    dates = np.array(['2000-01-01', '2000-01-02', '2000-01-02', '2000-01-03', '2000-01-04', '2000-01-06'], dtype='datetime64[D]')
+    values = np.array([1., 2., 2., np.nan, 4., 5.])
+    starts, ends = valid_intervals(dates, values)
+
+    day = lambda d: np.datetime64(d, 'D').astype(np.int64)
+    np.testing.assert_array_equal(starts, [day('2000-01-01'), day('2000-01-04'), day('2000-01-06')])
+    np.testing.assert_array_equal(ends, [day('2000-01-02'), day('2000-01-04'), day('2000-01-06')])
+
+
+def test_gauge_density_empty(output_dir):
+    density = gauge_density('q', base_path=output_dir, executor='serial')
+    assert len(density) == 0
+
+
+def test_gauge_density(output_dir):
+    make_state('DE1', n=2)
+    make_state('DE2', n=1)
+
+    density = gauge_density('q', base_path=output_dir, executor='serial')
+    assert density.index[0] == pd.Timestamp('2000-01-01')
+    assert len(density) == 400
+
+    # the gap and sentinels of DE110000 reduce the count by one
+    expected = np.full(400, 3)
+    expected[100:110] = 2
+    expected[200:203] = 2
+    np.testing.assert_array_equal(density.values, expected)
+
+    # the same result from the process pool and resampled
+    pd.testing.assert_series_equal(gauge_density('q', base_path=output_dir, executor='process'), density)
+    monthly = gauge_density('q', freq='MS', base_path=output_dir, executor='serial')
+    assert monthly.iloc[0] == 3.
+
+
+def test_export_gauge_density(output_dir):
+    make_state('DE1', n=2)
+    q = gauge_density('q', base_path=output_dir, executor='serial')
+    w = gauge_density('w', base_path=output_dir, executor='serial')
+
+    path = export_gauge_density(base_path=output_dir, q_density=q, w_density=w)
+    assert path == os.path.join(output_dir, 'metrics', 'gauge_density.plotly.json')
+    with open(path) as f:
+        fig = json.load(f)
+    assert [trace['name'] for trace in fig['data']] == ['Q gauges', 'W gauges']
+    assert os.path.exists(os.path.join(output_dir, 'metrics', 'gauge_density.description.json'))
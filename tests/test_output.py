@@ -0,0 +1,24 @@
+import os
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+
+def test_scatter_plot_ignores_old_sentinels(state):
+    # a data file saved before sentinels were replaced on ingest
+    path = os.path.join(state.output_path, 'DE110010', 'DE110010_data.csv')
+    data = pd.read_csv(path)
+    data.loc[0:4, ['q', 'w']] = -999
+    data.to_csv(path, index=False, na_rep='NaN')
+    os.remove(os.path.join(state.output_path, 'DE110010', 'DE110010_flags.csv'))
+
+    fig = state._generate_scatter_plot('DE110010', 'object', None, 'raise')
+    offsets = fig.axes[0].collections[0].get_offsets()
+    # NaN points are masked, the sentinels must not be plotted
+    masked = np.ma.getmaskarray(offsets).any(axis=1)
+    assert masked[:5].all() and not masked[5:].any()
+    assert offsets.min() > -999
+    plt.close(fig)
@@ -0,0 +1,87 @@
+import os
+import json
+import hashlib
+import zipfile
+import tarfile
+
+import pytest
+
+from camelsp.release import build_release, release_parts
+from camelsp.__main__ import main
+
+
+def _sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_release_empty(output_dir, tmp_path):
+    summary = build_release(release_path=str(tmp_path), base_path=output_dir, extras=False, executor='serial')
+    assert len(summary) == 0
+    with open(tmp_path / 'manifest.json') as f:
+        assert json.load(f)['archives'] == {}
+
+    with pytest.raises(ValueError):
+        build_release(release_path=str(tmp_path), base_path=output_dir, fmt='rar')
+
+
+def test_release_roundtrip(state, tmp_path):
+    summary = build_release(release_path=str(tmp_path), base_path=state.base_path, executor='serial')
+    assert summary.loc['DE1', 'status'] == 'written'
+    assert 'metadata' in summary.index
+
+    # the archive holds all files of the state with their relative paths
+    parts = release_parts(base_path=state.base_path)
+    with zipfile.ZipFile(tmp_path / 'DE1.zip') as archive:
+        names = sorted(archive.namelist())
+        assert names == sorted(os.path.relpath(f, state.base_path) for f in parts['DE1'])
+        data = 'DE1/DE110000/DE110000_data.csv'
+        with open(os.path.join(state.base_path, data), 'rb') as f:
+            assert archive.read(data) == f.read()
+
+    # the manifest and checksums match the archives
+    with open(tmp_path / 'manifest.json') as f:
+        manifest = json.load(f)
+    assert manifest['archives']['DE1']['sha256'] == _sha256(tmp_path / 'DE1.zip')
+    with open(tmp_path / 'SHA256SUMS') as f:
+        assert f"{_sha256(tmp_path / 'DE1.zip')}  DE1.zip\n" in f.read()
+
+
+def test_release_excludes_temporary_files(state, tmp_path):
+    # a report and a plot, that are being written by util.atomic_path
+    for folder, fname in (('reports', 'DE110000.1234.tmp.html'), ('scatter_plots', 'DE110000.1234.tmp.png'), ('DE1', 'DE110000/DE110000_data.1234.tmp.csv')):
+        path = os.path.join(state.base_path, folder, fname)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('half-written')
+    with open(os.path.join(state.base_path, 'reports', 'DE110010.html'), 'w') as f:
+        f.write('complete')
+
+    build_release(release_path=str(tmp_path), base_path=state.base_path, executor='serial')
+    with zipfile.ZipFile(tmp_path / 'reports.zip') as archive:
+        assert archive.namelist() == ['reports/DE110010.html']
+    assert not (tmp_path / 'scatter_plots.zip').exists()
+    with zipfile.ZipFile(tmp_path / 'DE1.zip') as archive:
+        assert not any('.tmp.' in name for name in archive.namelist())
+
+    with open(tmp_path / 'manifest.json') as f:
+        manifest = json.load(f)
+    assert not any('.tmp.' in name for part in manifest['archives'].values() for name in part['files'])
+
+
+def test_release_skips_unchanged_parts(state, tmp_path):
+    build_release(release_path=str(tmp_path), base_path=state.base_path, extras=False, executor='serial')
+    summary = build_release(release_path=str(tmp_path), base_path=state.base_path, extras=False, executor='serial')
+    assert summary.loc['DE1', 'status'] == 'unchanged'
+
+    # a changed file triggers a new archive
+    with open(os.path.join(state.base_path, 'DE1', 'DE110000', 'extra.txt'), 'w') as f:
+        f.write('changed')
+    summary = build_release(release_path=str(tmp_path), base_path=state.base_path, extras=False, executor='serial')
+    assert summary.loc['DE1', 'status'] == 'written'
+
+
+def test_release_cli(state, tmp_path):
+    assert main(['release', '-o', str(tmp_path), '-b', state.base_path, '-s', 'DE1', '-f', 'tar.gz', '--no-extras', '-e', 'serial']) == 0
+    with tarfile.open(tmp_path / 'DE1.tar.gz') as archive:
+        assert 'DE1/DE110010/DE110010_data.csv' in archive.getnames()
@@ -0,0 +1,67 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from camelsp.report import native_report, render_html
+
+
+def test_native_report_empty():
+    report = native_report(pd.DataFrame({'date': pd.to_datetime([]), 'q': [], 'q_flag': []}), 'DE110000')
+    assert report['table']['n'] == 0 and report['table']['start'] is None
+    assert report['variables']['q']['count'] == 0
+    assert report['variables']['q']['mean'] is None
+    assert report['flags']['q_flag']['p_true'] is None
+
+    # still serializable and renderable
+    json.dumps(report)
+    assert 'DE110000' in render_html(report)
+
+
+def test_native_report_values():
+    dates = pd.date_range('2000-01-01', periods=10, freq='D')
+    q = np.array([1., 2., np.nan, -999, 5., 6., 7., 8., 9., 10.])
+    w = q * 2 + 1
+    flags = pd.array([True, True, False, None, True, True, True, True, True, False], dtype='boolean')
+    report = native_report(pd.DataFrame({'date': dates, 'q': q, 'w': w, 'q_flag': flags}), 'DE110000', bins=5)
+
+    valid = q[~np.isnan(q) & (q != -999)]
+    s = report['variables']['q']
+    assert s['count'] == 8 and s['n_missing'] == 1 and s['n_sentinel'] == 1
+    assert s['mean'] == pytest.approx(valid.mean())
+    assert s['std'] == pytest.approx(valid.std(ddof=1))
+    assert s['quantiles']['50%'] == pytest.approx(np.median(valid))
+    assert (s['n_gaps'], s['longest_gap']) == (1, 2)
+    assert sum(s['histogram']['counts']) == 8
+
+    assert report['flags']['q_flag'] == dict(n=10, n_true=7, n_false=2, n_missing=1, p_true=7 / 9)
+
+    # correlations in the ydata_profiling structure
+    assert report['correlations']['pearson'][0]['w'] == pytest.approx(1.)
+    spearman = stats.spearmanr(valid, valid * 2 + 1).statistic
+    assert report['correlations']['spearman'][1]['q'] == pytest.approx(spearman)
+
+
+def test_generate_native_reports(state):
+    summary = state.generate_reports(fmt='json', report_engine='native', executor='serial')
+    assert (summary.error.isna()).all()
+
+    with open(os.path.join(state.base_path, 'reports', 'DE110000.json')) as f:
+        report = json.load(f)
+    # the sentinels replaced on ingest are counted from the flag table
+    assert report['variables']['q']['n_sentinel'] == 3
+    assert report['variables']['q']['n_missing'] == 10
+    assert report['variables']['q']['count'] == 387
+
+    reports = state.generate_reports(fmt='object', report_engine='native')
+    assert [r['analysis']['title'] for r in reports] == ['DE110000', 'DE110010']
+
+
+def test_native_report_with_flag_table_counts():
+    dates = pd.date_range('2000-01-01', periods=4, freq='D')
+    report = native_report(pd.DataFrame({'date': dates, 'q': [1., np.nan, np.nan, 4.]}), 'DE110000', sentinels={'q': 1})
+    q = report['variables']['q']
+    assert (q['count'], q['n_missing'], q['n_sentinel']) == (2, 1, 1)
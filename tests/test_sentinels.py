@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from camelsp import build_cube, open_cube
+from camelsp.flags import has_flag_table, flags_path
+from camelsp.metrics import gauge_density
+from camelsp.report import native_report
+from camelsp.summary import summarize_timeseries
+
+
+def _legacy(state, camels_id: str = 'DE110010') -> str:
+    """Turn a station into data saved before sentinels were replaced on ingest: -999 in the file and no flag table."""
+    path = os.path.join(state.output_path, camels_id, f'{camels_id}_data.csv')
+    data = pd.read_csv(path)
+    data.loc[0:4, 'q'] = -999
+    data.to_csv(path, index=False, na_rep='NaN')
+    os.remove(flags_path(path))
+    return path
+
+
+def test_has_flag_table(state):
+    path = os.path.join(state.output_path, 'DE110000', 'DE110000_data.csv')
+    assert flags_path(path) == os.path.join(state.output_path, 'DE110000', 'DE110000_flags.csv')
+    assert has_flag_table(path)
+    assert not has_flag_table(_legacy(state))
+
+
+def test_legacy_files_are_searched(state):
+    _legacy(state)
+
+    # summary
+    state.update_summary()
+    summary = state.summary
+    assert summary.loc['DE110010', 'q_sentinel'] == 5
+    assert summary.loc['DE110010', 'q_count'] == 395
+    assert summary.loc['DE110000', 'q_sentinel'] == 3
+
+    # cube
+    build_cube('q', base_path=state.base_path)
+    assert np.isnan(open_cube('q', base_path=state.base_path).station('DE110010')[:5]).all()
+
+    # density
+    density = gauge_density('q', base_path=state.base_path, executor='serial')
+    assert density.iloc[0] == 1 and density.iloc[5] == 2
+
+
+def test_flag_table_counts_are_used():
+    data = pd.DataFrame({'date': pd.date_range('2000-01-01', periods=3), 'q': [1., np.nan, 3.]})
+    record = summarize_timeseries(data, 'DE110000', sentinels={'q': 1})
+    assert (record['q_count'], record['q_nan'], record['q_sentinel']) == (2, 0, 1)
+
+    # without flag table, the values are searched
+    data.loc[1, 'q'] = -999
+    record = summarize_timeseries(data, 'DE110000')
+    assert (record['q_count'], record['q_nan'], record['q_sentinel']) == (2, 0, 1)
+    assert native_report(data, 'DE110000')['variables']['q']['n_sentinel'] == 1
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from camelsp.signatures import SIGNATURES, calculate_signatures, lyne_hollick, station_signatures
+from camelsp.util import get_metadata
+
+
+def test_calculate_signatures_empty():
+    result = calculate_signatures(np.empty((0, 0)), pd.DatetimeIndex([]), [])
+    assert len(result) == 0
+    assert result.columns.tolist() == list(SIGNATURES.keys())
+
+    with pytest.raises(ValueError):
+        calculate_signatures(np.empty((0, 0)), pd.DatetimeIndex([]), [], signatures=['unknown'])
+
+
+def test_constant_discharge():
+    dates = pd.date_range('2000-11-01', '2002-10-31', freq='D')
+    Q = np.ones((2, len(dates)))
+    Q[1, 30:] = np.nan
+
+    result = calculate_signatures(Q, dates, ['a', 'b'], min_days=365)
+    a = result.loc['a']
+    assert a.q_mean == 1. and a.q5 == 1. and a.q95 == 1.
+    assert a.baseflow_index == pytest.approx(1.)
+    assert a.zero_q_freq == 0. and a.high_q_freq == 0.
+    assert np.isnan(a.high_q_dur)
+    assert a.hfd_mean == pytest.approx(182, abs=1)
+
+    # too little data
+    assert result.loc['b'].isna().all()
+
+
+def test_lyne_hollick():
+    rng = np.random.default_rng(0)
+    Q = rng.gamma(2, 2, (3, 200))
+    Q[1, 50:60] = np.nan
+
+    baseflow = lyne_hollick(Q)
+    assert baseflow.shape == Q.shape
+    valid = ~np.isnan(Q)
+    assert (baseflow[valid] <= Q[valid] + 1e-9).all()
+    assert (baseflow[valid] >= 0).all()
+
+    # gaps stay missing and the filter restarts after them
+    assert np.isnan(baseflow[1, 50:60]).all()
+    assert not np.isnan(baseflow[1, 60:]).any()
+
+
+def test_station_signatures_empty(output_dir):
+    result = station_signatures(base_path=output_dir, executor='serial')
+    assert len(result) == 0
+
+
+def test_station_signatures(state):
+    result = station_signatures(signatures=['q_mean', 'q95'], base_path=state.base_path, executor='serial')
+    assert result.index.tolist() == ['DE110000', 'DE110010']
+
+    # sentinels are not used
+    q = state.get_data('DE110000')['q'].replace(-999, np.nan)
+    assert result.loc['DE110000', 'q_mean'] == pytest.approx(q.mean(), rel=1e-5)
+
+    # the signatures were added to the metadata
+    meta = get_metadata(base_path=state.base_path).set_index('camels_id')
+    assert meta.loc['DE110010', 'q95'] == pytest.approx(result.loc['DE110010', 'q95'])
+
+    # the cube gives the same result
+    cube = station_signatures(signatures=['q_mean', 'q95'], base_path=state.base_path, executor='serial', use_cube=True, save=False)
+    pd.testing.assert_frame_equal(cube, result, rtol=1e-5)
@@ -0,0 +1,120 @@
+import os
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from camelsp.store import MetadataStore
+from camelsp.executor import run, ProcessExecutor
+
+
+def _record(nuts_id: str, provider_id: str) -> dict:
+    return dict(nuts_id=nuts_id, provider_id=provider_id, path=f'./{nuts_id[:3]}/{nuts_id}/{nuts_id}_data.csv')
+
+
+def _seed(n: int = 3) -> pd.DataFrame:
+    return pd.DataFrame({
+        'camels_id': [f'DE1100{i}0' for i in range(n)],
+        'provider_id': [f'p{i}' for i in range(n)],
+        'nuts_lvl2': 'DE1',
+        'area': np.arange(n, dtype=float),
+    })
+
+
+def _update_area(base_path: str, camels_id: str, area: float):
+    MetadataStore(base_path).update_metadata(pd.DataFrame({'camels_id': [camels_id], 'area': [area]}), id_column='camels_id')
+
+
+def test_empty_store(output_dir):
+    store = MetadataStore(output_dir)
+    assert store.get_nuts_mapping() == []
+    assert store.lookup('DE110000') is None
+    assert not store.has_metadata()
+    with pytest.raises(RuntimeError):
+        store.update_metadata(pd.DataFrame({'camels_id': ['DE110000'], 'area': [1.]}), id_column='camels_id')
+
+
+def test_open_half_created_database(output_dir):
+    # another process connected, but did not create the schema yet
+    os.makedirs(os.path.join(output_dir, 'metadata'))
+    sqlite3.connect(os.path.join(output_dir, 'metadata', 'metadata.db')).close()
+
+    store = MetadataStore(output_dir)
+    assert store.get_nuts_mapping() == []
+    store.update_nuts_mapping([_record('DE110000', 'a')])
+    assert MetadataStore(output_dir).lookup('a')['nuts_id'] == 'DE110000'
+
+
+def test_nuts_mapping(output_dir):
+    store = MetadataStore(output_dir)
+    store.update_nuts_mapping([_record('DE110000', 'a'), _record('DE110010', 'b'), _record('DE210000', 'a')])
+    assert [m['nuts_id'] for m in store.get_nuts_mapping(nuts_lvl2='DE1')] == ['DE110000', 'DE110010']
+
+    # lookup by camels_id and provider_id
+    assert store.lookup('DE110010')['provider_id'] == 'b'
+    assert store.lookup('a')['nuts_id'] == 'DE110000'
+
+    # replace in place and drop without an explicit drop list
+    store.update_nuts_mapping([_record('DE110010', 'c')])
+    assert store.lookup('DE110010')['provider_id'] == 'c'
+    assert [m['nuts_id'] for m in store.get_nuts_mapping()] == ['DE110000', 'DE110010', 'DE210000']
+    store.update_nuts_mapping([], drop=['DE110000'])
+    assert [m['nuts_id'] for m in store.get_nuts_mapping()] == ['DE110010', 'DE210000']
+
+
+def test_update_metadata(output_dir):
+    store = MetadataStore(output_dir)
+    store.update_metadata(pd.DataFrame({'camels_id': ['DE110010'], 'area': [np.nan], 'lon': [9.]}), id_column='camels_id', seed=_seed())
+
+    # the seed keeps its order, also when seeded again
+    assert store.get_metadata().camels_id.tolist() == ['DE110000', 'DE110010', 'DE110020']
+    with store.transaction() as conn:
+        store._insert_metadata(conn, _seed().iloc[[1]])
+    assert store.get_metadata().camels_id.tolist() == ['DE110000', 'DE110010', 'DE110020']
+
+    meta = store.get_metadata().set_index('camels_id')
+    assert meta.loc['DE110010', 'area'] == 1.    # NA does not overwrite
+    assert meta.loc['DE110010', 'lon'] == 9.
+    assert np.isnan(meta.loc['DE110000', 'lon'])
+    assert len(store.get_metadata(nuts_lvl2='DE2')) == 0
+
+
+def test_import_and_export_roundtrip(output_dir):
+    # existing flat files are imported on first use
+    os.makedirs(os.path.join(output_dir, 'metadata'))
+    with open(os.path.join(output_dir, 'metadata', 'nuts_mapping.json'), 'w') as f:
+        json.dump([_record('DE110000', 'p0'), _record('DE110010', 'p1')], f)
+    _seed(2).to_csv(os.path.join(output_dir, 'metadata', 'metadata.csv'), index=False)
+
+    store = MetadataStore(output_dir)
+    assert store.lookup('p1')['nuts_id'] == 'DE110010'
+
+    export = os.path.join(output_dir, 'export')
+    paths = store.export(export)
+    assert sorted(os.path.basename(p) for p in paths) == ['metadata.csv', 'nuts_mapping.csv', 'nuts_mapping.json']
+    pd.testing.assert_frame_equal(pd.read_csv(os.path.join(export, 'metadata.csv'), dtype={'provider_id': str}), _seed(2))
+
+
+def test_parallel_writers(output_dir):
+    store = MetadataStore(output_dir)
+    store.update_metadata(_seed(8)[['camels_id']], id_column='camels_id', seed=_seed(8))
+
+    ids = _seed(8).camels_id.tolist()
+    results = run(_update_area, ids, [(output_dir, c, 100. + i) for i, c in enumerate(ids)], executor=ProcessExecutor(max_workers=4))
+    assert all(r.error is None for r in results)
+    assert store.get_metadata().area.tolist() == [100. + i for i in range(8)]
+
+
+def test_bundesland_switches_backend_at_runtime(output_dir, monkeypatch):
+    from camelsp import util, Bundesland
+
+    monkeypatch.setattr(util, 'METADATA_BACKEND', 'sqlite')
+    with Bundesland('DE1') as bl:
+        bl._update_nuts_mapping([_record('DE110000', 'a')])
+
+        # the mapping went into the database, not the json file
+        assert MetadataStore(bl.base_path).lookup('a')['nuts_id'] == 'DE110000'
+        assert not os.path.exists(os.path.join(bl.meta_path, 'nuts_mapping.json'))
+        assert [m['nuts_id'] for m in bl.nuts_mapping] == ['DE110000']
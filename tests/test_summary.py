@@ -0,0 +1,63 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from camelsp import Bundesland, get_summary
+from camelsp.executor import run, ProcessExecutor
+from camelsp.summary import summarize_timeseries, read_summary, update_summary_file
+
+
+def _save_station(NUTS: str, provider_id: str, seed: int):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2000-01-01', periods=365, freq='D')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with Bundesland(NUTS) as bl:
+            bl.save_timeseries(pd.DataFrame({'date': dates, 'q': rng.gamma(2, 2, 365), 'flag': True}), provider_id)
+
+
+def test_summarize_timeseries():
+    data = pd.DataFrame({
+        'date': pd.date_range('2000-01-01', periods=6, freq='D'),
+        'q': [1., 2., np.nan, -999., 4., 3.],
+        'w': [10., 20., 30., 40., np.nan, 30.],
+    })
+    record = summarize_timeseries(data, 'DE110000')
+    assert record['q_count'] == 4 and record['q_nan'] == 1 and record['q_sentinel'] == 1
+    assert record['q_start'] == '2000-01-01' and record['q_end'] == '2000-01-06'
+    assert record['q_min'] == 1. and record['q_max'] == 4.
+    assert record['w_count'] == 5
+
+    # sentinels replaced on ingest are NaN, but counted as sentinels
+    data.loc[3, 'q'] = np.nan
+    record = summarize_timeseries(data, 'DE110000', sentinels={'q': 1})
+    assert record['q_nan'] == 1 and record['q_sentinel'] == 1
+
+
+def test_empty_summary(output_dir):
+    assert len(get_summary(base_path=output_dir)) == 0
+
+
+def test_update_summary_file(tmp_path):
+    path = str(tmp_path / 'DE1_summary.json')
+    update_summary_file(path, {'a': {'camels_id': 'a'}})
+    update_summary_file(path, {'b': {'camels_id': 'b'}, 'a': {'camels_id': 'a', 'q_count': 1}})
+    assert read_summary(path) == {'a': {'camels_id': 'a', 'q_count': 1}, 'b': {'camels_id': 'b'}}
+
+
+def test_save_timeseries_updates_summary(state):
+    summary = get_summary()
+    assert summary.index.tolist() == ['DE110000', 'DE110010']
+    assert summary.loc['DE110010', 'q_count'] == 400
+    assert summary.loc['DE110000', 'q_count'] == 387
+
+
+def test_parallel_saves_keep_all_records(output_dir):
+    n = 24
+    with Bundesland('DE2') as bl:
+        bl.save_raw_metadata(pd.DataFrame({'pid': [f'p{i}' for i in range(n)]}), 'pid', overwrite=True)
+
+    results = run(_save_station, [f'p{i}' for i in range(n)], [('DE2', f'p{i}', i) for i in range(n)], executor=ProcessExecutor(max_workers=6))
+    assert all(r.error is None for r in results)
+    assert len(Bundesland('DE2').summary) == n